@@ -1,5 +1,13 @@
 import sys
 
+from file_tags import client
+
+socket_path = client.socket_path_from_env()
+if socket_path and client.can_forward(sys.argv[1:]):
+    exit_code = client.forward(socket_path, sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
 from file_tags import tags
 
 tags.run(sys.argv[1:])
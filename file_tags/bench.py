@@ -0,0 +1,326 @@
+"""
+Throughput benchmarks.
+
+Generates synthetic trees of tagged files and times each processing stage
+separately: path validation, TaggedFile parsing, tag normalization, new name
+computation and renaming. Also times the start-up of a single-file command line
+run and, with --latency, the asyncio pipeline on a simulated high-latency
+filesystem. The results are written as JSON so that runs of different versions can be
+compared.
+
+usage: python -m file_tags.bench [--sizes 10000,100000,1000000] [-o results.json]
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from file_tags import pipeline
+from file_tags import tags as tagger
+from file_tags import util
+
+
+DEFAULT_SIZES = [10_000, 100_000]
+DEFAULT_STARTUP_RUNS = 10
+FILE_TAGS_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "file_tags.py"
+)
+FILES_PER_DIRECTORY = 1000
+# How many files the simulated high-latency filesystem benchmark tags.
+LATENCY_FILE_COUNT = 1000
+TAG_VOCABULARY_SIZE = 300
+MAX_TAGS_PER_FILE = 6
+BASE_NAMES = ["IMG_{:05}", "Picture {:03}", "scan-{}", "notes {}", "track_{:02}"]
+EXTENSIONS = ["jpg", "png", "txt", "pdf", "mp3", ""]
+
+
+def generate_file_names(count: int, seed: int = 0) -> Iterator[str]:
+    """
+    Yield `count` unique file names with a realistic tag distribution: the tag
+    popularity follows Zipf's law, most files carry a couple of tags, some none,
+    and tags are spelled with varying case and separators.
+    """
+    rng = random.Random(seed)
+    vocabulary = [
+        "tag{}-{}".format(i, rng.choice(["a", "b", "long-word", "x-y-z"]))
+        for i in range(TAG_VOCABULARY_SIZE)
+    ]
+    weights = [1 / rank for rank in range(1, TAG_VOCABULARY_SIZE + 1)]
+    for i in range(count):
+        name = rng.choice(BASE_NAMES).format(i)
+        tag_count = min(int(rng.expovariate(0.7)), MAX_TAGS_PER_FILE)
+        tags = rng.choices(vocabulary, weights=weights, k=tag_count)
+        for tag in tags:
+            if rng.random() < 0.1:
+                tag = tag.upper()
+            if rng.random() < 0.05:
+                tag = tag.replace(tagger.TAG_WORD_SEP, tagger.TAG_WORD_SEP * 2)
+            tag = tagger.TAG_START_CHAR + tag
+            if rng.random() < 0.25:
+                name = "{} {}".format(tag, name)
+            else:
+                name = "{} {}".format(name, tag)
+        extension = rng.choice(EXTENSIONS)
+        yield "{}.{}".format(name, extension) if extension else name
+
+
+def generate_tree(
+    root: str,
+    count: int,
+    seed: int = 0,
+    files_per_directory: int = FILES_PER_DIRECTORY,
+) -> List[str]:
+    """
+    Create `count` empty files with generated names under `root`, spread across
+    two levels of directories, and return their paths.
+    """
+    paths = []
+    for i, file_name in enumerate(generate_file_names(count, seed)):
+        directory_index = i // files_per_directory
+        directory = os.path.join(
+            root,
+            "d{:03}".format(directory_index // 100),
+            "d{:05}".format(directory_index),
+        )
+        if i % files_per_directory == 0:
+            os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, file_name)
+        with open(path, "w"):
+            pass
+        paths.append(path)
+    return paths
+
+
+class Stage(NamedTuple):
+    name: str
+    item_count: int
+    seconds: float
+
+    def as_dict(self) -> Dict:
+        return {
+            "items": self.item_count,
+            "seconds": round(self.seconds, 6),
+            "items_per_second": round(self.item_count / self.seconds, 1)
+            if self.seconds
+            else None,
+        }
+
+
+def _timed(name: str, item_count: int, function: Callable, *args) -> Tuple[Stage, Any]:
+    start = time.perf_counter()
+    result = function(*args)
+    return Stage(name, item_count, time.perf_counter() - start), result
+
+
+def benchmark_tree(root: str, count: int, seed: int = 0) -> List[Stage]:
+    """
+    Generate a tree of `count` files under `root` and time each stage on it.
+    The tree gets renamed by the last stage.
+    """
+    paths = generate_tree(root, count, seed)
+    stages = []
+
+    stage, paths = _timed("validate_paths", count, util.validate_paths, paths)
+    stages.append(stage)
+
+    stage, tagged_files = _timed(
+        "parse", count, lambda: [tagger.TaggedFile(path) for path in paths]
+    )
+    stages.append(stage)
+
+    raw_tag_names = [
+        match
+        for tagged_file in tagged_files
+        for match in tagger.TAG_PATTERN.findall(tagged_file.name)
+    ]
+
+    stage, _ = _timed(
+        "normalize_tags",
+        len(raw_tag_names),
+        lambda: tagger.normalize_tag_names(raw_tag_names),
+    )
+    stages.append(stage)
+
+    tag = tagger.Tag("benchmark")
+    for tagged_file in tagged_files:
+        tagged_file.add_tag(tag)
+    stage, _ = _timed(
+        "new_name",
+        count,
+        lambda: [tagged_file.new_name for tagged_file in tagged_files],
+    )
+    stages.append(stage)
+
+    stage, _ = _timed("rename_files", count, tagger.rename_files, tagged_files)
+    stages.append(stage)
+    return stages
+
+
+def benchmark_startup(runs: int = DEFAULT_STARTUP_RUNS) -> Dict:
+    """
+    Time `runs` single-file dry runs of the command line tool against the bare
+    interpreter start-up, reporting the medians.
+    """
+
+    def median_run_seconds(command: List[str]) -> float:
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(
+                command,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    with tempfile.TemporaryDirectory(prefix="file_tags_bench_") as directory:
+        file_path = os.path.join(directory, "file.jpg")
+        with open(file_path, "w"):
+            pass
+        interpreter_seconds = median_run_seconds([sys.executable, "-c", "pass"])
+        command_seconds = median_run_seconds(
+            [sys.executable, FILE_TAGS_SCRIPT, "add", "tag", file_path, "-n"]
+        )
+    return {
+        "runs": runs,
+        "interpreter_seconds": round(interpreter_seconds, 6),
+        "command_seconds": round(command_seconds, 6),
+        "overhead_seconds": round(command_seconds - interpreter_seconds, 6),
+    }
+
+
+def benchmark_latency(
+    directory: str,
+    count: int,
+    latency: float,
+    concurrencies: Iterable[int] = (1, pipeline.DEFAULT_CONCURRENCY),
+) -> Dict:
+    """
+    Time tagging `count` files through `pipeline` with `latency` seconds added
+    to every filesystem call, once per concurrency.
+    """
+    file_system = pipeline.LatencyFileSystem(latency)
+
+    def add_tag(tagged_file: tagger.TaggedFile) -> None:
+        tagged_file.add_tag(tagger.intern_tag("benchmark"))
+
+    def tag_files(paths: List[str], concurrency: int) -> int:
+        changed_files, _ = pipeline.collect_changes(
+            paths, add_tag, file_system, concurrency
+        )
+        rename_plan = pipeline.plan_renames(
+            changed_files.planned_renames(), file_system, concurrency
+        )
+        return pipeline.execute_plan(rename_plan, file_system, concurrency)
+
+    results = {}
+    for concurrency in concurrencies:
+        root = tempfile.mkdtemp(prefix="file_tags_bench_", dir=directory)
+        try:
+            paths = generate_tree(root, count)
+            stage, _ = _timed("pipeline", count, tag_files, paths, concurrency)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        results[str(concurrency)] = stage.as_dict()
+    return {"latency_seconds": latency, "count": count, "concurrency": results}
+
+
+def run_benchmarks(
+    sizes: Iterable[int],
+    seed: int = 0,
+    directory: Optional[str] = None,
+    startup_runs: int = 0,
+    latency: float = 0.0,
+) -> Dict:
+    results = []
+    for size in sizes:
+        root = tempfile.mkdtemp(prefix="file_tags_bench_", dir=directory)
+        try:
+            stages = benchmark_tree(root, size, seed)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        results.append(
+            {"size": size, "stages": {stage.name: stage.as_dict() for stage in stages}}
+        )
+    benchmark_results = {
+        "version": tagger.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "results": results,
+    }
+    if startup_runs:
+        benchmark_results["startup"] = benchmark_startup(startup_runs)
+    if latency:
+        benchmark_results["latency"] = benchmark_latency(
+            directory, LATENCY_FILE_COUNT, latency
+        )
+    return benchmark_results
+
+
+def main(command_line_args: List) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m file_tags.bench",
+        formatter_class=argparse.RawTextHelpFormatter,
+        description=__doc__,
+    )
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="comma separated tree sizes to benchmark (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--startup-runs",
+        metavar="N",
+        type=int,
+        default=DEFAULT_STARTUP_RUNS,
+        help="how many times to time the command line start-up, 0 to skip "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--latency",
+        metavar="SECONDS",
+        type=float,
+        default=0.0,
+        help="also time the asyncio pipeline with SECONDS added to every "
+        "filesystem call, serially and concurrently (default: skipped)",
+    )
+    parser.add_argument(
+        "--directory",
+        help="where to generate the trees (default: the system temp directory)",
+    )
+    parser.add_argument(
+        "-o", "--output", help="write the JSON results to a file instead of stdout"
+    )
+    parsed = parser.parse_args(command_line_args)
+
+    results = run_benchmarks(
+        [int(size) for size in parsed.sizes.split(",")],
+        seed=parsed.seed,
+        directory=parsed.directory,
+        startup_runs=parsed.startup_runs,
+        latency=parsed.latency,
+    )
+    if parsed.output:
+        with open(parsed.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,42 @@
+import os
+
+from file_tags import bench
+from file_tags import tags as tagger
+
+
+def test_generate_tree(tmp_path):
+    paths = bench.generate_tree(str(tmp_path), 50, files_per_directory=20)
+    assert len(paths) == len(set(paths)) == 50
+    assert all(os.path.isfile(path) for path in paths)
+    assert len({os.path.dirname(path) for path in paths}) == 3
+    assert any(tagger.TaggedFile(path).tags for path in paths)
+
+    # Generation is deterministic.
+    assert list(bench.generate_file_names(50)) == [
+        os.path.basename(path) for path in paths
+    ]
+
+
+def test_run_benchmarks(tmp_path):
+    results = bench.run_benchmarks([30], directory=str(tmp_path))
+    assert [result["size"] for result in results["results"]] == [30]
+    assert set(results["results"][0]["stages"]) == {
+        "validate_paths",
+        "parse",
+        "normalize_tags",
+        "new_name",
+        "rename_files",
+    }
+    # The generated trees get cleaned up.
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_benchmark_startup():
+    results = bench.benchmark_startup(runs=1)
+    assert results["command_seconds"] > 0
+
+
+def test_benchmark_latency(tmp_path):
+    results = bench.benchmark_latency(str(tmp_path), 20, 0.001, concurrencies=(1, 4))
+    assert set(results["concurrency"]) == {"1", "4"}
+    assert os.listdir(str(tmp_path)) == []
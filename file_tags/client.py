@@ -0,0 +1,78 @@
+"""
+Thin client forwarding command lines to a running `serve` process.
+
+The socket and json modules are only imported when forwarding, so forwarding a
+command costs a fraction of starting up the full command line tool.
+"""
+
+from typing import List, Optional
+import os
+import sys
+
+
+DEFAULT_SOCKET_PATH = "~/.cache/file_tags/server.sock"
+# When set, file_tags.py forwards its command line to the server at this path.
+SOCKET_ENV_VAR = "FILE_TAGS_SOCKET"
+# Commands that run until they're stopped, which would keep the server busy.
+LOCAL_ONLY_COMMANDS = {"serve", "watch"}
+# Options that need the client's terminal or stdin, always handled locally.
+LOCAL_ONLY_ARGS = {"-i", "--interactive", "--from-stdin", "-0", "--null"}
+
+
+def socket_path_from_env() -> Optional[str]:
+    path = os.environ.get(SOCKET_ENV_VAR)
+    if not path:
+        return None
+    return os.path.expanduser(path)
+
+
+def can_forward(command_line_args: List[str]) -> bool:
+    if not command_line_args or command_line_args[0] in LOCAL_ONLY_COMMANDS:
+        return False
+    return not any(
+        arg in LOCAL_ONLY_ARGS
+        # Abbreviated long options, which argparse accepts, e.g. "--inter".
+        or (
+            arg.startswith("--")
+            and len(arg) > 2
+            and any(local_arg.startswith(arg) for local_arg in LOCAL_ONLY_ARGS)
+        )
+        # Combined short options, e.g. "-ni".
+        or (
+            arg.startswith("-")
+            and not arg.startswith("--")
+            and ("i" in arg[1:] or "0" in arg[1:])
+        )
+        for arg in command_line_args
+    )
+
+
+def forward(socket_path: str, command_line_args: List[str]) -> Optional[int]:
+    """
+    Run `command_line_args` on the server listening at `socket_path`, relaying
+    its output to stdout/stderr.
+
+    Returns the command's exit code, or None when the server can't be reached.
+    """
+    import json
+    import socket
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except OSError:
+        client.close()
+        return None
+    with client, client.makefile("rb") as responses:
+        request = {"args": command_line_args, "cwd": os.getcwd()}
+        client.sendall(json.dumps(request).encode() + b"\n")
+        client.shutdown(socket.SHUT_WR)
+        for line in responses:
+            response = json.loads(line)
+            if "exit_code" in response:
+                return response["exit_code"]
+            stream = sys.stdout if response["stream"] == "stdout" else sys.stderr
+            stream.write(response["data"])
+            stream.flush()
+    # The server went away mid-command.
+    return 1
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def make_tree():
+    """
+    Creates empty files at the given paths relative to a root, along with their
+    directories, and returns their full paths.
+    """
+
+    def make_tree(root, relative_paths):
+        paths = []
+        for relative_path in relative_paths:
+            path = os.path.join(str(root), relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w"):
+                pass
+            paths.append(path)
+        return paths
+
+    return make_tree
+
+
+@pytest.fixture
+def tree_names():
+    """
+    Returns the sorted paths of the files under a root, relative to it.
+    """
+
+    def tree_names(root):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), str(root))
+            for directory, _, names in os.walk(str(root))
+            for name in names
+        )
+
+    return tree_names
@@ -0,0 +1,402 @@
+# pylint: disable=unused-wildcard-import
+from typing import *
+
+import contextlib
+import os
+import sqlite3
+import time
+
+from file_tags import exception
+from file_tags import tags as tagger
+from file_tags import util
+
+
+DEFAULT_INDEX_PATH = "~/.cache/file_tags/index.sqlite3"
+# Directories modified more recently are indexed without recording their mtime,
+# so that later refreshes rescan them, see `util.MIN_MTIME_AGE_NS`.
+MIN_AGE_NS = util.MIN_MTIME_AGE_NS
+# Recorded instead of the mtime of recently modified directories.
+UNSETTLED_MTIME_NS = -1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    parent_id INTEGER,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_parent_id ON directories (parent_id);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    directory_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (directory_id, name)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS file_tags (
+    tag_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    PRIMARY KEY (tag_id, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS file_tags_file_id ON file_tags (file_id);
+"""
+
+
+class RefreshResult(NamedTuple):
+    scanned_directory_count: int
+    skipped_directory_count: int
+    file_count: int
+
+
+class TagIndex:
+    """
+    Persistent mapping of tags to the files carrying them, stored in SQLite.
+
+    Directories are refreshed incrementally: a directory whose mtime hasn't changed
+    since it was last indexed can't have gained, lost or renamed any entries, so
+    its files aren't listed or parsed again and its subdirectories are taken from
+    the index.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH) -> None:
+        self.path = util.normalize_path(path)
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
+            self.connection.executescript(SCHEMA)
+        except (OSError, sqlite3.Error) as err:
+            raise exception.Error(
+                "While opening the tag index [1]: [2]."
+                "\n [1]: '{}'"
+                "\n [2]: '{}'".format(self.path, util.fmt_err(err))
+            )
+        self._tag_ids: Dict[str, int] = {}
+
+    def __repr__(self) -> str:
+        return "{}({})".format(self.__class__.__name__, '"{}"'.format(self.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[None]:
+        try:
+            with self.connection:
+                yield
+        except BaseException:
+            # Tags inserted by the rolled back transaction are gone, and their
+            # ids can be given to other tags.
+            self._tag_ids.clear()
+            raise
+
+    def refresh(self, roots: Iterable[str]) -> RefreshResult:
+        with self._transaction():
+            return self._refresh([(util.normalize_path(root), None) for root in roots])
+
+    def update_directory(self, path: str) -> RefreshResult:
+        """
+        Refresh the directory at `path`, linking it to its parent directory when
+        that's indexed.
+        """
+        path = util.normalize_path(path)
+        with self._transaction():
+            return self._refresh([(path, self._directory_id(os.path.dirname(path)))])
+
+    def update_file(self, path: str) -> None:
+        """
+        Re-parse the file at `path`. Its directory needs to be indexed already.
+        """
+        path = util.normalize_path(path)
+        directory_id = self._directory_id(os.path.dirname(path))
+        if directory_id is None:
+            return
+        with self._transaction():
+            self._delete_file(directory_id, os.path.basename(path))
+            self._add_file(
+                directory_id,
+                os.path.basename(path),
+                tagger.parse_file_name(os.path.basename(path))[1],
+            )
+
+    def remove_path(self, path: str) -> None:
+        """
+        Drop the file or the directory tree at `path` from the index.
+        """
+        path = util.normalize_path(path)
+        with self._transaction():
+            directory_id = self._directory_id(path)
+            if directory_id is not None:
+                self._delete_directory(directory_id)
+                return
+            parent_id = self._directory_id(os.path.dirname(path))
+            if parent_id is not None:
+                self._delete_file(parent_id, os.path.basename(path))
+
+    def touch_directory(self, path: str) -> None:
+        """
+        Record the current mtime of the directory at `path` after its changes
+        were applied to the index, so that refreshes don't rescan it.
+        """
+        path = util.normalize_path(path)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return
+        with self._transaction():
+            self.connection.execute(
+                "UPDATE directories SET mtime_ns = ? WHERE path = ?", (mtime_ns, path)
+            )
+
+    def _refresh(self, stack: List[Tuple[str, Optional[int]]]) -> RefreshResult:
+        scanned_directory_count = 0
+        skipped_directory_count = 0
+        file_count = 0
+        while stack:
+            path, parent_id = stack.pop()
+            row = self.connection.execute(
+                "SELECT id, mtime_ns, parent_id FROM directories WHERE path = ?",
+                (path,),
+            ).fetchone()
+            if row and parent_id is not None and row[2] != parent_id:
+                self.connection.execute(
+                    "UPDATE directories SET parent_id = ? WHERE id = ?",
+                    (parent_id, row[0]),
+                )
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                if row:
+                    self._delete_directory(row[0])
+                continue
+            if row and row[1] == mtime_ns:
+                skipped_directory_count += 1
+                stack.extend(
+                    (child_path, row[0])
+                    for (child_path,) in self.connection.execute(
+                        "SELECT path FROM directories WHERE parent_id = ?",
+                        (row[0],),
+                    )
+                )
+                continue
+            scanned_directory_count += 1
+            (
+                directory_id,
+                subdirectory_paths,
+                directory_file_count,
+            ) = self._scan_directory(
+                path,
+                parent_id,
+                # A change within the same mtime tick wouldn't change it.
+                mtime_ns
+                if time.time_ns() - mtime_ns >= MIN_AGE_NS
+                else UNSETTLED_MTIME_NS,
+                row[0] if row else None,
+            )
+            file_count += directory_file_count
+            stack.extend(
+                (subdirectory_path, directory_id)
+                for subdirectory_path in subdirectory_paths
+            )
+        return RefreshResult(
+            scanned_directory_count=scanned_directory_count,
+            skipped_directory_count=skipped_directory_count,
+            file_count=file_count,
+        )
+
+    def query(
+        self,
+        tag_names: Iterable[str],
+        excluded_tag_names: Iterable[str] = (),
+        roots: Iterable[str] = (),
+    ) -> Iterator[str]:
+        """
+        Yield the paths of the indexed files that carry all of `tag_names` and none
+        of `excluded_tag_names`, optionally limited to the files under `roots`.
+        """
+        tag_ids = self._existing_tag_ids(tag_names)
+        if tag_ids is None:
+            return
+        excluded_tag_ids = self._existing_tag_ids(excluded_tag_names, strict=False)
+
+        conditions = []
+        parameters: List = []
+        if tag_ids:
+            conditions.append(
+                "files.id IN (SELECT file_id FROM file_tags WHERE tag_id IN ({}) "
+                "GROUP BY file_id HAVING COUNT(*) = ?)".format(
+                    ", ".join("?" * len(tag_ids))
+                )
+            )
+            parameters.extend(tag_ids)
+            parameters.append(len(tag_ids))
+        if excluded_tag_ids:
+            conditions.append(
+                "files.id NOT IN (SELECT file_id FROM file_tags WHERE tag_id IN ({}))".format(
+                    ", ".join("?" * len(excluded_tag_ids))
+                )
+            )
+            parameters.extend(excluded_tag_ids)
+        root_conditions = []
+        for root in roots:
+            root = util.normalize_path(root)
+            prefix = os.path.join(root, "")
+            root_conditions.append(
+                "(directories.path = ? OR substr(directories.path, 1, ?) = ?)"
+            )
+            parameters.extend([root, len(prefix), prefix])
+        if root_conditions:
+            conditions.append("({})".format(" OR ".join(root_conditions)))
+
+        cursor = self.connection.execute(
+            "SELECT directories.path, files.name FROM files "
+            "JOIN directories ON directories.id = files.directory_id"
+            "{}".format(
+                " WHERE {}".format(" AND ".join(conditions)) if conditions else ""
+            ),
+            parameters,
+        )
+        for directory_path, name in cursor:
+            yield os.path.join(directory_path, name)
+
+    def _scan_directory(
+        self,
+        path: str,
+        parent_id: Optional[int],
+        mtime_ns: int,
+        directory_id: Optional[int],
+    ) -> Tuple[int, List[str], int]:
+        subdirectory_paths = []
+        file_entries = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        subdirectory_paths.append(entry.path)
+                    else:
+                        file_entries.append(entry.name)
+        except OSError:
+            pass
+
+        if directory_id is None:
+            directory_id = self.connection.execute(
+                "INSERT INTO directories (path, parent_id, mtime_ns) VALUES (?, ?, ?)",
+                (path, parent_id, mtime_ns),
+            ).lastrowid
+        else:
+            self.connection.execute(
+                "UPDATE directories SET mtime_ns = ? WHERE id = ?",
+                (mtime_ns, directory_id),
+            )
+            self._delete_files(directory_id)
+            # Subdirectories that are gone are dropped here, the remaining ones
+            # get revisited (and possibly skipped) by the caller.
+            existing_subdirectory_paths = set(subdirectory_paths)
+            for child_id, child_path in self.connection.execute(
+                "SELECT id, path FROM directories WHERE parent_id = ?", (directory_id,)
+            ).fetchall():
+                if child_path not in existing_subdirectory_paths:
+                    self._delete_directory(child_id)
+
+        for name, (_, tag_names) in zip(
+            file_entries, tagger.parse_file_names(file_entries)
+        ):
+            self._add_file(directory_id, name, tag_names)
+        return directory_id, subdirectory_paths, len(file_entries)
+
+    def _add_file(self, directory_id: int, name: str, tag_names: List[str]) -> None:
+        file_id = self.connection.execute(
+            "INSERT INTO files (directory_id, name) VALUES (?, ?)",
+            (directory_id, name),
+        ).lastrowid
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO file_tags (tag_id, file_id) VALUES (?, ?)",
+            ((self._tag_id(tag_name), file_id) for tag_name in tag_names),
+        )
+
+    def _tag_id(self, tag_name: str) -> int:
+        tag_id = self._tag_ids.get(tag_name)
+        if tag_id is None:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO tags (name) VALUES (?)", (tag_name,)
+            )
+            tag_id = self.connection.execute(
+                "SELECT id FROM tags WHERE name = ?", (tag_name,)
+            ).fetchone()[0]
+            self._tag_ids[tag_name] = tag_id
+        return tag_id
+
+    def _existing_tag_ids(
+        self, tag_names: Iterable[str], strict: bool = True
+    ) -> Optional[List[int]]:
+        """
+        Look up the ids of the (normalized) `tag_names`. When `strict` is set and a
+        tag isn't in the index at all, return None as nothing can match.
+        """
+        tag_ids = []
+        for tag_name in tag_names:
+            row = self.connection.execute(
+                "SELECT id FROM tags WHERE name = ?",
+                (tagger.intern_tag(tag_name).name,),
+            ).fetchone()
+            if row:
+                tag_ids.append(row[0])
+            elif strict:
+                return None
+        return tag_ids
+
+    def _directory_id(self, path: str) -> Optional[int]:
+        row = self.connection.execute(
+            "SELECT id FROM directories WHERE path = ?", (path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _delete_file(self, directory_id: int, name: str) -> None:
+        row = self.connection.execute(
+            "SELECT id FROM files WHERE directory_id = ? AND name = ?",
+            (directory_id, name),
+        ).fetchone()
+        if row:
+            self.connection.execute("DELETE FROM file_tags WHERE file_id = ?", row)
+            self.connection.execute("DELETE FROM files WHERE id = ?", row)
+
+    def _delete_files(self, directory_id: int) -> None:
+        self.connection.execute(
+            "DELETE FROM file_tags WHERE file_id IN "
+            "(SELECT id FROM files WHERE directory_id = ?)",
+            (directory_id,),
+        )
+        self.connection.execute(
+            "DELETE FROM files WHERE directory_id = ?", (directory_id,)
+        )
+
+    def _delete_directory(self, directory_id: int) -> None:
+        subtree_ids = [
+            row[0]
+            for row in self.connection.execute(
+                "WITH RECURSIVE subtree(id) AS ("
+                " SELECT ? UNION ALL"
+                " SELECT directories.id FROM directories"
+                " JOIN subtree ON directories.parent_id = subtree.id"
+                ") SELECT id FROM subtree",
+                (directory_id,),
+            )
+        ]
+        for subtree_id in subtree_ids:
+            self._delete_files(subtree_id)
+            self.connection.execute(
+                "DELETE FROM directories WHERE id = ?", (subtree_id,)
+            )
@@ -0,0 +1,115 @@
+import os
+import sqlite3
+
+import pytest
+
+from file_tags import index
+from file_tags import tags as tagger
+
+
+@pytest.fixture(autouse=True)
+def record_recent_mtimes(monkeypatch):
+    # The test trees are created right before being indexed.
+    monkeypatch.setattr(index, "MIN_AGE_NS", 0)
+
+
+def query(tag_index, *args, **kwargs):
+    return sorted(os.path.basename(path) for path in tag_index.query(*args, **kwargs))
+
+
+def test_tag_index_query(tmp_path, make_tree):
+    tree = tmp_path / "tree"
+    make_tree(
+        tree,
+        [
+            "a {0}wallpaper.jpg".format(tagger.TAG_START_CHAR),
+            "b {0}wallpaper {0}draft.jpg".format(tagger.TAG_START_CHAR),
+            "sub/c {0}wallpaper {0}blue.jpg".format(tagger.TAG_START_CHAR),
+            "sub/d.jpg",
+        ],
+    )
+    with index.TagIndex(str(tmp_path / "index.sqlite3")) as tag_index:
+        result = tag_index.refresh([str(tree)])
+        assert result.scanned_directory_count == 2
+        assert result.file_count == 4
+
+        assert query(tag_index, ["wallpaper"]) == [
+            "a #wallpaper.jpg",
+            "b #wallpaper #draft.jpg",
+            "c #wallpaper #blue.jpg",
+        ]
+        assert query(tag_index, ["wallpaper"], ["draft"]) == [
+            "a #wallpaper.jpg",
+            "c #wallpaper #blue.jpg",
+        ]
+        assert query(tag_index, ["wallpaper", "blue"]) == ["c #wallpaper #blue.jpg"]
+        assert query(tag_index, [], ["wallpaper"]) == ["d.jpg"]
+        assert query(tag_index, ["unknown"]) == []
+        assert query(tag_index, ["wallpaper"], roots=[str(tree / "sub")]) == [
+            "c #wallpaper #blue.jpg"
+        ]
+
+
+def test_tag_index_incremental_refresh(tmp_path, make_tree):
+    tree = tmp_path / "tree"
+    make_tree(tree, ["a {0}x.jpg".format(tagger.TAG_START_CHAR), "sub/b.jpg"])
+    with index.TagIndex(str(tmp_path / "index.sqlite3")) as tag_index:
+        tag_index.refresh([str(tree)])
+
+        # Nothing changed, nothing gets listed again.
+        result = tag_index.refresh([str(tree)])
+        assert result.scanned_directory_count == 0
+        assert result.skipped_directory_count == 2
+
+        # Only the changed directory is rescanned.
+        sub = tree / "sub"
+        os.rename(
+            str(sub / "b.jpg"), str(sub / "b {0}x.jpg".format(tagger.TAG_START_CHAR))
+        )
+        os.utime(str(sub), ns=(1, 1))
+        result = tag_index.refresh([str(tree)])
+        assert result.scanned_directory_count == 1
+        assert result.skipped_directory_count == 1
+        assert query(tag_index, ["x"]) == ["a #x.jpg", "b #x.jpg"]
+
+        # Removed directories are dropped from the index.
+        os.remove(str(sub / "b {0}x.jpg".format(tagger.TAG_START_CHAR)))
+        os.rmdir(str(sub))
+        os.utime(str(tree), ns=(2, 2))
+        tag_index.refresh([str(tree)])
+        assert query(tag_index, ["x"]) == ["a #x.jpg"]
+
+
+def test_tag_index_recently_modified_directories(tmp_path, monkeypatch, make_tree):
+    # They could still change without their mtime changing, so they're rescanned
+    # until they've been still for a while.
+    monkeypatch.setattr(index, "MIN_AGE_NS", 10**18)
+    make_tree(tmp_path / "tree", ["a.jpg", "sub/b.jpg"])
+    with index.TagIndex(str(tmp_path / "index.sqlite3")) as tag_index:
+        for _ in range(2):
+            result = tag_index.refresh([str(tmp_path / "tree")])
+            assert result.scanned_directory_count == 2
+
+
+def test_tag_index_rollback(tmp_path, make_tree):
+    tree = tmp_path / "tree"
+    make_tree(tree, ["a {0}alpha.jpg".format(tagger.TAG_START_CHAR)])
+    with index.TagIndex(str(tmp_path / "index.sqlite3")) as tag_index:
+        tag_index.refresh([str(tree)])
+        # The id given to "beta" is rolled back along with it.
+        with pytest.raises(sqlite3.OperationalError):
+            with tag_index._transaction():
+                tag_index._tag_id("beta")
+                raise sqlite3.OperationalError("database is locked")
+
+        make_tree(
+            tree,
+            [
+                "b {0}gamma.jpg".format(tagger.TAG_START_CHAR),
+                "c {0}beta.jpg".format(tagger.TAG_START_CHAR),
+            ],
+        )
+        os.utime(str(tree), ns=(1, 1))
+        tag_index.refresh([str(tree)])
+        assert query(tag_index, ["gamma"]) == ["b #gamma.jpg"]
+        assert query(tag_index, ["beta"]) == ["c #beta.jpg"]
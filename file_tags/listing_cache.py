@@ -0,0 +1,265 @@
+"""
+On-disk cache of directory listings and parsed file names.
+
+On a big, mostly static archive, listing the directories and parsing the file
+names is most of the work of a run, and it's the same work every time. The
+cache keeps, for each directory, the names of its subdirectories and files and
+the parsed file names (tagless name and tag names), keyed by the directory's
+mtime and inode. Adding, removing or renaming an entry updates the directory's
+mtime, so an unchanged directory is taken from the cache with a single `stat`,
+without being listed or parsed again.
+
+The cache is a single `marshal` file, read whole when opened and replaced
+atomically when saved. Each column of a directory's entries is kept as a single
+string, split only when the directory is walked: loading millions of small
+strings, lists and tuples would cost more than listing the directories again.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import logging
+import marshal
+import os
+import time
+
+from file_tags import exception
+from file_tags import tags as tagger
+from file_tags import util
+from file_tags import walk
+
+
+log = logging.getLogger()
+
+DEFAULT_CACHE_PATH = tagger.DEFAULT_LISTING_CACHE_PATH
+# Bumped when the layout of the entries or the parsing of file names changes,
+# older caches are then ignored.
+FORMAT_VERSION = 1
+# Separate the names in the columns, and the tag names of a file. Neither can
+# be part of a file name or a tag name.
+NAME_SEP = "\0"
+TAG_NAME_SEP = " "
+# Directories modified more recently aren't cached, see `util.MIN_MTIME_AGE_NS`.
+MIN_AGE_NS = util.MIN_MTIME_AGE_NS
+
+# The tagless name and the tag names of a file, as returned by
+# `tags.parse_file_name`.
+ParsedName = Tuple[str, List[str]]
+
+
+class Listing(NamedTuple):
+    subdirectory_names: List[str]
+    file_names: List[str]
+    parsed_names: List[ParsedName]
+
+
+class ListingCache:
+    """
+    Usage:
+        with ListingCache() as listing_cache:
+            for path, parsed_name in walk_paths(paths, listing_cache):
+                ...
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH) -> None:
+        self.path = util.normalize_path(path)
+        # Directories taken from the cache and (re-)listed.
+        self.hit_count = 0
+        self.miss_count = 0
+        # Set when there's a file at `path` that isn't a listing cache, it's
+        # then never replaced.
+        self._unreadable = False
+        # Directory path -> (mtime_ns, inode, subdirectory names, file names,
+        # tagless names, tag names), with the names joined.
+        self._entries: Dict[str, Tuple] = self._load()
+        self._changed = False
+
+    def __repr__(self) -> str:
+        return '{}("{}")'.format(self.__class__.__name__, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.save()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def listing(self, directory: str) -> Optional[Listing]:
+        """
+        The entries of `directory`, from the cache when it hasn't changed since
+        it was cached. None when it can't be listed.
+        """
+        try:
+            stat = os.stat(directory)
+        except OSError:
+            return None
+        entry = self._entries.get(directory)
+        if (
+            entry is not None
+            and entry[0] == stat.st_mtime_ns
+            and entry[1] == stat.st_ino
+        ):
+            self.hit_count += 1
+            return Listing(
+                _split(entry[2]),
+                _split(entry[3]),
+                list(
+                    zip(
+                        _split(entry[4]),
+                        [
+                            tag_names.split(TAG_NAME_SEP) if tag_names else []
+                            for tag_names in _split(entry[5])
+                        ],
+                    )
+                ),
+            )
+
+        self.miss_count += 1
+        subdirectory_names = []
+        file_names = []
+        try:
+            with os.scandir(directory) as entries:
+                for dir_entry in entries:
+                    try:
+                        is_dir = dir_entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        subdirectory_names.append(dir_entry.name)
+                    else:
+                        file_names.append(dir_entry.name)
+        except OSError:
+            return None
+        parsed_names = tagger.parse_file_names(file_names)
+
+        if entry is not None:
+            self._forget_removed_subdirectories(directory, entry[2], subdirectory_names)
+        if time.time_ns() - stat.st_mtime_ns >= MIN_AGE_NS:
+            self._entries[directory] = (
+                stat.st_mtime_ns,
+                stat.st_ino,
+                _join(subdirectory_names),
+                _join(file_names),
+                _join([tagless_name for tagless_name, _ in parsed_names]),
+                _join([TAG_NAME_SEP.join(tag_names) for _, tag_names in parsed_names]),
+            )
+            self._changed = True
+        elif entry is not None:
+            del self._entries[directory]
+            self._changed = True
+        return Listing(subdirectory_names, file_names, parsed_names)
+
+    def save(self) -> None:
+        """
+        Write the cache back if anything changed. Raises `exception.Error`
+        rather than replace a file that couldn't be read as a listing cache.
+        """
+        if not self._changed:
+            return
+        if self._unreadable:
+            raise exception.Error(
+                "While saving the listing cache [1]: [2]."
+                "\n [1]: '{}'"
+                "\n [2]: 'The file isn't a listing cache, not replacing it. "
+                "Remove it or use another cache file.'".format(self.path)
+            )
+        temporary_path = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temporary_path, "wb") as cache_file:
+                marshal.dump((FORMAT_VERSION, self._entries), cache_file)
+            os.replace(temporary_path, self.path)
+        except OSError as err:
+            raise exception.Error(
+                "While saving the listing cache [1]: [2]."
+                "\n [1]: '{}'"
+                "\n [2]: '{}'".format(self.path, util.fmt_err(err))
+            )
+        self._changed = False
+
+    def _load(self) -> Dict[str, Tuple]:
+        try:
+            with open(self.path, "rb") as cache_file:
+                version, entries = marshal.load(cache_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, EOFError, ValueError, TypeError) as err:
+            # It's only a cache, the directories get listed again. The file may
+            # not be one at all though, e.g. a wrong path.
+            log.warning(
+                "Ignoring the unreadable listing cache '{}': {}".format(
+                    self.path, util.fmt_err(err)
+                )
+            )
+            self._unreadable = True
+            return {}
+        return entries if version == FORMAT_VERSION else {}
+
+    def _forget_removed_subdirectories(
+        self, directory: str, old_names: Optional[str], names: List[str]
+    ) -> None:
+        removed_paths = [
+            os.path.join(directory, name)
+            for name in set(_split(old_names)) - set(names)
+        ]
+        if not removed_paths:
+            return
+        removed_prefixes = tuple(os.path.join(path, "") for path in removed_paths)
+        for path in list(self._entries):
+            if path in removed_paths or path.startswith(removed_prefixes):
+                del self._entries[path]
+        self._changed = True
+
+
+def walk_paths(
+    paths: Iterable[str],
+    listing_cache: ListingCache,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    max_depth: Optional[int] = None,
+) -> Iterator[Tuple[str, ParsedName]]:
+    """
+    `walk.walk_paths`, with the directories listed through `listing_cache`.
+    Yields each file's path along with its parsed name, once also when `paths`
+    overlap.
+    """
+    include_match = walk.compile_globs(include)
+    exclude_match = walk.compile_globs(exclude)
+    roots, nested_roots = walk.split_roots(paths)
+    for path in roots:
+        if not os.path.isdir(path):
+            yield path, tagger.parse_file_name(os.path.basename(path))
+            continue
+        stack = [(path, 0)]
+        while stack:
+            directory, depth = stack.pop()
+            listing = listing_cache.listing(directory)
+            if listing is None:
+                continue
+            for name, parsed_name in zip(listing.file_names, listing.parsed_names):
+                if exclude_match and exclude_match(name):
+                    continue
+                if include_match and not include_match(name):
+                    continue
+                file_path = os.path.join(directory, name)
+                if nested_roots and file_path in nested_roots:
+                    continue
+                yield file_path, parsed_name
+            if max_depth is not None and depth >= max_depth:
+                continue
+            for name in reversed(listing.subdirectory_names):
+                if exclude_match and exclude_match(name):
+                    continue
+                subdirectory = os.path.join(directory, name)
+                if nested_roots and subdirectory in nested_roots:
+                    continue
+                stack.append((subdirectory, depth + 1))
+
+
+def _join(names: List[str]) -> Optional[str]:
+    return NAME_SEP.join(names) if names else None
+
+
+def _split(joined_names: Optional[str]) -> List[str]:
+    return joined_names.split(NAME_SEP) if joined_names is not None else []
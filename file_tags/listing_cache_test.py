@@ -0,0 +1,139 @@
+import marshal
+import os
+import shutil
+
+import pytest
+
+from file_tags import exception
+from file_tags import listing_cache
+from file_tags import tags as tagger
+from file_tags import util
+from file_tags import walk
+
+
+@pytest.fixture(autouse=True)
+def cache_recent_directories(monkeypatch):
+    # The test trees are created right before being walked.
+    monkeypatch.setattr(listing_cache, "MIN_AGE_NS", 0)
+
+
+def cached_walk(cache_path, root, **kwargs):
+    with listing_cache.ListingCache(cache_path) as cache:
+        result = sorted(listing_cache.walk_paths([str(root)], cache, **kwargs))
+    return result, (cache.miss_count, cache.hit_count)
+
+
+def expected_walk(root, **kwargs):
+    return sorted(
+        (path, tagger.parse_file_name(os.path.basename(path)))
+        for path in walk.walk_paths([str(root)], **kwargs)
+    )
+
+
+def test_walk_paths(tmp_path, make_tree):
+    tree = tmp_path / "tree"
+    make_tree(tree, ["a #x.jpg", "b.txt", "x/c #y #x.jpg", "x/y/d.jpg", "z/e #z"])
+    cache_path = str(tmp_path / "listings.marshal")
+
+    # Cold, then warm.
+    assert cached_walk(cache_path, tree) == (expected_walk(tree), (4, 0))
+    assert cached_walk(cache_path, tree) == (expected_walk(tree), (0, 4))
+
+    for kwargs in (
+        {"max_depth": 0},
+        {"max_depth": 1},
+        {"include": ["*.jpg"], "exclude": ["y"]},
+        {"exclude": ["x"]},
+    ):
+        assert cached_walk(cache_path, tree, **kwargs)[0] == expected_walk(
+            tree, **kwargs
+        )
+
+    # Overlapping paths.
+    paths = [str(tree), str(tree / "x"), str(tree / "x" / "y" / "d.jpg")]
+    with listing_cache.ListingCache(cache_path) as cache:
+        assert sorted(listing_cache.walk_paths(paths, cache)) == expected_walk(tree)
+
+    # Files passed in directly are parsed as they are.
+    file_path = str(tree / "a #x.jpg")
+    with listing_cache.ListingCache(cache_path) as cache:
+        assert list(listing_cache.walk_paths([file_path], cache)) == [
+            (file_path, ("a.jpg", ["x"]))
+        ]
+
+
+def test_changed_directories(tmp_path, monkeypatch, make_tree):
+    tree = tmp_path / "tree"
+    make_tree(tree, ["a.jpg", "x/b #x.jpg", "x/y/c.jpg", "z/d.jpg"])
+    cache_path = str(tmp_path / "listings.marshal")
+    cached_walk(cache_path, tree)
+
+    # Only the directories with added, renamed or removed entries get relisted.
+    make_tree(tree, ["x/e #y.jpg"])
+    os.rename(str(tree / "z" / "d.jpg"), str(tree / "z" / "d #z.jpg"))
+    shutil.rmtree(str(tree / "x" / "y"))
+    assert cached_walk(cache_path, tree) == (expected_walk(tree), (2, 1))
+    with listing_cache.ListingCache(cache_path) as cache:
+        assert len(cache) == 3
+
+    # Recently modified directories aren't cached, they may still change
+    # without their mtime changing.
+    monkeypatch.setattr(listing_cache, "MIN_AGE_NS", 10**18)
+    make_tree(tree, ["f.jpg"])
+    assert cached_walk(cache_path, tree)[1] == (1, 2)
+    assert cached_walk(cache_path, tree)[1] == (1, 2)
+
+
+def test_unreadable_cache(tmp_path, make_tree):
+    make_tree(tmp_path / "tree", ["a.jpg"])
+    cache_path = tmp_path / "listings.marshal"
+    cache_path.write_bytes(b"not a cache")
+    cache = listing_cache.ListingCache(str(cache_path))
+    assert sorted(
+        listing_cache.walk_paths([str(tmp_path / "tree")], cache)
+    ) == expected_walk(tmp_path / "tree")
+    # It may be any file given by mistake, it's left as it is.
+    with pytest.raises(exception.Error, match="isn't a listing cache"):
+        cache.save()
+    assert cache_path.read_bytes() == b"not a cache"
+
+    # Caches of an older format are replaced.
+    with open(str(cache_path), "wb") as cache_file:
+        marshal.dump((listing_cache.FORMAT_VERSION - 1, {}), cache_file)
+    assert cached_walk(str(cache_path), tmp_path / "tree")[1] == (1, 0)
+    assert cached_walk(str(cache_path), tmp_path / "tree")[1] == (0, 1)
+
+
+def test_cache_option_before_paths(tmp_path, monkeypatch, make_tree):
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    make_tree(tmp_path / "tree", ["a.jpg", "sub/b.jpg"])
+    a_path = str(tmp_path / "tree" / "a.jpg")
+    sub_path = str(tmp_path / "tree" / "sub")
+    config = tagger.Config.from_command_line_args(
+        ["add", "y", "-r", "--cache", a_path, sub_path, "-n"]
+    )
+    assert config.listing_cache_path == tagger.DEFAULT_LISTING_CACHE_PATH
+    assert list(config.file_paths) == [a_path, sub_path]
+    with pytest.raises(SystemExit):
+        tagger.main(config)
+    # Still there, untouched.
+    assert os.path.getsize(a_path) == 0
+    assert os.path.exists(util.normalize_path(tagger.DEFAULT_LISTING_CACHE_PATH))
+
+
+def test_tag_command_line(tmp_path, caplog, make_tree):
+    tree = tmp_path / "tree"
+    make_tree(tree, ["a #x.jpg", "sub/b.jpg", "sub/c #x.jpg"])
+    cache_path = str(tmp_path / "listings.marshal")
+    args = ["-r", "--cache-file", cache_path, "--where", "x", "add", "y", str(tree)]
+
+    tagger.main(tagger.Config.from_command_line_args(list(args)))
+    assert sorted(
+        os.path.relpath(path, str(tree)) for path in walk.walk_paths([str(tree)])
+    ) == ["a #x #y.jpg", "sub/b.jpg", os.path.join("sub", "c #x #y.jpg")]
+
+    # The renamed directories get relisted.
+    caplog.clear()
+    with pytest.raises(SystemExit):
+        tagger.main(tagger.Config.from_command_line_args(list(args)))
+    assert "Directories listed: 2, from the cache: 0" in caplog.messages
@@ -0,0 +1,147 @@
+# pylint: disable=unused-wildcard-import
+from typing import *
+
+import sys
+import time
+
+
+class Phase:
+    """
+    Counters of a single processing phase, accumulated over every time the phase
+    was entered.
+    """
+
+    __slots__ = ("name", "seconds", "item_count", "error_count")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.seconds = 0.0
+        self.item_count = 0
+        self.error_count = 0
+
+    def __repr__(self) -> str:
+        return "{}({})".format(self.__class__.__name__, '"{}"'.format(self.name))
+
+    def as_dict(self) -> Dict:
+        return {
+            "seconds": round(self.seconds, 6),
+            "items": self.item_count,
+            "items_per_second": round(self.item_count / self.seconds, 1)
+            if self.seconds
+            else None,
+            "errors": self.error_count,
+        }
+
+
+class Metrics:
+    """
+    Per-phase wall time and item/error counts of a run. The peak memory is only
+    known for the whole process, it's reported once for the run.
+
+    Usage:
+        with metrics.phase("parse") as phase:
+            ...
+            phase.item_count += len(chunk)
+    """
+
+    enabled = True
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, Phase] = {}
+
+    def phase(self, name: str) -> "_PhaseTimer":
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase(name)
+        return _PhaseTimer(phase)
+
+    def as_dict(self) -> Dict:
+        return {
+            "phases": {name: phase.as_dict() for name, phase in self.phases.items()},
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+    def dump(self, path: str) -> None:
+        """
+        Write the metrics as JSON to the file at `path`, or to stderr for "-".
+        """
+        import json
+
+        if path == "-":
+            json.dump(self.as_dict(), sys.stderr, indent=2)
+            sys.stderr.write("\n")
+            return
+        with open(path, "w") as output_file:
+            json.dump(self.as_dict(), output_file, indent=2)
+
+
+class NullMetrics:
+    """
+    Stand-in for `Metrics` when no stats were asked for. Every phase is the same
+    do-nothing context manager, so instrumented code pays nothing per phase.
+    """
+
+    enabled = False
+
+    def phase(self, name: str) -> "_NullPhase":
+        return _NULL_PHASE
+
+    def as_dict(self) -> Dict:
+        return {}
+
+    def dump(self, path: str) -> None:
+        pass
+
+
+class _PhaseTimer:
+    __slots__ = ("phase", "start")
+
+    def __init__(self, phase: Phase) -> None:
+        self.phase = phase
+        self.start = 0.0
+
+    def __enter__(self) -> Phase:
+        self.start = time.perf_counter()
+        return self.phase
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.phase.seconds += time.perf_counter() - self.start
+        if exc_type is not None and not issubclass(exc_type, SystemExit):
+            self.phase.error_count += 1
+
+
+class _NullPhase:
+    """
+    Accepts and forgets any counter updates.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullPhase":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def __setattr__(self, name, value) -> None:
+        pass
+
+    item_count = 0
+    error_count = 0
+
+
+_NULL_PHASE = _NullPhase()
+NULL_METRICS = NullMetrics()
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Peak resident set size of the process so far, None where unknown.
+    """
+    try:
+        import resource
+    except ImportError:  # Not available on Windows.
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, in bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
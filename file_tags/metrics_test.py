@@ -0,0 +1,40 @@
+import json
+import sys
+
+import pytest
+
+from file_tags import metrics
+
+
+def test_metrics(tmp_path):
+    run_metrics = metrics.Metrics()
+    for _ in range(2):
+        with run_metrics.phase("parse") as phase:
+            phase.item_count += 5
+    with pytest.raises(ValueError):
+        with run_metrics.phase("rename"):
+            raise ValueError
+
+    stats = run_metrics.as_dict()
+    phases = stats["phases"]
+    assert list(phases) == ["parse", "rename"]
+    assert phases["parse"]["items"] == 10
+    assert phases["parse"]["errors"] == 0
+    assert phases["rename"]["errors"] == 1
+    # Only known for the whole process.
+    assert "peak_rss_bytes" not in phases["parse"]
+    if sys.platform != "win32":
+        assert stats["peak_rss_bytes"] > 0
+
+    stats_path = str(tmp_path / "stats.json")
+    run_metrics.dump(stats_path)
+    with open(stats_path) as stats_file:
+        assert json.load(stats_file) == stats
+
+
+def test_null_metrics():
+    with metrics.NULL_METRICS.phase("parse") as phase:
+        phase.item_count += 5
+        phase.error_count += 1
+    assert phase.item_count == 0
+    assert metrics.NULL_METRICS.as_dict() == {}
@@ -0,0 +1,258 @@
+"""
+asyncio pipeline for high-latency filesystems.
+
+On network mounts (NFS, SMB, ...) every filesystem call is a round trip, so
+checking and renaming files one after another is bound by the latency, not by
+the work. The pipeline keeps up to `concurrency` calls in flight on a thread
+pool. The stages are connected by bounded queues, so the scan can't run ahead of
+the validation by more than a couple of items per worker (backpressure).
+
+`LatencyFileSystem` adds a delay to every call, to measure the effect locally.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import asyncio
+import concurrent.futures
+import itertools
+import os
+import time
+
+from file_tags import exception
+from file_tags import plan
+from file_tags import rename
+from file_tags import store
+from file_tags import tags as tagger
+from file_tags import util
+
+
+DEFAULT_CONCURRENCY = 64
+# How many paths the scan stage takes from the path iterator per call. Getting
+# them may walk directories, which are round trips as well.
+SCAN_CHUNK_SIZE = 256
+
+
+class FileSystem:
+    """
+    The filesystem calls made by the pipeline.
+    """
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def list_directory(self, path: str) -> List[str]:
+        return os.listdir(path)
+
+    def rename(self, path: str, new_path: str) -> None:
+        os.rename(path, new_path)
+
+
+class LatencyFileSystem(FileSystem):
+    """
+    Adds `latency` seconds to every call. The calling thread is blocked for that
+    long, like it is by the system call on a network filesystem.
+    """
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+
+    def exists(self, path: str) -> bool:
+        time.sleep(self.latency)
+        return super().exists(path)
+
+    def list_directory(self, path: str) -> List[str]:
+        time.sleep(self.latency)
+        return super().list_directory(path)
+
+    def rename(self, path: str, new_path: str) -> None:
+        time.sleep(self.latency)
+        super().rename(path, new_path)
+
+
+def collect_changes(
+    paths: Iterable[str],
+    update: Callable[[tagger.TaggedFile], None],
+    file_system: Optional[FileSystem] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    where: Optional[tagger.TagPredicate] = None,
+) -> Tuple[store.FileStore, int]:
+    """
+    Validate `paths`, apply `update` to each file (matching `where`, if given)
+    and keep the ones whose name changes.
+
+    Returns the changed files and the number of paths seen. Raises
+    `exception.Error` listing the paths that don't exist.
+    """
+    return asyncio.run(
+        _collect_changes(paths, update, file_system or FileSystem(), concurrency, where)
+    )
+
+
+def plan_renames(
+    renames: Iterable[rename.Rename],
+    file_system: Optional[FileSystem] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> plan.RenamePlan:
+    """
+    `plan.plan_renames`, with the affected directories listed concurrently
+    beforehand.
+    """
+    renames = list(renames)
+    listings = asyncio.run(
+        _list_directories(
+            {planned_rename.directory for planned_rename in renames},
+            file_system or FileSystem(),
+            concurrency,
+        )
+    )
+    return plan.plan_renames(renames, list_directory=listings.__getitem__)
+
+
+def execute_plan(
+    rename_plan: plan.RenamePlan,
+    file_system: Optional[FileSystem] = None,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> int:
+    """
+    Perform the renames of `rename_plan` with up to `concurrency` of them in
+    flight. The renames of each sequence are performed in order. Stops at the
+    first failure and raises `exception.Error`.
+
+    Returns the number of renamed files.
+    """
+    return asyncio.run(
+        _execute_plan(rename_plan, file_system or FileSystem(), concurrency)
+    )
+
+
+async def _collect_changes(
+    paths: Iterable[str],
+    update: Callable[[tagger.TaggedFile], None],
+    file_system: FileSystem,
+    concurrency: int,
+    where: Optional[tagger.TagPredicate],
+) -> Tuple[store.FileStore, int]:
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=2 * concurrency)
+    changed_files = store.FileStore()
+    missing_paths = []
+    path_count = 0
+
+    async def scan(executor: concurrent.futures.Executor) -> None:
+        nonlocal path_count
+        path_iterator = iter(paths)
+        try:
+            while True:
+                chunk = await loop.run_in_executor(
+                    executor, _take, path_iterator, SCAN_CHUNK_SIZE
+                )
+                if not chunk:
+                    break
+                path_count += len(chunk)
+                for path in chunk:
+                    await queue.put(path)
+        finally:
+            for _ in range(concurrency):
+                await queue.put(None)
+
+    async def validate(executor: concurrent.futures.Executor) -> None:
+        while True:
+            path = await queue.get()
+            if path is None:
+                return
+            path = util.normalize_path(path)
+            if not await loop.run_in_executor(executor, file_system.exists, path):
+                missing_paths.append(path)
+                continue
+            tagged_file = tagger.filtered_tagged_file(path, where)
+            if tagged_file is None:
+                continue
+            update(tagged_file)
+            new_name = tagged_file.new_name
+            if tagged_file.name != new_name:
+                changed_files.add(tagged_file.path, new_name, tagged_file.tags)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        await asyncio.gather(
+            scan(executor), *(validate(executor) for _ in range(concurrency))
+        )
+    if missing_paths:
+        raise util.missing_paths_error(missing_paths, path_count)
+    return changed_files, path_count
+
+
+async def _list_directories(
+    directories: Iterable[str], file_system: FileSystem, concurrency: int
+) -> Dict[str, List[str]]:
+    loop = asyncio.get_running_loop()
+    listings: Dict[str, List[str]] = {}
+    directory_iterator = iter(directories)
+
+    async def list_directories(executor: concurrent.futures.Executor) -> None:
+        for directory in directory_iterator:
+            try:
+                listings[directory] = await loop.run_in_executor(
+                    executor, file_system.list_directory, directory
+                )
+            except OSError:
+                # Handled by the planning like an empty directory.
+                listings[directory] = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        await asyncio.gather(*(list_directories(executor) for _ in range(concurrency)))
+    return listings
+
+
+async def _execute_plan(
+    rename_plan: plan.RenamePlan, file_system: FileSystem, concurrency: int
+) -> int:
+    loop = asyncio.get_running_loop()
+    # Each worker takes the next independent rename or sequence once it's done
+    # with the previous one, so only `concurrency` of them are ever in flight.
+    units = itertools.chain(
+        ([planned_rename] for planned_rename in rename_plan.independent),
+        rename_plan.sequences,
+    )
+    renamed_count = 0
+    first_err = None
+
+    async def rename_units(executor: concurrent.futures.Executor) -> None:
+        nonlocal renamed_count, first_err
+        for unit in units:
+            for planned_rename in unit:
+                if first_err is not None:
+                    return
+                try:
+                    await loop.run_in_executor(
+                        executor,
+                        file_system.rename,
+                        planned_rename.path,
+                        planned_rename.new_path,
+                    )
+                except OSError as err:
+                    if first_err is None:
+                        first_err = exception.Error(
+                            "While renaming a file from [1] to [2]: [3]."
+                            "\n [1]: '{}'"
+                            "\n [2]: '{}'"
+                            "\n [3]: '{}'".format(
+                                planned_rename.path, planned_rename.new_path, err
+                            )
+                        )
+                    return
+                renamed_count += 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        await asyncio.gather(*(rename_units(executor) for _ in range(concurrency)))
+    if first_err is not None:
+        raise exception.Error(
+            "While renaming files ({}/{} renamed): [1]."
+            "\n [1]: '{}'".format(
+                renamed_count, len(rename_plan), util.fmt_err(first_err)
+            )
+        )
+    return renamed_count
+
+
+def _take(iterator: Iterator[str], count: int) -> List[str]:
+    return list(itertools.islice(iterator, count))
@@ -0,0 +1,65 @@
+import os
+import time
+
+import pytest
+
+from file_tags import exception
+from file_tags import pipeline
+from file_tags import tags as tagger
+
+
+def add_tag(tagged_file):
+    tagged_file.add_tag(tagger.Tag("new"))
+
+
+def tag_files(paths, file_system, concurrency):
+    changed_files, file_count = pipeline.collect_changes(
+        paths, add_tag, file_system, concurrency
+    )
+    assert file_count == len(paths)
+    rename_plan = pipeline.plan_renames(
+        changed_files.planned_renames(), file_system, concurrency
+    )
+    return pipeline.execute_plan(rename_plan, file_system, concurrency)
+
+
+def test_pipeline(tmp_path, make_tree):
+    paths = make_tree(tmp_path, ["file {}.jpg".format(i) for i in range(50)])
+    paths += make_tree(tmp_path, ["tagged {}new.jpg".format(tagger.TAG_START_CHAR)])
+
+    assert tag_files(paths, pipeline.FileSystem(), concurrency=8) == 50
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        ["file {} #new.jpg".format(i) for i in range(50)] + ["tagged #new.jpg"]
+    )
+
+
+def test_pipeline_missing_paths(tmp_path, make_tree):
+    paths = make_tree(tmp_path, ["a.jpg"]) + [os.path.join(str(tmp_path), "b.jpg")]
+    with pytest.raises(exception.Error, match=r"don't exist \(1/2\)"):
+        pipeline.collect_changes(paths, add_tag)
+
+
+def test_pipeline_rename_error(tmp_path, make_tree):
+    paths = make_tree(tmp_path, ["a.jpg", "b.jpg"])
+    changed_files, _ = pipeline.collect_changes(paths, add_tag)
+    rename_plan = pipeline.plan_renames(changed_files.planned_renames())
+    os.remove(paths[0])
+    with pytest.raises(exception.Error, match=r"While renaming files \(\d/2 renamed\)"):
+        pipeline.execute_plan(rename_plan, concurrency=1)
+
+
+def test_pipeline_latency(tmp_path, make_tree):
+    # Every call takes 10ms, like on a slow network share: with 20 calls in
+    # flight the 40 files take a fraction of the serial time.
+    file_system = pipeline.LatencyFileSystem(0.01)
+    timings = []
+    for concurrency in (1, 20):
+        directory = tmp_path / str(concurrency)
+        directory.mkdir()
+        paths = make_tree(directory, ["file {}.jpg".format(i) for i in range(40)])
+        start = time.perf_counter()
+        assert tag_files(paths, file_system, concurrency) == 40
+        timings.append(time.perf_counter() - start)
+    serial_seconds, concurrent_seconds = timings
+    assert serial_seconds > 0.8
+    assert concurrent_seconds < serial_seconds / 4
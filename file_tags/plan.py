@@ -0,0 +1,159 @@
+# pylint: disable=unused-wildcard-import
+from typing import *
+
+import os
+
+from file_tags import exception
+from file_tags.rename import Rename
+
+
+# Kept short so that it fits whatever the length of the original name.
+TEMPORARY_NAME_TEMPLATE = ".file_tags-{index}"
+# How many problems are listed in the error raised for an unsafe plan.
+MAX_LISTED_PROBLEMS = 10
+
+
+class RenamePlan(NamedTuple):
+    # Renames that can run in any order, in parallel.
+    independent: List[Rename]
+    # Renames that have to run one after another, in the given order. Different
+    # sequences don't depend on each other.
+    sequences: List[List[Rename]]
+
+    def __len__(self) -> int:
+        return len(self.independent) + sum(len(sequence) for sequence in self.sequences)
+
+
+def plan_renames(
+    renames: Iterable[Rename],
+    list_directory: Callable[[str], Iterable[str]] = os.listdir,
+) -> RenamePlan:
+    """
+    Check a batch of renames for conflicts and work out a safe execution order,
+    in time linear in the number of renames.
+
+    A rename whose new name is the current name of another one has to wait for
+    that one to move out of the way, which makes chains of dependent renames.
+    Cycles (e.g. swapping two names) are broken up by moving one file to a
+    temporary name first. Each affected directory gets listed once to check
+    that no rename overwrites a file that's not part of the batch.
+
+    Raises `exception.Error` when renames collide with each other or with an
+    existing file.
+    """
+    by_source: Dict[Tuple[str, str], Rename] = {}
+    by_target: Dict[Tuple[str, str], Rename] = {}
+    problems = []
+    for rename in renames:
+        source = (rename.directory, rename.name)
+        target = (rename.directory, rename.new_name)
+        if source in by_source:
+            problems.append("'{}' is renamed twice".format(rename.path))
+            continue
+        if target in by_target:
+            problems.append(
+                "'{}' and '{}' would both be renamed to '{}'".format(
+                    by_target[target].path, rename.path, rename.new_path
+                )
+            )
+            continue
+        by_source[source] = rename
+        by_target[target] = rename
+
+    existing_names: Dict[str, Set[str]] = {}
+    for directory, new_name in by_target:
+        if (directory, new_name) in by_source:
+            continue
+        if new_name in _existing_names(directory, existing_names, list_directory):
+            problems.append(
+                "'{}' would overwrite the existing '{}'".format(
+                    by_target[directory, new_name].path,
+                    os.path.join(directory, new_name),
+                )
+            )
+
+    if problems:
+        raise exception.Error(
+            "While planning the renames of {} files: [1]."
+            "\n [1]: '{} conflict(s):\n{}{}'".format(
+                len(by_source),
+                len(problems),
+                "\n".join(
+                    "  {}".format(problem) for problem in problems[:MAX_LISTED_PROBLEMS]
+                ),
+                "\n  ..." if len(problems) > MAX_LISTED_PROBLEMS else "",
+            )
+        )
+
+    independent = []
+    sequences = []
+    planned: Set[Tuple[str, str]] = set()
+    # Every name is the source and the target of at most one rename, so the
+    # renames form simple chains and cycles. A chain starts with the rename whose
+    # target is free and continues with the rename moving into the name it freed.
+    for source, rename in by_source.items():
+        if (rename.directory, rename.new_name) in by_source:
+            continue
+        sequence = [rename]
+        planned.add(source)
+        previous = by_target.get(source)
+        while previous is not None:
+            sequence.append(previous)
+            planned.add((previous.directory, previous.name))
+            previous = by_target.get((previous.directory, previous.name))
+        if len(sequence) == 1:
+            independent.append(rename)
+        else:
+            sequences.append(sequence)
+
+    # What's left are cycles.
+    for source, rename in by_source.items():
+        if source in planned:
+            continue
+        temporary_name = _temporary_name(
+            rename, by_source, by_target, existing_names, list_directory
+        )
+        sequence = [Rename(rename.directory, rename.name, temporary_name)]
+        planned.add(source)
+        previous = by_target[source]
+        while previous is not rename:
+            sequence.append(previous)
+            planned.add((previous.directory, previous.name))
+            previous = by_target[previous.directory, previous.name]
+        sequence.append(Rename(rename.directory, temporary_name, rename.new_name))
+        sequences.append(sequence)
+
+    return RenamePlan(independent=independent, sequences=sequences)
+
+
+def _temporary_name(
+    rename: Rename,
+    by_source: Dict[Tuple[str, str], Rename],
+    by_target: Dict[Tuple[str, str], Rename],
+    existing_names: Dict[str, Set[str]],
+    list_directory: Callable[[str], Iterable[str]],
+) -> str:
+    names = _existing_names(rename.directory, existing_names, list_directory)
+    index = 0
+    while True:
+        name = TEMPORARY_NAME_TEMPLATE.format(index=index)
+        key = (rename.directory, name)
+        if name not in names and key not in by_source and key not in by_target:
+            names.add(name)
+            return name
+        index += 1
+
+
+def _existing_names(
+    directory: str,
+    existing_names: Dict[str, Set[str]],
+    list_directory: Callable[[str], Iterable[str]],
+) -> Set[str]:
+    names = existing_names.get(directory)
+    if names is None:
+        try:
+            names = set(list_directory(directory))
+        except OSError:
+            names = set()
+        existing_names[directory] = names
+    return names
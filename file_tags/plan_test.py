@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from file_tags import exception
+from file_tags import plan
+from file_tags import rename
+from file_tags.rename import Rename
+
+
+def listing(names_by_directory):
+    return lambda directory: names_by_directory.get(directory, [])
+
+
+def test_plan_renames_independent():
+    renames = [Rename("/a", "1", "1x"), Rename("/b", "1", "1x")]
+    rename_plan = plan.plan_renames(renames, listing({"/a": ["1"], "/b": ["1"]}))
+    assert rename_plan.independent == renames
+    assert rename_plan.sequences == []
+    assert len(rename_plan) == 2
+
+
+def test_plan_renames_chains_and_cycles():
+    chain = [Rename("/a", "1", "2"), Rename("/a", "2", "3"), Rename("/a", "3", "4")]
+    cycle = [Rename("/a", "x", "y"), Rename("/a", "y", "x")]
+    rename_plan = plan.plan_renames(
+        chain + cycle, listing({"/a": ["1", "2", "3", "x", "y"]})
+    )
+    assert rename_plan.independent == []
+    assert rename_plan.sequences[0] == list(reversed(chain))
+    temporary_name = rename_plan.sequences[1][0].new_name
+    assert rename_plan.sequences[1] == [
+        Rename("/a", "x", temporary_name),
+        Rename("/a", "y", "x"),
+        Rename("/a", temporary_name, "y"),
+    ]
+    assert temporary_name not in {"x", "y"}
+
+
+def test_plan_renames_conflicts():
+    # Two files renamed to the same name.
+    with pytest.raises(exception.Error):
+        plan.plan_renames(
+            [Rename("/a", "1", "x"), Rename("/a", "2", "x")],
+            listing({"/a": ["1", "2"]}),
+        )
+    # Overwriting a file that isn't renamed.
+    with pytest.raises(exception.Error):
+        plan.plan_renames([Rename("/a", "1", "x")], listing({"/a": ["1", "x"]}))
+    # The same name in another directory is fine.
+    plan.plan_renames([Rename("/a", "1", "x")], listing({"/b": ["x"]}))
+
+
+def test_execute_swap(tmp_path):
+    for name in ["x", "y", "z"]:
+        with open(str(tmp_path / name), "w") as file:
+            file.write(name)
+    directory = str(tmp_path)
+    rename_plan = plan.plan_renames(
+        [
+            Rename(directory, "x", "y"),
+            Rename(directory, "y", "z"),
+            Rename(directory, "z", "x"),
+        ]
+    )
+    rename.rename_all(rename_plan.independent, jobs=4, sequences=rename_plan.sequences)
+    assert sorted(os.listdir(directory)) == ["x", "y", "z"]
+    for name, content in [("x", "z"), ("y", "x"), ("z", "y")]:
+        with open(str(tmp_path / name)) as file:
+            assert file.read() == content
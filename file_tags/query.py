@@ -0,0 +1,133 @@
+"""
+Query the tag index.
+
+Prints the paths of the indexed files that carry all of the given tags and none
+of the excluded ones. When paths are given, the index is first refreshed for them
+(only directories changed since the last refresh get re-listed) and the results
+are limited to the files under them.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import argparse
+import logging
+import sys
+
+from file_tags import exception
+from file_tags import index
+from file_tags import util
+
+
+log = logging.getLogger()
+
+
+class Config:
+    def __init__(
+        self,
+        index_path: str,
+        tag_names: List[str],
+        excluded_tag_names: List[str],
+        roots: List[str],
+        refresh: bool,
+        null_separated: bool,
+    ) -> None:
+        self.index_path = index_path
+        self.tag_names = tag_names
+        self.excluded_tag_names = excluded_tag_names
+        self.roots = roots
+        self.refresh = refresh
+        self.null_separated = null_separated
+
+    @classmethod
+    def from_command_line_args(cls, command_line_args: List):
+        parser = argparse.ArgumentParser(
+            prog="query",
+            formatter_class=argparse.RawTextHelpFormatter,
+            description=__doc__,
+        )
+        parser.add_argument(
+            "tags",
+            help=(
+                "what tag(s) the files need to have. To specify multiple tags "
+                "separate them with commas, e.g. tag1,tag2,tag3"
+            ),
+        )
+        parser.add_argument(
+            "paths", nargs="*", help="directories to refresh and limit the query to"
+        )
+        parser.add_argument(
+            "-x",
+            "--without",
+            metavar="TAGS",
+            default="",
+            help="comma separated tag(s) the files must not have",
+        )
+        parser.add_argument(
+            "--index",
+            default=index.DEFAULT_INDEX_PATH,
+            help="tag index location (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--no-refresh",
+            action="store_true",
+            help="query the index as it is, without refreshing it for the paths",
+        )
+        parser.add_argument(
+            "-0",
+            "--null",
+            action="store_true",
+            help="separate the printed paths with NUL instead of newline characters",
+        )
+        parsed = parser.parse_args(command_line_args)
+
+        try:
+            roots = util.validate_paths(parsed.paths)
+        except exception.Error as err:
+            log.error(util.fmt_err(err))
+            sys.exit(1)
+
+        return cls(
+            index_path=parsed.index,
+            tag_names=[name for name in parsed.tags.split(",") if name.strip()],
+            excluded_tag_names=[
+                name for name in parsed.without.split(",") if name.strip()
+            ],
+            roots=roots,
+            refresh=not parsed.no_refresh,
+            null_separated=parsed.null,
+        )
+
+
+def main(config: Config, tag_index: Optional[index.TagIndex] = None) -> None:
+    """
+    `tag_index` is an already open index to use when it's the one at
+    `config.index_path`. It's left open.
+    """
+    if tag_index is not None and tag_index.path == util.normalize_path(
+        config.index_path
+    ):
+        _query(config, tag_index)
+        return
+    with index.TagIndex(config.index_path) as tag_index:
+        _query(config, tag_index)
+
+
+def _query(config: Config, tag_index: index.TagIndex) -> None:
+    if config.roots and config.refresh:
+        result = tag_index.refresh(config.roots)
+        log.info(
+            "Index refreshed: {} directories scanned, {} unchanged, {} files parsed".format(
+                result.scanned_directory_count,
+                result.skipped_directory_count,
+                result.file_count,
+            )
+        )
+    separator = "\0" if config.null_separated else "\n"
+    match_count = 0
+    for path in tag_index.query(
+        config.tag_names, config.excluded_tag_names, config.roots
+    ):
+        sys.stdout.write(path + separator)
+        match_count += 1
+    sys.stdout.flush()
+    log.info("Matching files: {}".format(match_count))
@@ -0,0 +1,147 @@
+# pylint: disable=unused-wildcard-import
+from typing import *
+
+import os
+import threading
+
+from file_tags import exception
+from file_tags import util
+
+
+DEFAULT_JOBS = 8
+# The most renames a single worker task performs, so that huge directories are
+# spread across the worker pool as well.
+CHUNK_SIZE = 256
+HAS_DIR_FD = os.rename in os.supports_dir_fd
+
+
+class Rename(NamedTuple):
+    directory: str
+    name: str
+    new_name: str
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, self.name)
+
+    @property
+    def new_path(self) -> str:
+        return os.path.join(self.directory, self.new_name)
+
+
+def group_by_directory(
+    renames: Iterable[Rename], chunk_size: int = CHUNK_SIZE
+) -> List[Tuple[str, List[Rename]]]:
+    """
+    Group `renames` by their directory, in chunks of at most `chunk_size`.
+    """
+    by_directory: Dict[str, List[Rename]] = {}
+    for rename in renames:
+        by_directory.setdefault(rename.directory, []).append(rename)
+    return [
+        (directory, directory_renames[i : i + chunk_size])
+        for directory, directory_renames in by_directory.items()
+        for i in range(0, len(directory_renames), chunk_size)
+    ]
+
+
+def rename_all(
+    renames: Iterable[Rename],
+    jobs: int = DEFAULT_JOBS,
+    sequences: Iterable[List[Rename]] = (),
+) -> int:
+    """
+    Perform `renames` on `jobs` worker threads, one directory chunk per task.
+    Each of `sequences` is a list of renames in a single directory that are
+    performed in order, by a single task.
+
+    Where supported, each task opens its directory once and renames relative to
+    the directory's file descriptor, so no full path gets resolved per file.
+    Stops at the first failure and raises `exception.Error`.
+
+    Returns the number of renamed files.
+    """
+    chunks = group_by_directory(renames)
+    chunks.extend(
+        (sequence[0].directory, sequence) for sequence in sequences if sequence
+    )
+    total_count = sum(len(chunk) for _, chunk in chunks)
+    stop = threading.Event()
+    counter = _Counter()
+    first_err = None
+    if jobs <= 1 or len(chunks) <= 1:
+        try:
+            for directory, chunk in chunks:
+                _rename_chunk(directory, chunk, stop, counter)
+        except exception.Error as err:
+            first_err = err
+    else:
+        import concurrent.futures
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(_rename_chunk, directory, chunk, stop, counter)
+                for directory, chunk in chunks
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                err = future.exception()
+                if err is not None and first_err is None:
+                    first_err = err
+                    stop.set()
+                    for pending_future in futures:
+                        pending_future.cancel()
+
+    if first_err is not None:
+        raise exception.Error(
+            "While renaming files ({}/{} renamed): [1]."
+            "\n [1]: '{}'".format(counter.value, total_count, util.fmt_err(first_err))
+        )
+    return counter.value
+
+
+class _Counter:
+    def __init__(self) -> None:
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def increment(self) -> None:
+        with self._lock:
+            self.value += 1
+
+
+def _rename_chunk(
+    directory: str, chunk: List[Rename], stop: threading.Event, counter: _Counter
+) -> None:
+    directory_fd = None
+    if HAS_DIR_FD:
+        try:
+            directory_fd = os.open(
+                directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0)
+            )
+        except OSError:
+            directory_fd = None
+    try:
+        for rename in chunk:
+            if stop.is_set():
+                return
+            try:
+                if directory_fd is None:
+                    os.rename(rename.path, rename.new_path)
+                else:
+                    os.rename(
+                        rename.name,
+                        rename.new_name,
+                        src_dir_fd=directory_fd,
+                        dst_dir_fd=directory_fd,
+                    )
+            except OSError as err:
+                raise exception.Error(
+                    "While renaming a file from [1] to [2]: [3]."
+                    "\n [1]: '{}'"
+                    "\n [2]: '{}'"
+                    "\n [3]: '{}'".format(rename.path, rename.new_path, err)
+                )
+            counter.increment()
+    finally:
+        if directory_fd is not None:
+            os.close(directory_fd)
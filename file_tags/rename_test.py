@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from file_tags import exception
+from file_tags import rename
+
+
+def test_group_by_directory():
+    renames = [
+        rename.Rename("/a", "1", "1x"),
+        rename.Rename("/b", "2", "2x"),
+        rename.Rename("/a", "3", "3x"),
+        rename.Rename("/a", "4", "4x"),
+    ]
+    assert rename.group_by_directory(renames) == [
+        ("/a", [renames[0], renames[2], renames[3]]),
+        ("/b", [renames[1]]),
+    ]
+    assert rename.group_by_directory(renames, chunk_size=2) == [
+        ("/a", [renames[0], renames[2]]),
+        ("/a", [renames[3]]),
+        ("/b", [renames[1]]),
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 4])
+def test_rename_all(tmp_path, jobs):
+    renames = []
+    for directory_index in range(5):
+        directory = tmp_path / str(directory_index)
+        directory.mkdir()
+        for file_index in range(rename.CHUNK_SIZE + 1):
+            name = "file {}".format(file_index)
+            (directory / name).touch()
+            renames.append(rename.Rename(str(directory), name, name + " #tag"))
+
+    assert rename.rename_all(renames, jobs=jobs) == len(renames)
+    for planned_rename in renames:
+        assert not os.path.exists(planned_rename.path)
+        assert os.path.exists(planned_rename.new_path)
+
+
+def test_rename_all_failure(tmp_path):
+    (tmp_path / "a").touch()
+    renames = [
+        rename.Rename(str(tmp_path), "a", "a #tag"),
+        rename.Rename(str(tmp_path), "missing", "missing #tag"),
+    ]
+    with pytest.raises(exception.Error):
+        rename.rename_all(renames, jobs=2)
@@ -0,0 +1,280 @@
+"""
+Rename a tag, or merge several tags into one, across a whole archive.
+
+Only the files carrying one of the old tags are parsed and renamed. They're
+looked up in the tag index when there's one (after refreshing it for the paths,
+which only rescans directories changed since), otherwise the paths are walked
+and only the file names containing the old tags are parsed.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+
+from file_tags import exception
+from file_tags import index
+from file_tags import plan
+from file_tags import rename
+from file_tags import tags as tagger
+from file_tags import util
+from file_tags import walk
+
+
+log = logging.getLogger()
+
+DEFAULT_PROGRESS_INTERVAL = 5.0
+# How many files are counted between looks at the clock.
+PROGRESS_CHECK_COUNT = 1024
+
+
+class Config:
+    def __init__(
+        self,
+        old_tags: List[tagger.Tag],
+        new_tag: tagger.Tag,
+        roots: List[str],
+        index_path: Optional[str],
+        no_action: bool,
+        jobs: int = rename.DEFAULT_JOBS,
+        progress_interval: float = DEFAULT_PROGRESS_INTERVAL,
+    ) -> None:
+        self.old_tags = old_tags
+        self.new_tag = new_tag
+        self.roots = roots
+        # The paths are scanned when None or when there's no index there.
+        self.index_path = index_path
+        self.no_action = no_action
+        self.jobs = jobs
+        self.progress_interval = progress_interval
+
+    @classmethod
+    def from_command_line_args(cls, command_line_args: List):
+        parser = argparse.ArgumentParser(
+            prog="retag",
+            formatter_class=argparse.RawTextHelpFormatter,
+            description=__doc__,
+        )
+        parser.add_argument(
+            "old_tags",
+            help=(
+                "the tag(s) to replace. To merge multiple tags separate them "
+                "with commas, e.g. whale,whales"
+            ),
+        )
+        parser.add_argument("new_tag", help="the tag to replace them with")
+        parser.add_argument("paths", nargs="+", help="directories to retag")
+        parser.add_argument(
+            "--index",
+            default=index.DEFAULT_INDEX_PATH,
+            help=(
+                "tag index to find the files with, when it exists "
+                "(default: %(default)s)"
+            ),
+        )
+        parser.add_argument(
+            "--no-index",
+            action="store_true",
+            help="scan the paths even when there's a tag index",
+        )
+        parser.add_argument(
+            "-n", "--no-action", help="don't rename files", action="store_true"
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            metavar="N",
+            type=int,
+            default=rename.DEFAULT_JOBS,
+            help="how many renames to run concurrently (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--progress",
+            metavar="SECONDS",
+            type=float,
+            default=DEFAULT_PROGRESS_INTERVAL,
+            help="how often to log the progress (default: %(default)s)",
+        )
+        parsed = parser.parse_args(command_line_args)
+
+        try:
+            old_tags = [
+                tagger.intern_tag(name)
+                for name in parsed.old_tags.split(",")
+                if name.strip()
+            ]
+            new_tag = tagger.intern_tag(parsed.new_tag)
+            roots = util.validate_paths(parsed.paths)
+        except exception.Error as err:
+            log.error(util.fmt_err(err))
+            sys.exit(1)
+        if not old_tags:
+            parser.error("no tags to replace given")
+        for root in roots:
+            if not os.path.isdir(root):
+                parser.error("'{}' isn't a directory".format(root))
+
+        return cls(
+            old_tags=old_tags,
+            new_tag=new_tag,
+            roots=roots,
+            index_path=None if parsed.no_index else parsed.index,
+            no_action=parsed.no_action,
+            jobs=parsed.jobs,
+            progress_interval=parsed.progress,
+        )
+
+
+class Progress:
+    """
+    Counts the files looked at and the ones found to carry the tags, logging
+    the counts every `interval` seconds.
+    """
+
+    def __init__(self, interval: float = DEFAULT_PROGRESS_INTERVAL) -> None:
+        self.interval = interval
+        self.scanned_count = 0
+        self.found_count = 0
+        self._start = time.monotonic()
+        self._next_log_time = self._start + interval
+
+    def log_if_due(self) -> None:
+        now = time.monotonic()
+        if now < self._next_log_time:
+            return
+        self._next_log_time = now + self.interval
+        log.info(
+            "Scanned {} files ({:.0f}/s), found {} with the tags ...".format(
+                self.scanned_count,
+                self.scanned_count / (now - self._start),
+                self.found_count,
+            )
+        )
+
+
+def scan_paths(
+    roots: Iterable[str],
+    tags: Iterable[tagger.Tag],
+    progress: Optional[Progress] = None,
+) -> Iterator[str]:
+    """
+    Lazily yield the files under `roots` whose names may carry one of `tags`.
+
+    Each word of a normalized tag name appears as it is in the names of the
+    files carrying the tag, so only the names containing the longest word of
+    one of the tags are yielded, to be parsed by the caller.
+    """
+    search = re.compile(
+        "|".join(
+            re.escape(max(tag.name.split(tagger.TAG_WORD_SEP), key=len)) for tag in tags
+        )
+    ).search
+    progress = progress or Progress(float("inf"))
+    for path in walk.walk_paths(roots):
+        progress.scanned_count += 1
+        if search(path, path.rfind(os.sep) + 1):
+            progress.found_count += 1
+            yield path
+        if not progress.scanned_count % PROGRESS_CHECK_COUNT:
+            progress.log_if_due()
+
+
+def indexed_paths(
+    tag_index: index.TagIndex,
+    roots: Iterable[str],
+    tags: Iterable[tagger.Tag],
+    progress: Optional[Progress] = None,
+) -> Iterator[str]:
+    """
+    Lazily yield the indexed files under `roots` that carry one of `tags`.
+    """
+    roots = list(roots)
+    tags = set(tags)
+    progress = progress or Progress(float("inf"))
+    # Only needed for files carrying several of the tags.
+    seen_paths: Optional[Set[str]] = set() if len(tags) > 1 else None
+    for tag in tags:
+        for path in tag_index.query([tag.name], roots=roots):
+            if seen_paths is not None:
+                if path in seen_paths:
+                    continue
+                seen_paths.add(path)
+            progress.scanned_count += 1
+            progress.found_count += 1
+            yield path
+            if not progress.found_count % PROGRESS_CHECK_COUNT:
+                progress.log_if_due()
+
+
+def main(config: Config, tag_index: Optional[index.TagIndex] = None) -> None:
+    """
+    `tag_index` is an already open index to use when it's the one at
+    `config.index_path`. It's left open.
+    """
+    if config.index_path is None:
+        _retag(config, None)
+        return
+    if tag_index is not None and tag_index.path == util.normalize_path(
+        config.index_path
+    ):
+        _retag(config, tag_index)
+        return
+    if not os.path.exists(util.normalize_path(config.index_path)):
+        log.info("No tag index at '{}', scanning the paths".format(config.index_path))
+        _retag(config, None)
+        return
+    with index.TagIndex(config.index_path) as tag_index:
+        _retag(config, tag_index)
+
+
+def _retag(config: Config, tag_index: Optional[index.TagIndex]) -> None:
+    log.info(
+        "Retag: {} -> {}".format(
+            ", ".join(tag.name for tag in config.old_tags), config.new_tag.name
+        )
+    )
+    expression = tagger.TagExpression(
+        [("~", old_tag, config.new_tag) for old_tag in config.old_tags]
+    )
+    progress = Progress(config.progress_interval)
+    if tag_index is not None:
+        result = tag_index.refresh(config.roots)
+        log.info(
+            "Index refreshed: {} directories scanned, {} unchanged".format(
+                result.scanned_directory_count, result.skipped_directory_count
+            )
+        )
+        paths = indexed_paths(tag_index, config.roots, config.old_tags, progress)
+    else:
+        paths = scan_paths(config.roots, config.old_tags, progress)
+
+    # The scan's candidates only may carry the tags.
+    where = tagger.TagPredicate(
+        " or ".join(
+            "{}{}".format(tagger.TAG_START_CHAR, tag.name) for tag in config.old_tags
+        )
+    )
+    changed_files, file_count = tagger.collect_changes(
+        paths, expression.apply, where=where
+    )
+    log.info("Files scanned: {}, parsed: {}".format(progress.scanned_count, file_count))
+    if not changed_files:
+        log.info("Exiting ... (no files to rename)")
+        return
+    tagger.list_files(changed_files.planned_renames())
+
+    rename_plan = plan.plan_renames(changed_files.planned_renames())
+    if config.no_action:
+        log.info("Exiting ... (--no-action)")
+        return
+
+    log.info("Renaming the files ...")
+    tagger.execute_plan(rename_plan, jobs=config.jobs)
+    log.info("Files successfully renamed.")
+    if tag_index is not None:
+        # Only the directories with renamed files get rescanned.
+        tag_index.refresh(config.roots)
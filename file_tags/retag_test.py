@@ -0,0 +1,80 @@
+import os
+
+from file_tags import index
+from file_tags import retag
+from file_tags import tags as tagger
+
+
+NAMES = [
+    "a {0}flying--whales.jpg",
+    "b {0}whale {0}sea.jpg",
+    "sub/c {0}flying-whales {0}whale.jpg",
+    "sub/d {0}whales {0}flying.jpg",
+    "sub/whale e.jpg",
+    "f.jpg",
+]
+TREE_NAMES = [name.format(tagger.TAG_START_CHAR) for name in NAMES]
+EXPECTED_NAMES = [
+    "a #whales.jpg",
+    "b #sea #whales.jpg",
+    "sub/c #whales.jpg",
+    "sub/d #whales #flying.jpg",
+    "sub/whale e.jpg",
+    "f.jpg",
+]
+
+
+def test_scan_paths(tmp_path, make_tree):
+    make_tree(tmp_path, TREE_NAMES)
+    progress = retag.Progress()
+    paths = retag.scan_paths(
+        [str(tmp_path)], [tagger.Tag("flying-whales"), tagger.Tag("whale")], progress
+    )
+    # Only the names containing "whales" or "whale" are candidates.
+    assert sorted(os.path.relpath(path, str(tmp_path)) for path in paths) == (
+        TREE_NAMES[:5]
+    )
+    assert progress.scanned_count == 6
+    assert progress.found_count == 5
+
+
+def test_retag(tmp_path, make_tree, tree_names):
+    tree = tmp_path / "tree"
+    make_tree(tree, TREE_NAMES)
+    config = retag.Config.from_command_line_args(
+        ["flying-whales,whale", "whales", str(tree), "--no-index"]
+    )
+    retag.main(config)
+    assert tree_names(tree) == sorted(EXPECTED_NAMES)
+
+
+def test_retag_with_index(tmp_path, make_tree, tree_names):
+    tree = tmp_path / "tree"
+    make_tree(tree, TREE_NAMES)
+    index_path = str(tmp_path / "index.sqlite3")
+    with index.TagIndex(index_path) as tag_index:
+        tag_index.refresh([str(tree)])
+        config = retag.Config.from_command_line_args(
+            ["flying-whales,whale", "whales", str(tree), "--index", index_path]
+        )
+        assert sorted(
+            os.path.basename(path)
+            for path in retag.indexed_paths(tag_index, config.roots, config.old_tags)
+        ) == [
+            "a #flying--whales.jpg",
+            "b #whale #sea.jpg",
+            "c #flying-whales #whale.jpg",
+        ]
+
+        retag.main(config, tag_index)
+        assert tree_names(tree) == sorted(EXPECTED_NAMES)
+        # The index is up to date with the renames.
+        assert sorted(
+            os.path.basename(path) for path in tag_index.query(["whales"])
+        ) == [
+            "a #whales.jpg",
+            "b #sea #whales.jpg",
+            "c #whales.jpg",
+            "d #whales #flying.jpg",
+        ]
+        assert list(tag_index.query(["whale"])) == []
@@ -0,0 +1,226 @@
+"""
+Serve tag actions and queries over a local Unix socket.
+
+Keeps a warm process, optionally with the tag index open, and runs the command
+lines that clients forward to it. Run file_tags.py with the FILE_TAGS_SOCKET
+environment variable set to the socket path to forward commands to the server.
+Interactive mode and reading paths from stdin aren't forwarded.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import argparse
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import sys
+
+from file_tags import client
+from file_tags import exception
+from file_tags import index
+from file_tags import tags as tagger
+from file_tags import util
+
+
+log = logging.getLogger()
+
+
+class Config:
+    def __init__(self, socket_path: str, index_path: Optional[str]) -> None:
+        self.socket_path = socket_path
+        self.index_path = index_path
+
+    @classmethod
+    def from_command_line_args(cls, command_line_args: List):
+        parser = argparse.ArgumentParser(
+            prog="serve",
+            formatter_class=argparse.RawTextHelpFormatter,
+            description=__doc__,
+        )
+        parser.add_argument(
+            "--socket",
+            default=client.DEFAULT_SOCKET_PATH,
+            help="socket path to listen on (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--index",
+            metavar="PATH",
+            nargs="?",
+            const=index.DEFAULT_INDEX_PATH,
+            help="keep the tag index at PATH open for queries (default: %(const)s)",
+        )
+        parsed = parser.parse_args(command_line_args)
+        return cls(
+            socket_path=util.normalize_path(parsed.socket),
+            index_path=parsed.index,
+        )
+
+
+# How much output is buffered before it's sent to the client.
+RELAY_BUFFER_SIZE = 1 << 16
+
+
+class _Relay:
+    """
+    Sends the output of a command to the client as `stream` messages, merging
+    consecutive writes to the same stream.
+    """
+
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.stream: Optional[str] = None
+        self.buffer: List[str] = []
+        self.buffer_size = 0
+
+    def write(self, stream: str, data: str) -> None:
+        if stream != self.stream:
+            self.flush()
+            self.stream = stream
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= RELAY_BUFFER_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            send(self.connection, {"stream": self.stream, "data": "".join(self.buffer)})
+        self.buffer = []
+        self.buffer_size = 0
+
+
+class _StreamWriter(io.TextIOBase):
+    def __init__(self, relay: _Relay, stream: str) -> None:
+        super().__init__()
+        self.relay = relay
+        self.stream = stream
+
+    def write(self, data: str) -> int:
+        if data:
+            self.relay.write(self.stream, data)
+        return len(data)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    server: "Server"
+
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        if not line:
+            # E.g. another server checking if this one is alive.
+            return
+        try:
+            request = json.loads(line)
+            command_line_args = list(request["args"])
+            cwd = request["cwd"]
+        except (ValueError, KeyError, TypeError):
+            exit_code = 2
+        else:
+            relay = _Relay(self.connection)
+            exit_code = self.server.execute(command_line_args, cwd, relay)
+            relay.flush()
+        send(self.connection, {"exit_code": exit_code})
+
+    def finish(self) -> None:
+        try:
+            super().finish()
+        except OSError:
+            # The client went away.
+            pass
+
+
+class Server(socketserver.UnixStreamServer):
+    """
+    Runs one forwarded command at a time, since commands change the working
+    directory and the standard streams of the process.
+    """
+
+    def __init__(self, socket_path: str, tag_index: Optional[index.TagIndex]) -> None:
+        self.tag_index = tag_index
+        super().__init__(socket_path, RequestHandler)
+
+    def server_bind(self) -> None:
+        super().server_bind()
+        # Anyone who can connect can rename files as this user. Nobody can
+        # connect before `server_activate` starts listening.
+        os.chmod(self.server_address, 0o600)
+
+    def execute(self, command_line_args: List[str], cwd: str, relay: _Relay) -> int:
+        stdout = _StreamWriter(relay, "stdout")
+        stderr = _StreamWriter(relay, "stderr")
+        saved_handlers = log.handlers[:]
+        saved_streams = sys.stdin, sys.stdout, sys.stderr
+        saved_cwd = os.getcwd()
+        for handler in saved_handlers:
+            log.removeHandler(handler)
+        util.setup_terminal_logging(log, stream=stderr)
+        sys.stdin, sys.stdout, sys.stderr = io.StringIO(), stdout, stderr
+        try:
+            os.chdir(cwd)
+            command_kwargs = {}
+            if (
+                command_line_args[:1] in (["query"], ["retag"])
+                and self.tag_index is not None
+            ):
+                command_kwargs["tag_index"] = self.tag_index
+            tagger.run_command(command_line_args, **command_kwargs)
+        except SystemExit as err:
+            return err.code if isinstance(err.code, int) else int(err.code is not None)
+        except OSError as err:
+            log.error(util.fmt_err(err))
+            return 1
+        finally:
+            os.chdir(saved_cwd)
+            sys.stdin, sys.stdout, sys.stderr = saved_streams
+            for handler in log.handlers[:]:
+                log.removeHandler(handler)
+            for handler in saved_handlers:
+                log.addHandler(handler)
+        return 0
+
+    def handle_error(self, request, client_address) -> None:
+        if isinstance(sys.exc_info()[1], OSError):
+            # The client went away.
+            return
+        super().handle_error(request, client_address)
+
+
+def send(connection, message: Dict) -> None:
+    connection.sendall(json.dumps(message).encode() + b"\n")
+
+
+def main(config: Config) -> None:
+    if os.path.exists(config.socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with probe:
+            try:
+                probe.connect(config.socket_path)
+            except OSError:
+                # A leftover from a server that didn't shut down cleanly.
+                os.remove(config.socket_path)
+            else:
+                raise exception.Error(
+                    "While starting the server on [1]: [2]."
+                    "\n [1]: '{}'"
+                    "\n [2]: 'Another server is already listening.'".format(
+                        config.socket_path
+                    )
+                )
+    os.makedirs(os.path.dirname(config.socket_path), mode=0o700, exist_ok=True)
+    tag_index = index.TagIndex(config.index_path) if config.index_path else None
+    # Shut down cleanly, removing the socket, when terminated.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        with Server(config.socket_path, tag_index) as server:
+            log.info("Listening on '{}'".format(config.socket_path))
+            if tag_index is not None:
+                log.info("Tag index: '{}'".format(tag_index.path))
+            server.serve_forever()
+    finally:
+        if tag_index is not None:
+            tag_index.close()
+        if os.path.exists(config.socket_path):
+            os.remove(config.socket_path)
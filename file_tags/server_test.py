@@ -0,0 +1,68 @@
+import os
+import stat
+import subprocess
+import sys
+import threading
+
+from file_tags import client
+from file_tags import server
+from file_tags import tags as tagger
+
+FILE_TAGS_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "file_tags.py"
+)
+
+
+def test_can_forward():
+    assert client.can_forward(["add", "tag", "file"])
+    assert not client.can_forward([])
+    assert not client.can_forward(["serve"])
+    assert not client.can_forward(["watch", "dir"])
+    assert not client.can_forward(["add", "tag", "file", "-i"])
+    assert not client.can_forward(["add", "tag", "file", "-ni"])
+    assert not client.can_forward(["add", "tag", "-0"])
+    assert not client.can_forward(["add", "tag", "-n0"])
+    # Abbreviated options.
+    assert not client.can_forward(["add", "x", "--from"])
+    assert not client.can_forward(["add", "x", "a", "--inter"])
+    assert client.can_forward(["add", "x", "a", "--no-act"])
+
+
+def test_server(tmp_path, capsys):
+    socket_path = str(tmp_path / "server.sock")
+    (tmp_path / "file.jpg").touch()
+    with server.Server(socket_path, tag_index=None) as tag_server:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        thread = threading.Thread(target=tag_server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            assert client.forward(socket_path, ["--version"]) == 0
+            assert capsys.readouterr().out.strip() == tagger.VERSION
+            assert client.forward(str(tmp_path / "missing.sock"), ["--version"]) is None
+
+            env = dict(os.environ, **{client.SOCKET_ENV_VAR: socket_path})
+            completed = subprocess.run(
+                [sys.executable, FILE_TAGS_SCRIPT, "add", "abc", "file.jpg"],
+                cwd=str(tmp_path),
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            assert completed.returncode == 0
+            assert "Files successfully renamed." in completed.stderr
+            assert (tmp_path / "file {0}abc.jpg".format(tagger.TAG_START_CHAR)).exists()
+
+            completed = subprocess.run(
+                [sys.executable, FILE_TAGS_SCRIPT, "add", "abc", "missing.jpg"],
+                cwd=str(tmp_path),
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            assert completed.returncode == 1
+            assert "missing.jpg" in completed.stderr
+        finally:
+            tag_server.shutdown()
+            thread.join()
@@ -0,0 +1,311 @@
+"""
+Tagging from a long-running process, without the command line.
+
+`tags.main` is made for the command line: it logs the planned renames, asks for
+confirmation and exits the process when it's done or when something fails. A
+`Session` does the same work as plan and apply steps that return their results
+and raise `exception.Error`, so it can be reused across many jobs in one warm
+process.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import os
+
+from file_tags import exception
+from file_tags import metrics
+from file_tags import plan
+from file_tags import rename
+from file_tags import store
+from file_tags import tags as tagger
+from file_tags import util
+from file_tags import walk
+
+
+class Change(NamedTuple):
+    path: str
+    new_path: str
+    added_tags: List[str]
+    removed_tags: List[str]
+
+
+class SessionPlan:
+    """
+    The renames worked out by `Session.plan`, already checked for conflicts.
+    """
+
+    def __init__(
+        self,
+        changed_files: store.FileStore,
+        file_count: int,
+        rename_plan: plan.RenamePlan,
+    ) -> None:
+        self.changed_files = changed_files
+        # How many files were looked at.
+        self.file_count = file_count
+        self.rename_plan = rename_plan
+        # Set by `Session.apply`.
+        self.renamed_count: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.changed_files)
+
+    def __repr__(self) -> str:
+        return "{}({} files, {} to rename)".format(
+            self.__class__.__name__, self.file_count, len(self)
+        )
+
+    @property
+    def applied(self) -> bool:
+        return self.renamed_count is not None
+
+    def changes(self) -> Iterator[Change]:
+        changed_files = self.changed_files
+        for index in range(len(changed_files)):
+            directory = changed_files.directory(index)
+            added_tag_names, removed_tag_names = tagger.tag_changes(
+                changed_files, index
+            )
+            yield Change(
+                path=os.path.join(directory, changed_files.names[index]),
+                new_path=os.path.join(directory, changed_files.new_names[index]),
+                added_tags=added_tag_names,
+                removed_tags=removed_tag_names,
+            )
+
+
+class Session:
+    """
+    Plans and applies tag changes, raising `exception.Error` on failure.
+
+    The options match the ones of the command line, `run_metrics` records the
+    phases of the work like --stats does. When `listing_cache_path`
+    is set, recursive plans walk through a `listing_cache.ListingCache` there,
+    which stays loaded for the whole session and is saved after each plan. With
+    `processes`, the pool of worker processes is started by the first plan and
+    kept for the whole session.
+
+    With `concurrency`, the work runs on its own event loop: such a session
+    can't be used from a coroutine, only from a thread (e.g. via
+    `asyncio.to_thread`).
+
+    Usage:
+        with Session() as session:
+            session_plan = session.plan(paths, "+final,-draft")
+            for change in session_plan.changes():
+                ...
+            session.apply(session_plan)
+    """
+
+    def __init__(
+        self,
+        jobs: int = rename.DEFAULT_JOBS,
+        concurrency: Optional[int] = None,
+        processes: Optional[int] = None,
+        listing_cache_path: Optional[str] = None,
+        run_metrics: Union[metrics.Metrics, metrics.NullMetrics] = metrics.NULL_METRICS,
+    ) -> None:
+        if concurrency is not None and processes is not None:
+            raise exception.Error("concurrency and processes can't be used together.")
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.processes = processes
+        self.metrics = run_metrics
+        self._executor = None
+        self.listing_cache = None
+        if listing_cache_path is not None:
+            from file_tags import listing_cache
+
+            self.listing_cache = listing_cache.ListingCache(listing_cache_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.listing_cache is not None:
+            self.listing_cache.save()
+
+    def plan(
+        self,
+        paths: Iterable[str],
+        expression: Union[str, tagger.TagExpression],
+        where: Union[str, tagger.TagPredicate, None] = None,
+        recursive: bool = False,
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        max_depth: Optional[int] = None,
+    ) -> SessionPlan:
+        """
+        Work out the renames applying `expression` (e.g. "+final,-draft", see
+        `tags.TagExpression`) to the files at `paths` whose tags match `where`
+        (e.g. "2019 and not keep", see `tags.TagPredicate`). With `recursive`,
+        directories in `paths` are walked like with --recursive.
+
+        Raises `exception.Error` for invalid expressions, missing paths and
+        conflicting renames. Nothing is renamed.
+        """
+        changed_files, file_count = self.collect(
+            paths, expression, where, recursive, include, exclude, max_depth
+        )
+        return SessionPlan(changed_files, file_count, self.check(changed_files))
+
+    def collect(
+        self,
+        paths: Iterable[str],
+        expression: Union[str, tagger.TagExpression],
+        where: Union[str, tagger.TagPredicate, None] = None,
+        recursive: bool = False,
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        max_depth: Optional[int] = None,
+    ) -> Tuple[store.FileStore, int]:
+        """
+        The first step of `plan`: the files whose name changes, not checked for
+        conflicts yet, and the number of files looked at.
+
+        `paths` are consumed lazily and validated in chunks, so they can come
+        from a stream of any length.
+        """
+        self._check_event_loop()
+        if isinstance(expression, str):
+            expression = tagger.TagExpression.compile(expression)
+        if isinstance(where, str):
+            where = tagger.TagPredicate(where)
+        run_metrics = self.metrics
+
+        file_paths: Iterable = (
+            # The pipeline validates the paths itself, concurrently.
+            map(util.normalize_path, paths)
+            if self.concurrency
+            else tagger.validate_paths_in_chunks(paths, run_metrics)
+        )
+        parsed = False
+        if recursive and self.listing_cache is not None:
+            from file_tags import listing_cache
+
+            file_paths = listing_cache.walk_paths(
+                file_paths, self.listing_cache, include, exclude, max_depth
+            )
+            if self.concurrency or self.processes is not None:
+                # Only the listings are reused, the names get parsed again.
+                file_paths = (path for path, _ in file_paths)
+            else:
+                parsed = True
+        elif recursive:
+            file_paths = walk.walk_paths(file_paths, include, exclude, max_depth)
+
+        if self.concurrency:
+            from file_tags import pipeline
+
+            # Scanning, validation and parsing overlap, so they're a single
+            # phase.
+            with run_metrics.phase("collect") as phase:
+                changed_files, file_count = pipeline.collect_changes(
+                    file_paths,
+                    expression.apply,
+                    concurrency=self.concurrency,
+                    where=where,
+                )
+                phase.item_count += file_count
+        elif self.processes is not None:
+            import concurrent.futures
+            from file_tags import shard
+
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes or None
+                )
+            with run_metrics.phase("collect") as phase:
+                changed_files, file_count = shard.collect_changes(
+                    file_paths,
+                    expression,
+                    self.processes,
+                    where=where,
+                    executor=self._executor,
+                )
+                phase.item_count += file_count
+        else:
+            changed_files, file_count = tagger.collect_changes(
+                file_paths, expression.apply, run_metrics, where, parsed=parsed
+            )
+        # Only the changed files are kept, so the paths can repeat without
+        # keeping all of them around.
+        changed_files.drop_repeats()
+        if self.listing_cache is not None:
+            self.listing_cache.save()
+        return changed_files, file_count
+
+    def check(self, changed_files: store.FileStore) -> "plan.RenamePlan":
+        """
+        The second step of `plan`: check the renames of `changed_files` for
+        conflicts and work out their order.
+        """
+        self._check_event_loop()
+        with self.metrics.phase("check") as phase:
+            if self.concurrency:
+                from file_tags import pipeline
+
+                rename_plan = pipeline.plan_renames(
+                    changed_files.planned_renames(), concurrency=self.concurrency
+                )
+            else:
+                rename_plan = plan.plan_renames(changed_files.planned_renames())
+            phase.item_count += len(rename_plan)
+        return rename_plan
+
+    def apply(self, session_plan: SessionPlan) -> int:
+        """
+        Perform the renames of `session_plan`. Returns the number of renamed
+        files, also kept in `session_plan.renamed_count`.
+
+        Stops at the first failure and raises `exception.Error`, the plan then
+        needs to be worked out again.
+        """
+        if session_plan.applied:
+            raise exception.Error("The plan was applied already.")
+        self._check_event_loop()
+        rename_plan = session_plan.rename_plan
+        with self.metrics.phase("rename") as phase:
+            if self.concurrency:
+                from file_tags import pipeline
+
+                renamed_count = pipeline.execute_plan(
+                    rename_plan, concurrency=self.concurrency
+                )
+            else:
+                renamed_count = rename.rename_all(
+                    rename_plan.independent,
+                    jobs=self.jobs,
+                    sequences=rename_plan.sequences,
+                )
+            phase.item_count += len(rename_plan)
+        session_plan.renamed_count = renamed_count
+        return renamed_count
+
+    def _check_event_loop(self) -> None:
+        if not self.concurrency:
+            return
+        import asyncio
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        raise exception.Error(
+            "A session with concurrency can't be used from a running event loop,"
+            " use it from another thread (e.g. via asyncio.to_thread)."
+        )
+
+    def run(self, *args, **kwargs) -> SessionPlan:
+        """
+        `plan` with the given arguments, then `apply`. Returns the applied plan.
+        """
+        session_plan = self.plan(*args, **kwargs)
+        self.apply(session_plan)
+        return session_plan
@@ -0,0 +1,115 @@
+import asyncio
+import os
+
+import pytest
+
+from file_tags import exception
+from file_tags import session
+from file_tags import tags as tagger
+
+
+def test_plan_and_apply(tmp_path, make_tree, tree_names):
+    paths = make_tree(tmp_path, ["a #draft.jpg", "b.jpg", "c #final.jpg"])
+    with session.Session() as tag_session:
+        session_plan = tag_session.plan(paths, "+final,-draft")
+        assert (session_plan.file_count, len(session_plan)) == (3, 2)
+        assert sorted(session_plan.changes()) == [
+            session.Change(
+                path=paths[0],
+                new_path=os.path.join(str(tmp_path), "a #final.jpg"),
+                added_tags=["final"],
+                removed_tags=["draft"],
+            ),
+            session.Change(
+                path=paths[1],
+                new_path=os.path.join(str(tmp_path), "b #final.jpg"),
+                added_tags=["final"],
+                removed_tags=[],
+            ),
+        ]
+        # Planning doesn't rename anything.
+        assert tree_names(tmp_path) == ["a #draft.jpg", "b.jpg", "c #final.jpg"]
+
+        assert tag_session.apply(session_plan) == 2
+        assert session_plan.applied
+        assert tree_names(tmp_path) == ["a #final.jpg", "b #final.jpg", "c #final.jpg"]
+        with pytest.raises(exception.Error, match="applied already"):
+            tag_session.apply(session_plan)
+
+        # The session is reusable.
+        session_plan = tag_session.run(
+            [str(tmp_path)],
+            tagger.TagExpression.compile("~final=done"),
+            "not final",
+            recursive=True,
+        )
+        assert (session_plan.file_count, session_plan.renamed_count) == (3, 0)
+        session_plan = tag_session.run(paths[2:], "~final=done", "final")
+        assert session_plan.renamed_count == 1
+        assert tree_names(tmp_path) == ["a #final.jpg", "b #final.jpg", "c #done.jpg"]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{"jobs": 4}, {"concurrency": 4}, {"processes": 2}, {"listing_cache_path": None}],
+)
+def test_options(tmp_path, options, make_tree, tree_names):
+    if "listing_cache_path" in options:
+        options = {"listing_cache_path": str(tmp_path / "listings.marshal")}
+    tree = tmp_path / "tree"
+    make_tree(tree, ["a #x.jpg", "sub/b.jpg", "sub/c #x #y.jpg", "sub/d #y.jpg"])
+    with session.Session(**options) as tag_session:
+        session_plan = tag_session.run(
+            [str(tree), str(tree / "sub")],
+            "+z",
+            "x or y and not x",
+            recursive=True,
+            exclude=["d*"],
+        )
+    assert session_plan.file_count == 3
+    assert tree_names(tree) == [
+        "a #x #z.jpg",
+        os.path.join("sub", "b.jpg"),
+        os.path.join("sub", "c #x #y #z.jpg"),
+        os.path.join("sub", "d #y.jpg"),
+    ]
+
+
+def test_process_pool(tmp_path, make_tree):
+    paths = make_tree(tmp_path, ["a.jpg", "b #x.jpg"])
+    with session.Session(processes=2) as tag_session:
+        session_plan = tag_session.plan(paths, "+x")
+        executor = tag_session._executor
+        assert len(session_plan) == 1
+        # Reused by the next plans.
+        assert len(tag_session.plan(paths, "-x")) == 1
+        assert tag_session._executor is executor
+    assert tag_session._executor is None
+
+
+def test_errors(tmp_path, make_tree, tree_names):
+    paths = make_tree(tmp_path, ["a #x.jpg", "a.jpg"])
+    tag_session = session.Session()
+    for args in (
+        ([paths[0]], "x"),
+        ([paths[0]], "+x", "x and"),
+        ([str(tmp_path / "missing.jpg")], "+x"),
+        # Would overwrite "a.jpg".
+        ([paths[0]], "-x"),
+    ):
+        with pytest.raises(exception.Error):
+            tag_session.plan(*args)
+    assert tree_names(tmp_path) == ["a #x.jpg", "a.jpg"]
+
+    session_plan = tag_session.plan([paths[1]], "+y")
+    os.remove(paths[1])
+    with pytest.raises(exception.Error, match="While renaming files"):
+        tag_session.apply(session_plan)
+    assert not session_plan.applied
+
+    async def plan_in_event_loop():
+        with session.Session(concurrency=4) as tag_session:
+            tag_session.plan([paths[0]], "+y")
+
+    with pytest.raises(exception.Error, match="running event loop"):
+        asyncio.run(plan_in_event_loop())
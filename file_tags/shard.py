@@ -0,0 +1,114 @@
+"""
+Parsing and planning on a pool of processes.
+
+Parsing file names and computing their new names is pure CPU work, so on big
+trees it's spread across processes. The paths are sharded by directory and each
+worker sends back only the files whose name changes, as the columns of a
+`store.FileStore`, which the parent merges. Checking and executing the merged
+renames stays in the parent.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import concurrent.futures
+import itertools
+import os
+
+from file_tags import store
+from file_tags import tags as tagger
+
+
+# The most files in a single shard. Smaller shards balance the load better,
+# bigger ones cost less to send around.
+SHARD_SIZE = 5_000
+# How many paths are grouped by directory at a time.
+WINDOW_SIZE = 100_000
+
+
+def collect_changes(
+    file_paths: Iterable[str],
+    expression: tagger.TagExpression,
+    processes: Optional[int] = None,
+    shard_size: int = SHARD_SIZE,
+    where: Optional[tagger.TagPredicate] = None,
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> Tuple[store.FileStore, int]:
+    """
+    `tags.collect_changes` on `processes` worker processes (default: one per
+    CPU), applying `expression` to each file matching `where`, if given.
+
+    `executor` is an already running pool of `processes` workers to use, it's
+    left running. Otherwise a pool is started for the call.
+
+    Returns the files whose name changes and the number of files.
+    """
+    processes = processes or os.cpu_count() or 1
+    if executor is None:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            return collect_changes(
+                file_paths, expression, processes, shard_size, where, executor
+            )
+
+    changed_files = store.FileStore()
+    file_count = 0
+    pending: Set[concurrent.futures.Future] = set()
+    for directory, names in _shards(file_paths, shard_size):
+        file_count += len(names)
+        pending.add(
+            executor.submit(_collect_shard_changes, directory, names, expression, where)
+        )
+        # Keeps the memory bound when the paths come faster than the workers
+        # handle them.
+        if len(pending) >= 2 * processes:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                changed_files.merge(future.result())
+    for future in concurrent.futures.as_completed(pending):
+        changed_files.merge(future.result())
+    return changed_files, file_count
+
+
+def _shards(
+    file_paths: Iterable[str], shard_size: int
+) -> Iterator[Tuple[str, List[str]]]:
+    file_paths = iter(file_paths)
+    while True:
+        window = list(itertools.islice(file_paths, WINDOW_SIZE))
+        if not window:
+            return
+        # Split after the last separator rather than with `os.path.split`, which
+        # is several times slower, so that the directory and the name add up to
+        # the path again.
+        names_by_directory: Dict[str, List[str]] = {}
+        for path in window:
+            name_start = path.rfind(os.sep) + 1
+            names = names_by_directory.get(path[:name_start])
+            if names is None:
+                names = names_by_directory[path[:name_start]] = []
+            names.append(path[name_start:])
+        for directory, names in names_by_directory.items():
+            for i in range(0, len(names), shard_size):
+                yield directory, names[i : i + shard_size]
+
+
+def _collect_shard_changes(
+    directory: str,
+    names: List[str],
+    expression: tagger.TagExpression,
+    where: Optional[tagger.TagPredicate] = None,
+) -> store.FileStore:
+    """
+    `directory` is a path prefix ending with a separator (or empty).
+    """
+    changed_files = store.FileStore()
+    for name in names:
+        tagged_file = tagger.filtered_tagged_file(directory + name, where)
+        if tagged_file is None:
+            continue
+        expression.apply(tagged_file)
+        new_name = tagged_file.new_name
+        if tagged_file.name != new_name:
+            changed_files.add(tagged_file.path, new_name, tagged_file.tags)
+    return changed_files
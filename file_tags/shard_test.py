@@ -0,0 +1,37 @@
+from file_tags import bench
+from file_tags import shard
+from file_tags import tags as tagger
+
+
+def renames(file_store):
+    return sorted(file_store.planned_renames())
+
+
+def test_collect_changes(tmp_path):
+    paths = bench.generate_tree(str(tmp_path), 300, files_per_directory=40)
+    for expression in ("+tag0-a,+new", "-tag0-a", "~tag1-a=renamed"):
+        expression = tagger.TagExpression.compile(expression)
+        expected, expected_count = tagger.collect_changes(paths, expression.apply)
+
+        changed_files, file_count = shard.collect_changes(
+            paths, expression, processes=2, shard_size=16
+        )
+
+        assert file_count == expected_count == 300
+        assert len(changed_files) > 0
+        assert renames(changed_files) == renames(expected)
+
+
+def test_collect_changes_where(tmp_path):
+    paths = bench.generate_tree(str(tmp_path), 300, files_per_directory=40)
+    expression = tagger.TagExpression.compile("+archived")
+    where = tagger.TagPredicate("tag0-x-y-z or tag12-b and not tag1-x-y-z")
+    expected, _ = tagger.collect_changes(paths, expression.apply, where=where)
+
+    changed_files, file_count = shard.collect_changes(
+        paths, expression, processes=2, shard_size=16, where=where
+    )
+
+    assert file_count == 300
+    assert 0 < len(changed_files) < 300
+    assert renames(changed_files) == renames(expected)
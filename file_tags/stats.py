@@ -0,0 +1,306 @@
+"""
+Tag statistics.
+
+Walks the given files and directories and reports how often each tag is used,
+how often each pair of tags appears on the same file and how the tags are
+distributed across directories, as CSV or JSON.
+
+Co-occurrence is counted with vectorized pair counting when NumPy is installed,
+and with a pure Python fallback otherwise.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import argparse
+import collections
+import itertools
+import logging
+import os
+import sys
+
+from file_tags import exception
+from file_tags import tags as tagger
+from file_tags import util
+from file_tags import walk
+
+
+log = logging.getLogger()
+
+# How many files have their tag pairs counted at a time.
+CHUNK_SIZE = 100_000
+# Pairs of tag ids are counted as single integers: first << PAIR_SHIFT | second.
+PAIR_SHIFT = 32
+
+
+class TagStatistics:
+    """
+    Tag frequency, co-occurrence and per-directory distribution counts. Tags are
+    mapped to integer ids in the order they're first seen.
+    """
+
+    def __init__(self, use_numpy: Optional[bool] = None) -> None:
+        self.tag_ids: Dict[str, int] = {}
+        self.tag_names: List[str] = []
+        self.tag_counts: List[int] = []
+        self.file_count = 0
+        self.directory_tag_counts: Dict[str, Counter] = {}
+        self._numpy = _import_numpy() if use_numpy in (None, True) else None
+        if use_numpy and self._numpy is None:
+            raise exception.Error(
+                "While counting tag statistics: [1]."
+                "\n [1]: 'NumPy is not installed.'"
+            )
+        self._pending_tag_ids: List[List[int]] = []
+        self._pair_counts: Counter = collections.Counter()
+        # The distinct encoded pairs seen so far, sorted, and their counts.
+        self._pair_keys = None
+        self._pair_key_counts = None
+
+    def add_paths(self, paths: Iterable[str]) -> None:
+        for path in paths:
+            self.add(
+                os.path.dirname(path), tagger.parse_file_name(os.path.basename(path))[1]
+            )
+
+    def add(self, directory: str, tag_names: Iterable[str]) -> None:
+        tag_ids = sorted({self._tag_id(tag_name) for tag_name in tag_names})
+        self.file_count += 1
+        if not tag_ids:
+            return
+        directory_counts = self.directory_tag_counts.get(directory)
+        if directory_counts is None:
+            directory_counts = self.directory_tag_counts[
+                directory
+            ] = collections.Counter()
+        for tag_id in tag_ids:
+            self.tag_counts[tag_id] += 1
+            directory_counts[tag_id] += 1
+        if len(tag_ids) < 2:
+            return
+        if self._numpy is None:
+            self._pair_counts.update(itertools.combinations(tag_ids, 2))
+            return
+        self._pending_tag_ids.append(tag_ids)
+        if len(self._pending_tag_ids) >= CHUNK_SIZE:
+            self._flush()
+
+    def co_occurrence(self) -> List[Tuple[str, str, int]]:
+        """
+        Return (tag, other tag, number of files with both) for every pair of tags
+        that appear together, most frequent first.
+        """
+        if self._numpy is None:
+            pair_counts: Iterable = self._pair_counts.items()
+        else:
+            self._flush()
+            pair_counts = self._numpy_pair_counts()
+        pairs = [
+            (self.tag_names[first], self.tag_names[second], count)
+            for (first, second), count in pair_counts
+        ]
+        pairs.sort(key=lambda pair: (-pair[2], pair[0], pair[1]))
+        return pairs
+
+    def tag_frequencies(self) -> List[Tuple[str, int]]:
+        frequencies = list(zip(self.tag_names, self.tag_counts))
+        frequencies.sort(key=lambda frequency: (-frequency[1], frequency[0]))
+        return frequencies
+
+    def directory_distribution(self) -> Dict[str, Dict[str, int]]:
+        return {
+            directory: {
+                self.tag_names[tag_id]: count
+                for tag_id, count in sorted(
+                    tag_counts.items(), key=lambda item: (-item[1], item[0])
+                )
+            }
+            for directory, tag_counts in sorted(self.directory_tag_counts.items())
+        }
+
+    def as_dict(self) -> Dict:
+        return {
+            "file_count": self.file_count,
+            "tags": dict(self.tag_frequencies()),
+            "co_occurrence": [list(pair) for pair in self.co_occurrence()],
+            "directories": self.directory_distribution(),
+        }
+
+    def csv_rows(self) -> Iterator[Tuple]:
+        yield ("section", "key", "tag", "count")
+        for tag_name, count in self.tag_frequencies():
+            yield ("tag", "", tag_name, count)
+        for tag_name, other_tag_name, count in self.co_occurrence():
+            yield ("pair", tag_name, other_tag_name, count)
+        for directory, tag_counts in self.directory_distribution().items():
+            for tag_name, count in tag_counts.items():
+                yield ("directory", directory, tag_name, count)
+
+    def _tag_id(self, tag_name: str) -> int:
+        tag_id = self.tag_ids.get(tag_name)
+        if tag_id is None:
+            tag_id = self.tag_ids[tag_name] = len(self.tag_names)
+            self.tag_names.append(tag_name)
+            self.tag_counts.append(0)
+        return tag_id
+
+    def _flush(self) -> None:
+        """
+        Add the co-occurrence counts of the pending files. Files with the same
+        number of tags k form a (files x k) array of sorted tag ids, from which
+        the pairs of all of them are taken with one index per pair of positions.
+        The pairs are encoded as single integers and counted with `unique`, so
+        memory grows with the pairs that occur, not with the square of the
+        number of tags.
+        """
+        if not self._pending_tag_ids:
+            return
+        numpy = self._numpy
+        tag_ids_by_length: Dict[int, List[List[int]]] = {}
+        for tag_ids in self._pending_tag_ids:
+            tag_ids_by_length.setdefault(len(tag_ids), []).append(tag_ids)
+        keys = []
+        for length, rows in tag_ids_by_length.items():
+            tag_id_matrix = numpy.array(rows, dtype=numpy.int64)
+            firsts, seconds = numpy.triu_indices(length, k=1)
+            keys.append(
+                (
+                    (tag_id_matrix[:, firsts] << PAIR_SHIFT) | tag_id_matrix[:, seconds]
+                ).ravel()
+            )
+        new_key_count = sum(len(chunk_keys) for chunk_keys in keys)
+        counts = [numpy.ones(new_key_count, numpy.int64)]
+        if self._pair_keys is not None:
+            keys.append(self._pair_keys)
+            counts.append(self._pair_key_counts)
+        self._pair_keys, inverse = numpy.unique(
+            numpy.concatenate(keys), return_inverse=True
+        )
+        self._pair_key_counts = numpy.bincount(
+            inverse.ravel(), weights=numpy.concatenate(counts)
+        ).astype(numpy.int64)
+        self._pending_tag_ids = []
+
+    def _numpy_pair_counts(self) -> Iterator[Tuple[Tuple[int, int], int]]:
+        if self._pair_keys is None:
+            return iter(())
+        firsts = (self._pair_keys >> PAIR_SHIFT).tolist()
+        seconds = (self._pair_keys & ((1 << PAIR_SHIFT) - 1)).tolist()
+        return zip(zip(firsts, seconds), self._pair_key_counts.tolist())
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+class Config:
+    def __init__(
+        self,
+        paths: List[str],
+        output_format: str,
+        output_path: Optional[str],
+        use_numpy: Optional[bool],
+        cache_path: Optional[str] = None,
+    ) -> None:
+        self.paths = paths
+        self.output_format = output_format
+        self.output_path = output_path
+        self.use_numpy = use_numpy
+        # Walk through a `listing_cache.ListingCache` there, when set.
+        self.cache_path = cache_path
+
+    @classmethod
+    def from_command_line_args(cls, command_line_args: List):
+        parser = argparse.ArgumentParser(
+            prog="stats",
+            formatter_class=argparse.RawTextHelpFormatter,
+            description=__doc__,
+        )
+        parser.add_argument(
+            "paths", nargs="+", help="files and directories (walked recursively)"
+        )
+        parser.add_argument(
+            "-f",
+            "--format",
+            choices=["csv", "json"],
+            default="csv",
+            help="output format (default: %(default)s)",
+        )
+        parser.add_argument("-o", "--output", help="write to a file instead of stdout")
+        parser.add_argument(
+            "--no-numpy",
+            action="store_true",
+            help="count with pure Python even when NumPy is installed",
+        )
+        parser.add_argument(
+            "--cache",
+            action="store_true",
+            help=(
+                "keep the listing and parsed names of each directory in {}, "
+                "only\nrelisting the directories changed since the last "
+                "run".format(tagger.DEFAULT_LISTING_CACHE_PATH)
+            ),
+        )
+        parser.add_argument(
+            "--cache-file",
+            metavar="FILE",
+            help="like --cache, but keep them in FILE",
+        )
+        parsed = parser.parse_args(command_line_args)
+
+        try:
+            paths = util.validate_paths(parsed.paths)
+        except exception.Error as err:
+            log.error(util.fmt_err(err))
+            sys.exit(1)
+
+        return cls(
+            paths=paths,
+            output_format=parsed.format,
+            output_path=parsed.output,
+            use_numpy=False if parsed.no_numpy else None,
+            cache_path=parsed.cache_file
+            or (tagger.DEFAULT_LISTING_CACHE_PATH if parsed.cache else None),
+        )
+
+
+def main(config: Config) -> None:
+    tag_statistics = TagStatistics(use_numpy=config.use_numpy)
+    if config.cache_path is None:
+        tag_statistics.add_paths(walk.walk_paths(config.paths))
+    else:
+        from file_tags import listing_cache
+
+        with listing_cache.ListingCache(config.cache_path) as cache:
+            for path, (_, tag_names) in listing_cache.walk_paths(config.paths, cache):
+                tag_statistics.add(os.path.dirname(path), tag_names)
+            log.info(
+                "Directories listed: {}, from the cache: {}".format(
+                    cache.miss_count, cache.hit_count
+                )
+            )
+    log.info(
+        "Files: {}, distinct tags: {}".format(
+            tag_statistics.file_count, len(tag_statistics.tag_names)
+        )
+    )
+    if config.output_path:
+        with open(config.output_path, "w", newline="") as output_file:
+            write(tag_statistics, config.output_format, output_file)
+    else:
+        write(tag_statistics, config.output_format, sys.stdout)
+
+
+def write(tag_statistics: TagStatistics, output_format: str, output_file) -> None:
+    if output_format == "json":
+        import json
+
+        json.dump(tag_statistics.as_dict(), output_file, indent=2)
+        output_file.write("\n")
+        return
+    import csv
+
+    csv.writer(output_file).writerows(tag_statistics.csv_rows())
@@ -0,0 +1,115 @@
+import json
+import os
+import random
+
+import pytest
+
+from file_tags import listing_cache
+from file_tags import stats
+from file_tags import tags as tagger
+
+
+def count(paths, use_numpy):
+    tag_statistics = stats.TagStatistics(use_numpy=use_numpy)
+    tag_statistics.add_paths(paths)
+    return tag_statistics
+
+
+PATHS = [
+    os.path.join("a", "x {0}wallpaper {0}blue.jpg".format(tagger.TAG_START_CHAR)),
+    os.path.join(
+        "a", "y {0}wallpaper {0}blue {0}draft.jpg".format(tagger.TAG_START_CHAR)
+    ),
+    os.path.join("b", "z {0}wallpaper.jpg".format(tagger.TAG_START_CHAR)),
+    os.path.join("b", "untagged.jpg"),
+]
+
+
+def test_tag_statistics():
+    tag_statistics = count(PATHS, use_numpy=False)
+    assert tag_statistics.file_count == 4
+    assert tag_statistics.tag_frequencies() == [
+        ("wallpaper", 3),
+        ("blue", 2),
+        ("draft", 1),
+    ]
+    assert tag_statistics.co_occurrence() == [
+        ("wallpaper", "blue", 2),
+        ("blue", "draft", 1),
+        ("wallpaper", "draft", 1),
+    ]
+    assert tag_statistics.directory_distribution() == {
+        "a": {"wallpaper": 2, "blue": 2, "draft": 1},
+        "b": {"wallpaper": 1},
+    }
+    assert list(tag_statistics.csv_rows())[:2] == [
+        ("section", "key", "tag", "count"),
+        ("tag", "", "wallpaper", 3),
+    ]
+
+
+def test_tag_statistics_numpy(monkeypatch):
+    pytest.importorskip("numpy")
+    # Several chunks, with new tags showing up in later ones.
+    monkeypatch.setattr(stats, "CHUNK_SIZE", 7)
+    random_generator = random.Random(0)
+    paths = [
+        "d{} f{} {}".format(
+            index % 3,
+            index,
+            " ".join(
+                "{}t{}".format(
+                    tagger.TAG_START_CHAR, random_generator.randrange(index + 2)
+                )
+                for _ in range(random_generator.randrange(5))
+            ),
+        )
+        for index in range(100)
+    ]
+    python_statistics = count(paths, use_numpy=False)
+    numpy_statistics = count(paths, use_numpy=True)
+    assert numpy_statistics.as_dict() == python_statistics.as_dict()
+
+
+def test_tag_statistics_numpy_large_vocabulary():
+    pytest.importorskip("numpy")
+    # 20k distinct tags: nothing may grow with the square of their number.
+    random_generator = random.Random(0)
+    paths = [
+        "f{} {}".format(
+            index,
+            " ".join(
+                "{}t{}".format(
+                    tagger.TAG_START_CHAR, random_generator.randrange(20_000)
+                )
+                for _ in range(random_generator.randrange(1, 6))
+            ),
+        )
+        for index in range(5_000)
+    ]
+    python_statistics = count(paths, use_numpy=False)
+    numpy_statistics = count(paths, use_numpy=True)
+    assert len(numpy_statistics.tag_names) > 10_000
+    assert numpy_statistics.co_occurrence() == python_statistics.co_occurrence()
+
+
+def test_main_json(tmp_path, capsys, monkeypatch):
+    tree = tmp_path / "tree"
+    for path in PATHS:
+        path = os.path.join(str(tree), path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w"):
+            pass
+
+    # Cached listings give the same results, cold and warm.
+    monkeypatch.setattr(listing_cache, "MIN_AGE_NS", 0)
+    cache_args = ["--cache-file", str(tmp_path / "listings.marshal")]
+    for extra_args in ([], cache_args, cache_args):
+        stats.main(
+            stats.Config.from_command_line_args([str(tree), "-f", "json"] + extra_args)
+        )
+
+        output = json.loads(capsys.readouterr().out)
+        assert output["file_count"] == 4
+        assert output["tags"] == {"wallpaper": 3, "blue": 2, "draft": 1}
+        assert output["directories"][os.path.join(str(tree), "b")] == {"wallpaper": 1}
@@ -0,0 +1,186 @@
+"""
+Columnar in-memory store of tagged files.
+
+Keeping a `TaggedFile` per file costs an object, its full path and a set of tags
+for each of them. `FileStore` keeps the same information in columns instead: the
+directories are interned and referenced by id, and the tags of all the files
+are integer ids in one flat array, sliced by an array of offsets.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import array
+import os
+
+from file_tags import rename
+
+
+# Separates the names of a pickled store.
+NAME_SEP = "\0"
+
+
+class FileStore:
+    """
+    Append-only columns describing files and the tags they should end up with.
+
+    Usage:
+        file_store = FileStore()
+        file_store.add_tagged_file(tagged_file)
+        for planned_rename in file_store.planned_renames():
+            ...
+    """
+
+    def __init__(self) -> None:
+        self.directories: List[str] = []
+        self._directory_ids: Optional[Dict[str, int]] = {}
+        self.tags: List = []
+        self._tag_ids: Optional[Dict] = {}
+        # One item per file.
+        self.directory_ids = array.array("I")
+        self.names: List[str] = []
+        self.new_names: List[str] = []
+        # The tag ids of file i are tag_ids[tag_offsets[i] : tag_offsets[i + 1]].
+        self.tag_ids = array.array("I")
+        self.tag_offsets = array.array("Q", [0])
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getstate__(self) -> Dict:
+        # Sending a store to another process costs little more than its columns:
+        # the lookup tables are rebuilt from them and the names are sent as
+        # single strings, which is several times faster than lists of them.
+        state = self.__dict__.copy()
+        del state["_directory_ids"]
+        del state["_tag_ids"]
+        state["names"] = _join_names(self.names)
+        state["new_names"] = _join_names(self.new_names)
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self.names = _split_names(state["names"])
+        self.new_names = _split_names(state["new_names"])
+        # Only rebuilt when needed, stores received from other processes usually
+        # just get merged.
+        self._directory_ids = None
+        self._tag_ids = None
+
+    def add(self, path: str, new_name: str, tags: Iterable) -> int:
+        """
+        Add the file at `path` that should be renamed to `new_name` and ends up
+        with `tags` (`tags.Tag` objects). Returns the index of the file.
+        """
+        directory, name = os.path.split(path)
+        self.tag_ids.extend(self._tag_id(tag) for tag in tags)
+        self.tag_offsets.append(len(self.tag_ids))
+        self.directory_ids.append(self._directory_id(directory))
+        self.names.append(name)
+        self.new_names.append(new_name)
+        return len(self.names) - 1
+
+    def add_tagged_file(self, tagged_file) -> int:
+        return self.add(tagged_file.path, tagged_file.new_name, tagged_file.tags)
+
+    def merge(self, other: "FileStore") -> None:
+        """
+        Append the files of `other`, e.g. one built by another process.
+        """
+        directory_ids = [
+            self._directory_id(directory) for directory in other.directories
+        ]
+        tag_ids = [self._tag_id(tag) for tag in other.tags]
+        self.directory_ids.extend(map(directory_ids.__getitem__, other.directory_ids))
+        self.names.extend(other.names)
+        self.new_names.extend(other.new_names)
+        self.tag_ids.extend(map(tag_ids.__getitem__, other.tag_ids))
+        self.tag_offsets.extend(
+            map(self.tag_offsets[-1].__add__, other.tag_offsets[1:])
+        )
+
+    def drop_repeats(self) -> int:
+        """
+        Remove the files added more than once, e.g. from paths given twice,
+        keeping the first of each. Returns how many were removed.
+        """
+        seen_files: Set[Tuple[int, str]] = set()
+        kept_indexes = []
+        for index, key in enumerate(zip(self.directory_ids, self.names)):
+            if key not in seen_files:
+                seen_files.add(key)
+                kept_indexes.append(index)
+        del seen_files
+        removed_count = len(self) - len(kept_indexes)
+        if not removed_count:
+            return 0
+
+        tag_ids = array.array("I")
+        tag_offsets = array.array("Q", [0])
+        for index in kept_indexes:
+            tag_ids.extend(
+                self.tag_ids[self.tag_offsets[index] : self.tag_offsets[index + 1]]
+            )
+            tag_offsets.append(len(tag_ids))
+        self.directory_ids = array.array(
+            "I", map(self.directory_ids.__getitem__, kept_indexes)
+        )
+        self.names = list(map(self.names.__getitem__, kept_indexes))
+        self.new_names = list(map(self.new_names.__getitem__, kept_indexes))
+        self.tag_ids = tag_ids
+        self.tag_offsets = tag_offsets
+        return removed_count
+
+    def directory(self, index: int) -> str:
+        return self.directories[self.directory_ids[index]]
+
+    def path(self, index: int) -> str:
+        return os.path.join(self.directory(index), self.names[index])
+
+    def file_tags(self, index: int) -> List:
+        tags = self.tags
+        return [
+            tags[tag_id]
+            for tag_id in self.tag_ids[
+                self.tag_offsets[index] : self.tag_offsets[index + 1]
+            ]
+        ]
+
+    def planned_rename(self, index: int) -> rename.Rename:
+        return rename.Rename(
+            directory=self.directory(index) or os.curdir,
+            name=self.names[index],
+            new_name=self.new_names[index],
+        )
+
+    def planned_renames(self) -> Iterator[rename.Rename]:
+        return (self.planned_rename(index) for index in range(len(self)))
+
+    def _directory_id(self, directory: str) -> int:
+        if self._directory_ids is None:
+            self._directory_ids = {
+                directory: directory_id
+                for directory_id, directory in enumerate(self.directories)
+            }
+        directory_id = self._directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = self._directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        return directory_id
+
+    def _tag_id(self, tag) -> int:
+        if self._tag_ids is None:
+            self._tag_ids = {tag: tag_id for tag_id, tag in enumerate(self.tags)}
+        tag_id = self._tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self._tag_ids[tag] = len(self.tags)
+            self.tags.append(tag)
+        return tag_id
+
+
+def _join_names(names: List[str]) -> Optional[str]:
+    # No file name contains a NUL character.
+    return NAME_SEP.join(names) if names else None
+
+
+def _split_names(joined_names: Optional[str]) -> List[str]:
+    return joined_names.split(NAME_SEP) if joined_names is not None else []
@@ -0,0 +1,90 @@
+import os
+import pickle
+
+from file_tags import rename
+from file_tags import store
+from file_tags import tags as tagger
+
+
+def test_file_store():
+    file_store = store.FileStore()
+    tagged_files = [
+        tagger.TaggedFile(
+            os.path.join("a", "x {}blue.jpg".format(tagger.TAG_START_CHAR))
+        ),
+        tagger.TaggedFile(os.path.join("a", "y.jpg")),
+        tagger.TaggedFile("z {}blue {}draft".format(*[tagger.TAG_START_CHAR] * 2)),
+    ]
+    tagged_files[1].add_tag(tagger.Tag("wallpaper"))
+    for tagged_file in tagged_files:
+        file_store.add_tagged_file(tagged_file)
+
+    assert len(file_store) == 3
+    # Directories and tags are interned.
+    assert file_store.directories == ["a", ""]
+    assert list(file_store.directory_ids) == [0, 0, 1]
+    assert len(file_store.tags) == 3
+    assert list(file_store.tag_offsets) == [0, 1, 2, 4]
+
+    for index, tagged_file in enumerate(tagged_files):
+        assert file_store.path(index) == tagged_file.path
+        assert set(file_store.file_tags(index)) == tagged_file.tags
+        assert file_store.new_names[index] == tagged_file.new_name
+        assert file_store.planned_rename(index) == tagged_file.planned_rename()
+    assert list(file_store.planned_renames())[2] == rename.Rename(
+        os.curdir, "z #blue #draft", "z #blue #draft"
+    )
+
+
+def test_file_store_drop_repeats():
+    tags = [tagger.Tag(name) for name in ("a", "b")]
+    file_store = store.FileStore()
+    for path, new_name, file_tags in (
+        (os.path.join("x", "1"), "1 #a", tags[:1]),
+        (os.path.join("y", "1"), "1 #a #b", tags),
+        (os.path.join("x", "1"), "1 #a", tags[:1]),
+        (os.path.join("x", "2"), "2 #b", tags[1:]),
+        (os.path.join("y", "1"), "1 #a #b", tags),
+    ):
+        file_store.add(path, new_name, file_tags)
+
+    assert file_store.drop_repeats() == 2
+    assert [file_store.path(index) for index in range(len(file_store))] == [
+        os.path.join("x", "1"),
+        os.path.join("y", "1"),
+        os.path.join("x", "2"),
+    ]
+    assert file_store.new_names == ["1 #a", "1 #a #b", "2 #b"]
+    assert [file_store.file_tags(index) for index in range(3)] == [
+        tags[:1],
+        tags,
+        tags[1:],
+    ]
+    assert file_store.drop_repeats() == 0
+
+
+def test_file_store_merge():
+    tags = [tagger.Tag(name) for name in ("a", "b", "c")]
+    file_store = store.FileStore()
+    file_store.add(os.path.join("x", "1"), "1 #a #b", tags[:2])
+    other = store.FileStore()
+    other.add(os.path.join("y", "2"), "2 #c", tags[2:])
+    other.add(os.path.join("x", "3"), "3 #a", tags[:1])
+    # Stores are sent between processes without their lookup tables.
+    other = pickle.loads(pickle.dumps(other))
+
+    file_store.merge(other)
+
+    assert file_store.directories == ["x", "y"]
+    assert [file_store.path(index) for index in range(3)] == [
+        os.path.join("x", "1"),
+        os.path.join("y", "2"),
+        os.path.join("x", "3"),
+    ]
+    assert file_store.new_names == ["1 #a #b", "2 #c", "3 #a"]
+    assert [file_store.file_tags(index) for index in range(3)] == [
+        tags[:2],
+        tags[2:],
+        tags[:1],
+    ]
+    assert len(file_store.tags) == 3
@@ -22,19 +22,34 @@ And with:
   * 'Picture 002 #flowers #flying-whales #wallpaper.jpg'
 """
 
-# pylint: disable=unused-wildcard-import
-from typing import *
-import argparse
-import contextlib
+# The imports needed only by some code paths (argparse, random, textwrap, ...) are
+# done where they're used, to keep the start-up of short runs fast.
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 import functools
+import importlib
+import itertools
 import logging
 import os
-import random
 import re
 import sys
-import textwrap
 
 from file_tags import exception
+from file_tags import metrics
+from file_tags import plan
+from file_tags import rename
+from file_tags import store
 from file_tags import util
 
 
@@ -42,7 +57,23 @@ VERSION = "0.0.1 2018-11-10"
 TAG_START_CHAR = "#"
 TAG_WORD_SEP = "-"
 TAG_REGEX = r"(?i)(?:^|\s)({0}[a-z0-9-]+)".format(TAG_START_CHAR)
+TAG_PATTERN = re.compile(TAG_REGEX)
 COMMON_SEPARATORS = {"-", "_", ".", " "}
+# How many files are parsed and planned at a time.
+CHUNK_SIZE = 10_000
+# How many raw tag names `intern_tag` remembers.
+TAG_INTERN_CACHE_SIZE = 8192
+# Subcommands, run instead of the tag action when given as the first argument.
+COMMANDS = {
+    "query": "file_tags.query",
+    "retag": "file_tags.retag",
+    "serve": "file_tags.server",
+    "stats": "file_tags.stats",
+    "watch": "file_tags.watch",
+}
+# Set up before parsing the command line, see `run`.
+BACKGROUND_LOG_ARG = "--background-log"
+DEFAULT_LISTING_CACHE_PATH = "~/.cache/file_tags/listings.marshal"
 
 
 log = logging.getLogger()
@@ -68,6 +99,8 @@ class TagAction:
             return "add"
         if normalized_value in ("remove", "rm", "delete", "del"):
             return "remove"
+        if normalized_value == "edit":
+            return "edit"
         raise exception.Error(
             "While normalizing tag action value [1]: [2]."
             "\n [1]: '{0}'"
@@ -77,6 +110,8 @@ class TagAction:
 
 @functools.total_ordering
 class Tag:
+    __slots__ = ("name", "value")
+
     def __init__(self, name: str) -> None:
         self.name = self._normalize_name(name)
         self.value = TAG_START_CHAR + self.name
@@ -95,26 +130,14 @@ class Tag:
             raise NotImplementedError
         return self.name == other.name
 
-    def __gt__(self, other) -> bool:
+    def __lt__(self, other) -> bool:
         if not isinstance(other, self.__class__):
             raise NotImplementedError
-        return self.name == sorted([self.name, other.name])[1]
+        return self.name < other.name
 
     @staticmethod
     def _normalize_name(name: str) -> str:
-        normalized_name = name.strip()
-        for common_separator in COMMON_SEPARATORS:
-            normalized_name = normalized_name.replace(common_separator, TAG_WORD_SEP)
-        normalized_name = (
-            "".join(
-                char
-                for char in normalized_name
-                if char.isalnum() or char == TAG_WORD_SEP
-            )
-            .strip(TAG_WORD_SEP)
-            .strip()
-        )
-        normalized_name = util.trim_repeating_character(TAG_WORD_SEP, normalized_name)
+        normalized_name = _normalize_tag_name(name)
         if not normalized_name:
             raise exception.Error(
                 "While normalizing tag name [1]: [2]."
@@ -124,12 +147,303 @@ class Tag:
         return normalized_name
 
 
+class _TagNameTable(dict):
+    """
+    `str.translate` table that fills itself in on first use of each character:
+    common separators become TAG_WORD_SEP, alphanumeric characters are kept and
+    anything else is dropped.
+    """
+
+    def __missing__(self, codepoint: int) -> Optional[str]:
+        char = chr(codepoint)
+        if char in COMMON_SEPARATORS:
+            replacement: Optional[str] = TAG_WORD_SEP
+        elif char.isalnum():
+            replacement = char
+        else:
+            replacement = None
+        self[codepoint] = replacement
+        return replacement
+
+
+# Separates the names normalized together by `normalize_tag_names`. It can't be
+# part of a file name or a command line argument.
+_BATCH_SEP = "\0"
+_TAG_NAME_TABLE = _TagNameTable()
+_BATCH_TAG_NAME_TABLE = _TagNameTable({ord(_BATCH_SEP): _BATCH_SEP})
+_REPEATED_WORD_SEP = re.compile("{}{{2,}}".format(re.escape(TAG_WORD_SEP)))
+
+
+def _normalize_tag_name(name: str) -> str:
+    return _REPEATED_WORD_SEP.sub(TAG_WORD_SEP, name.translate(_TAG_NAME_TABLE)).strip(
+        TAG_WORD_SEP
+    )
+
+
+def normalize_tag_names(names: Sequence[str]) -> List[str]:
+    """
+    Normalize many raw tag names at once, the way `Tag` does. Names that normalize
+    to nothing come back as empty strings instead of raising.
+    """
+    if not names:
+        return []
+    joined = _BATCH_SEP.join(names)
+    if joined.count(_BATCH_SEP) != len(names) - 1:
+        # Some name contains the separator after all.
+        return [_normalize_tag_name(name) for name in names]
+    normalized = _REPEATED_WORD_SEP.sub(
+        TAG_WORD_SEP, joined.translate(_BATCH_TAG_NAME_TABLE)
+    )
+    return [name.strip(TAG_WORD_SEP) for name in normalized.split(_BATCH_SEP)]
+
+
+@functools.lru_cache(maxsize=TAG_INTERN_CACHE_SIZE)
+def intern_tag(name: str) -> Tag:
+    """
+    Return the canonical `Tag` instance for the raw tag name `name`, so that files
+    sharing a tag share one object and each raw name is normalized only once.
+    The returned tags are shared and must not be modified.
+    """
+    return Tag(name)
+
+
+class TagExpression:
+    """
+    Tag operations applied to each file in a single pass, in order:
+      * "+tag" adds the tag,
+      * "-tag" removes the tag,
+      * "~old=new" replaces the tag "old" with "new" on the files having it.
+
+    Usage:
+        expression = TagExpression.compile("+final,-draft,~old=new")
+        expression.apply(tagged_file)
+    """
+
+    __slots__ = ("operations",)
+
+    def __init__(self, operations: List[Tuple[str, Tag, Optional[Tag]]]) -> None:
+        # (operation, tag, new tag) triples, the new tag is only set for "~".
+        self.operations = operations
+
+    def __str__(self) -> str:
+        return ",".join(
+            "{}{}={}".format(operation, tag.name, new_tag.name)
+            if new_tag is not None
+            else "{}{}".format(operation, tag.name)
+            for operation, tag, new_tag in self.operations
+        )
+
+    def __repr__(self) -> str:
+        return "{}({})".format(self.__class__.__name__, '"{}"'.format(self))
+
+    def __getstate__(self) -> List[Tuple[str, Tag, Optional[Tag]]]:
+        return self.operations
+
+    def __setstate__(self, operations: List[Tuple[str, Tag, Optional[Tag]]]) -> None:
+        self.operations = operations
+
+    @classmethod
+    def compile(cls, expression: str) -> "TagExpression":
+        operations: List[Tuple[str, Tag, Optional[Tag]]] = []
+        for item in expression.split(","):
+            item = item.strip()
+            operation = item[:1]
+            try:
+                if operation in ("+", "-") and item[1:]:
+                    operations.append((operation, intern_tag(item[1:]), None))
+                elif operation == "~" and "=" in item:
+                    tag_name, new_tag_name = item[1:].split("=", 1)
+                    operations.append(
+                        (operation, intern_tag(tag_name), intern_tag(new_tag_name))
+                    )
+                else:
+                    raise exception.Error(
+                        "Expected '+tag', '-tag' or '~old=new', got '{}'.".format(item)
+                    )
+            except exception.Error as err:
+                raise exception.Error(
+                    "While compiling tag expression [1]: [2]."
+                    "\n [1]: '{}'"
+                    "\n [2]: '{}'".format(expression, err)
+                )
+        return cls(operations)
+
+    @classmethod
+    def from_action(cls, action: TagAction, tags: Iterable[Tag]) -> "TagExpression":
+        operation = "+" if action.value == "add" else "-"
+        return cls([(operation, tag, None) for tag in tags])
+
+    def tags(self) -> Set[Tag]:
+        tags = set()
+        for _, tag, new_tag in self.operations:
+            tags.add(tag)
+            if new_tag is not None:
+                tags.add(new_tag)
+        return tags
+
+    def apply(self, tagged_file: "TaggedFile") -> None:
+        for operation, tag, new_tag in self.operations:
+            if operation == "+":
+                tagged_file.add_tag(tag)
+            elif operation == "-":
+                tagged_file.remove_tag(tag)
+            elif tag in tagged_file.tags:
+                tagged_file.remove_tag(tag)
+                tagged_file.add_tag(new_tag)
+
+
+class TagPredicate:
+    """
+    Boolean filter over the tags of a file, e.g. "2019 and not (keep or draft)",
+    parsed once into a function of the file's set of tag names. Besides the tag
+    names, it's made of "and" (or "&"), "or" ("|"), "not" ("!") and parentheses.
+    A tag named like an operator is written with the tag start character, e.g.
+    "#not".
+
+    Conjunctions and disjunctions of (negated) tags, the usual case, are
+    evaluated as single set operations.
+    """
+
+    __slots__ = ("source", "matches")
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        try:
+            tokens = _PREDICATE_TOKEN_PATTERN.findall(source)
+            node, position = _parse_predicate_or(tokens, 0)
+            if position != len(tokens):
+                raise exception.Error("Unexpected '{}'.".format(tokens[position]))
+        except exception.Error as err:
+            raise exception.Error(
+                "While parsing tag filter [1]: [2]."
+                "\n [1]: '{}'"
+                "\n [2]: '{}'".format(source, err)
+            )
+        function = _compile_predicate(node)
+        # Whether a file with the given tag names matches.
+        self.matches: Callable[[Iterable[str]], bool] = lambda tag_names: function(
+            set(tag_names)
+        )
+
+    def __str__(self) -> str:
+        return self.source
+
+    def __repr__(self) -> str:
+        return '{}("{}")'.format(self.__class__.__name__, self.source)
+
+    def __getstate__(self) -> str:
+        return self.source
+
+    def __setstate__(self, source: str) -> None:
+        self.__init__(source)  # type: ignore
+
+
+_PREDICATE_TOKEN_PATTERN = re.compile(r"[()!&|]|[^\s()!&|]+")
+_PREDICATE_OPERATORS = {"and": "&", "or": "|", "not": "!"}
+# Parsed predicates are nested tuples: ("tag", name), ("not", node),
+# ("and", [nodes]) and ("or", [nodes]).
+_PredicateNode = Tuple
+
+
+def _predicate_token(tokens: List[str], position: int) -> Optional[str]:
+    if position >= len(tokens):
+        return None
+    token = tokens[position]
+    return _PREDICATE_OPERATORS.get(token.lower(), token)
+
+
+def _parse_predicate_or(tokens: List[str], position: int) -> Tuple[_PredicateNode, int]:
+    node, position = _parse_predicate_and(tokens, position)
+    nodes = [node]
+    while _predicate_token(tokens, position) == "|":
+        node, position = _parse_predicate_and(tokens, position + 1)
+        nodes.append(node)
+    return (nodes[0] if len(nodes) == 1 else ("or", nodes)), position
+
+
+def _parse_predicate_and(
+    tokens: List[str], position: int
+) -> Tuple[_PredicateNode, int]:
+    node, position = _parse_predicate_not(tokens, position)
+    nodes = [node]
+    while _predicate_token(tokens, position) == "&":
+        node, position = _parse_predicate_not(tokens, position + 1)
+        nodes.append(node)
+    return (nodes[0] if len(nodes) == 1 else ("and", nodes)), position
+
+
+def _parse_predicate_not(
+    tokens: List[str], position: int
+) -> Tuple[_PredicateNode, int]:
+    token = _predicate_token(tokens, position)
+    if token == "!":
+        node, position = _parse_predicate_not(tokens, position + 1)
+        return ("not", node), position
+    if token == "(":
+        node, position = _parse_predicate_or(tokens, position + 1)
+        if _predicate_token(tokens, position) != ")":
+            raise exception.Error("Missing ')'.")
+        return node, position + 1
+    if token is None or token in ("&", "|", ")"):
+        raise exception.Error(
+            "Expected a tag, got {}.".format(
+                "'{}'".format(token) if token else "the end"
+            )
+        )
+    return ("tag", intern_tag(tokens[position]).name), position + 1
+
+
+def _compile_predicate(node: _PredicateNode) -> Callable[[Set[str]], bool]:
+    kind = node[0]
+    if kind == "tag":
+        name = node[1]
+        return lambda tag_names: name in tag_names
+    if kind == "not":
+        function = _compile_predicate(node[1])
+        return lambda tag_names: not function(tag_names)
+
+    present = frozenset(child[1] for child in node[1] if child[0] == "tag")
+    absent = frozenset(
+        child[1][1] for child in node[1] if child[0] == "not" and child[1][0] == "tag"
+    )
+    functions = [
+        _compile_predicate(child)
+        for child in node[1]
+        if child[0] != "tag" and not (child[0] == "not" and child[1][0] == "tag")
+    ]
+    if kind == "and":
+        return lambda tag_names: (
+            present <= tag_names
+            and absent.isdisjoint(tag_names)
+            and all(function(tag_names) for function in functions)
+        )
+    return lambda tag_names: (
+        not present.isdisjoint(tag_names)
+        or not absent <= tag_names
+        or any(function(tag_names) for function in functions)
+    )
+
+
 class TaggedFile:
-    def __init__(self, path: str) -> None:
+    """
+    The new name is rebuilt only after `add_tag`/`remove_tag` changed the tags.
+    Changing `tags` directly doesn't update it.
+    """
+
+    __slots__ = ("path", "name", "tagless_name", "tags", "_new_name")
+
+    def __init__(
+        self, path: str, parsed_name: Optional[Tuple[str, List[str]]] = None
+    ) -> None:
+        """
+        `parsed_name` is what `parse_file_name` returns for the file's name,
+        when it's already known.
+        """
         self.path = path
         self.name = os.path.basename(self.path)
-        self.tagless_name = self._tagless_name_from_file_name(self.name)
-        self.tags = self._tags_from_file_name(self.name)
+        self.tagless_name, tag_names = parsed_name or parse_file_name(self.name)
+        self.tags = {intern_tag(name) for name in tag_names}
+        self._new_name: Optional[str] = None
 
     def __str__(self) -> str:
         return str(
@@ -144,18 +458,11 @@ class TaggedFile:
 
     @property
     def new_name(self) -> str:
-        # fmt: off
-        name = "{name}{tags}".format(
-             name=util.get_file_name_no_extension(self.tagless_name),
-             tags=" {}".format(
-                 " ".join(tag.value for tag in sorted(self.tags))
-             ) if self.tags else "",
-        ).strip()
-        # fmt: on
-        extension = util.get_file_extension(self.tagless_name)
-        return "{name}{ext}".format(
-            name=name, ext=".{}".format(extension) if extension else ""
-        ).strip()
+        if self._new_name is None:
+            self._new_name = util.tagged_file_name(
+                self.tagless_name, (tag.value for tag in self.tags)
+            )
+        return self._new_name
 
     @property
     def new_path(self) -> str:
@@ -178,47 +485,122 @@ class TaggedFile:
                 "\n [3]: '{}'".format(current_path, new_path, err)
             )
 
+    def planned_rename(self) -> rename.Rename:
+        return rename.Rename(
+            directory=os.path.dirname(self.path) or os.curdir,
+            name=self.name,
+            new_name=self.new_name,
+        )
+
     def add_tag(self, tag: Tag) -> None:
-        self.tags.add(tag)
+        if tag not in self.tags:
+            self.tags.add(tag)
+            self._new_name = None
 
     def remove_tag(self, tag: Tag) -> None:
-        self.tags.discard(tag)
+        if tag in self.tags:
+            self.tags.remove(tag)
+            self._new_name = None
 
     @staticmethod
     def _tagless_name_from_file_name(file_name: str) -> str:
+        return parse_file_name(file_name)[0]
+
+    @staticmethod
+    def _tags_from_file_name(file_name: str) -> Set[Tag]:
+        return {intern_tag(name) for name in parse_file_name(file_name)[1]}
+
+
+def parse_file_name(file_name: str) -> Tuple[str, List[str]]:
+    """
+    Split `file_name` into its tagless name and the normalized names of its tags,
+    in a single pass over the name. Tags that normalize to an empty name are
+    dropped.
+
+    Examples:
+        f("Picture #b 002 #a.jpg") -> ("Picture 002.jpg", ["b", "a"])
+    """
+    if TAG_START_CHAR not in file_name:
+        return file_name.strip(), []
+    tagless_name_parts = []
+    tag_names = []
+    position = 0
+    for match in TAG_PATTERN.finditer(file_name):
+        tagless_name_parts.append(file_name[position : match.start()])
+        position = match.end()
         try:
-            file_name = re.sub(TAG_REGEX, "", file_name)
-        except exception.InvalidRegexError as err:
-            raise exception.Error(
-                "While parsing the tagless file name based on tags starting with [1] "
-                "from file name [2]: [3]."
-                "\n [1]: '{}'"
-                "\n [2]: '{}'"
-                "\n [3]: '{}'".format(TAG_START_CHAR, file_name, util.fmt_err(err))
-            )
-        except exception.MatchFailedError:
+            tag_names.append(intern_tag(match.group(1)).name)
+        except exception.Error:
             pass
-        return file_name.strip()
+    tagless_name_parts.append(file_name[position:])
+    return "".join(tagless_name_parts).strip(), tag_names
 
-    @staticmethod
-    def _tags_from_file_name(file_name: str) -> Set:
-        err_template = (
-            "While parsing tags starting with [1] from file name [2]: [3]."
-            "\n [1]: '{}'"
-            "\n [2]: '{}'"
-            "\n [3]: '{{}}'".format(TAG_START_CHAR, file_name)
+
+def filtered_tagged_file(
+    path: str,
+    where: Optional[TagPredicate],
+    parsed_name: Optional[Tuple[str, List[str]]] = None,
+) -> Optional[TaggedFile]:
+    """
+    The `TaggedFile` for `path`, or None when its tags don't match `where`.
+    `parsed_name` is what `parse_file_name` returns for the file's name, when
+    it's already known.
+    """
+    if where is None:
+        return TaggedFile(path, parsed_name)
+    parsed_name = parsed_name or parse_file_name(os.path.basename(path))
+    if not where.matches(parsed_name[1]):
+        return None
+    return TaggedFile(path, parsed_name)
+
+
+# Raw tag name -> normalized name (empty when nothing is left), for the raw
+# names already seen by `parse_file_names`.
+_NORMALIZED_TAG_NAMES: Dict[str, str] = {}
+
+
+def parse_file_names(file_names: Iterable[str]) -> List[Tuple[str, List[str]]]:
+    """
+    Batch version of `parse_file_name`. The raw tag names not seen before are
+    normalized together, see `normalize_tag_names`.
+    """
+    normalized_names = _NORMALIZED_TAG_NAMES
+    if len(normalized_names) > TAG_INTERN_CACHE_SIZE:
+        normalized_names.clear()
+    split_names = []
+    new_raw_names: Dict[str, None] = {}
+    for file_name in file_names:
+        if TAG_START_CHAR not in file_name:
+            split_names.append((file_name.strip(), None))
+            continue
+        # The tagless name parts and the raw tag names, alternating.
+        parts = TAG_PATTERN.split(file_name)
+        raw_names = parts[1::2]
+        for raw_name in raw_names:
+            if raw_name not in normalized_names:
+                new_raw_names[raw_name] = None
+        split_names.append(("".join(parts[::2]).strip(), raw_names))
+
+    if new_raw_names:
+        normalized_names.update(
+            zip(
+                new_raw_names,
+                map(sys.intern, normalize_tag_names(list(new_raw_names))),
+            )
         )
-        try:
-            tag_names = re.findall(TAG_REGEX, file_name)
-        except exception.InvalidRegexError as err:
-            raise exception.Error(err_template.format(util.fmt_err(err)))
-        except exception.MatchFailedError:
-            return set()
-        tags = set()
-        for tag_name in tag_names:
-            with contextlib.suppress(exception.Error):
-                tags.add(Tag(tag_name))
-        return tags
+    return [
+        (
+            tagless_name,
+            [
+                normalized_names[raw_name]
+                for raw_name in raw_names
+                if normalized_names[raw_name]
+            ]
+            if raw_names
+            else [],
+        )
+        for tagless_name, raw_names in split_names
+    ]
 
 
 class Config:
@@ -228,43 +610,123 @@ class Config:
         in_interactive_mode: bool,
         no_action: bool,
         tags: Set[Tag],
-        tagged_files: Set[TaggedFile],
+        file_paths: Iterable[str],
+        jobs: int = rename.DEFAULT_JOBS,
+        stats_path: Optional[str] = None,
+        run_metrics: Union[metrics.Metrics, metrics.NullMetrics] = metrics.NULL_METRICS,
+        concurrency: Optional[int] = None,
+        processes: Optional[int] = None,
+        output_format: str = "text",
+        quiet: bool = False,
+        expression: Optional[TagExpression] = None,
+        where: Optional[TagPredicate] = None,
+        recursive: bool = False,
+        include: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+        max_depth: Optional[int] = None,
+        listing_cache_path: Optional[str] = None,
     ) -> None:
         self.action = action
         self.in_interactive_mode = in_interactive_mode
         self.no_action = no_action
         self.tags = tags
-        self.tagged_files = tagged_files
+        # What's done to each file, add/remove `tags` unless given.
+        self.expression = expression or TagExpression.from_action(action, tags)
+        self.file_paths = file_paths
+        self.jobs = jobs
+        self.stats_path = stats_path
+        # When set, the files are handled by `pipeline` with this many
+        # filesystem calls in flight.
+        self.concurrency = concurrency
+        # When set, the files are parsed and planned by `shard` on this many
+        # processes.
+        self.processes = processes
+        # "text": log a sample of the renames, "jsonl": write all of them to
+        # stdout as JSON Lines.
+        self.output_format = output_format
+        # Only log summaries, nothing per file.
+        self.quiet = quiet
+        # Only files whose tags match are handled.
+        self.where = where
+        # Walk the directories in `file_paths`, see `walk.walk_paths`.
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.max_depth = max_depth
+        # When set, the walk goes through the `listing_cache.ListingCache` there.
+        self.listing_cache_path = listing_cache_path
+        self.metrics = run_metrics
 
     @classmethod
     def from_command_line_args(cls, command_line_args: List):
+        import argparse
+
         if not command_line_args:
             command_line_args.append("-h")
 
         parser = argparse.ArgumentParser(
             formatter_class=argparse.RawTextHelpFormatter,
+            # Only built when it's going to be shown.
             description=(
-                "description:{}".format(
-                    textwrap.indent(
-                        "{0}" "\nRequires Python 3.5+".format(__doc__), "    "
-                    )
-                )
+                _help_description()
+                if "-h" in command_line_args or "--help" in command_line_args
+                else None
+            ),
+            epilog=(
+                "commands:\n"
+                "  query       list indexed files by tag, see 'query --help'\n"
+                "  retag       rename or merge tags across an archive, "
+                "see 'retag --help'\n"
+                "  serve       keep a warm process to forward commands to, "
+                "see 'serve --help'\n"
+                "  stats       tag frequency and co-occurrence, see 'stats --help'\n"
+                "  watch       keep the tag index up to date, see 'watch --help'"
             ),
         )
 
         parser.add_argument(
             "action",
-            choices=["add", "remove", "rm"],
+            choices=["add", "remove", "rm", "edit"],
             help="what tag action to perform on the files",
         )
         parser.add_argument(
             "tags",
             help=(
                 "what tag(s) to use. To specify multiple tags "
-                "separate them with commas, e.g. tag1,tag2,tag3"
+                "separate them with commas, e.g. tag1,tag2,tag3\n"
+                "For edit, the operations to apply to each file in a single "
+                "pass, e.g. +final,-draft,~old=new\n(add 'final', remove "
+                "'draft', replace 'old' with 'new'). An expression starting "
+                "with '-' has to follow '--'"
+            ),
+        )
+        parser.add_argument(
+            "file_paths",
+            nargs="*",
+            help="files to handle (or directories to walk with --recursive)",
+        )
+        parser.add_argument(
+            "--where",
+            metavar="EXPR",
+            help=(
+                "only handle the files whose tags match EXPR, e.g.\n"
+                "'2019 and not (keep or draft)' (operators: and/&, or/|, not/!)"
             ),
         )
-        parser.add_argument("file_paths", nargs="+", help="files to handle")
+        parser.add_argument(
+            "--from-stdin",
+            action="store_true",
+            help=(
+                "also read the files to handle from stdin, one per line. "
+                "They're validated and handled in chunks, so any amount works"
+            ),
+        )
+        parser.add_argument(
+            "-0",
+            "--null",
+            action="store_true",
+            help="like --from-stdin, but the paths are separated by NUL characters",
+        )
 
         parser.add_argument(
             "-n", "--no-action", help="don't rename files", action="store_true"
@@ -273,31 +735,226 @@ class Config:
             "-i", "--interactive", help="ask before renaming files", action="store_true"
         )
 
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            metavar="N",
+            type=int,
+            default=rename.DEFAULT_JOBS,
+            help="how many renames to run concurrently (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            metavar="N",
+            type=int,
+            help=(
+                "check and rename the files with up to N filesystem calls in "
+                "flight, for high-latency network filesystems (NFS, SMB)"
+            ),
+        )
+        parser.add_argument(
+            "-P",
+            "--processes",
+            metavar="N",
+            type=int,
+            help=(
+                "parse and plan the files on N processes, sharded by directory "
+                "(0: one per CPU)"
+            ),
+        )
+        parser.add_argument(
+            "--output",
+            choices=["text", "jsonl"],
+            default="text",
+            help=(
+                "how to show the planned renames: a sample of them as text, or "
+                "every one as JSON Lines on stdout, with the path, new path and "
+                "added/removed tags (default: %(default)s)"
+            ),
+        )
+        parser.add_argument(
+            "-q",
+            "--quiet",
+            action="store_true",
+            help="only log summaries, without listing the files to change",
+        )
+        parser.add_argument(
+            BACKGROUND_LOG_ARG,
+            action="store_true",
+            help="format and write the log on a background thread, in batches",
+        )
+        parser.add_argument(
+            "-r",
+            "--recursive",
+            help="walk the given directories and handle the files found in them",
+            action="store_true",
+        )
+        parser.add_argument(
+            "--include",
+            metavar="GLOB",
+            action="append",
+            default=[],
+            help="with --recursive, only handle files whose name matches GLOB",
+        )
+        parser.add_argument(
+            "--exclude",
+            metavar="GLOB",
+            action="append",
+            default=[],
+            help="with --recursive, skip files and directories whose name matches GLOB",
+        )
+        parser.add_argument(
+            "--cache",
+            action="store_true",
+            help=(
+                "with --recursive, keep the listing and parsed names of each "
+                "directory in\n{}, only relisting the directories changed "
+                "since the last run".format(DEFAULT_LISTING_CACHE_PATH)
+            ),
+        )
+        parser.add_argument(
+            "--cache-file",
+            metavar="FILE",
+            help="like --cache, but keep them in FILE",
+        )
+        parser.add_argument(
+            "--max-depth",
+            metavar="N",
+            type=int,
+            help="with --recursive, don't descend more than N directories deep",
+        )
+
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help=(
+                "record per-phase timings and counts, and the peak memory of the "
+                "run, and write them as JSON to stderr"
+            ),
+        )
+        parser.add_argument(
+            "--stats-file",
+            metavar="FILE",
+            help="like --stats, but write them to FILE ('-' for stderr)",
+        )
+
         parser.add_argument(
             "-v", "--version", action="version", version=VERSION, help="show version"
         )
-        parsed = parser.parse_args(command_line_args)
+        # Options can come between the tags and the paths.
+        parsed = parser.parse_intermixed_args(command_line_args)
+        from_stdin = parsed.from_stdin or parsed.null
+        if not parsed.file_paths and not from_stdin:
+            parser.error("no files given, pass file_paths or use --from-stdin")
+        if from_stdin and parsed.interactive:
+            parser.error("--interactive can't be used when reading files from stdin")
+        if parsed.concurrency is not None and parsed.concurrency < 1:
+            parser.error("--concurrency must be at least 1")
+        if parsed.processes is not None and parsed.processes < 0:
+            parser.error("--processes can't be negative")
+        if parsed.concurrency and parsed.processes is not None:
+            parser.error("--concurrency and --processes can't be used together")
+        stats_path = parsed.stats_file or ("-" if parsed.stats else None)
+        run_metrics = metrics.Metrics() if stats_path else metrics.NULL_METRICS
 
         try:
-            file_paths = util.validate_paths(parsed.file_paths)
-            tags = {Tag(tag) for tag in parsed.tags.split(",")}
+            if parsed.action == "edit":
+                expression: Optional[TagExpression] = TagExpression.compile(parsed.tags)
+                tags = expression.tags()
+            else:
+                expression = None
+                tags = {intern_tag(tag) for tag in parsed.tags.split(",")}
+            where = TagPredicate(parsed.where) if parsed.where is not None else None
         except exception.Error as err:
             log.error(util.fmt_err(err))
+            run_metrics.dump(stats_path)
             sys.exit(1)
 
+        # Validated lazily when they're handled, see `session.Session.collect`.
+        file_paths: Iterable[str] = parsed.file_paths
+        if from_stdin:
+            file_paths = itertools.chain(
+                file_paths,
+                util.read_paths(
+                    sys.stdin.buffer, separator=b"\0" if parsed.null else b"\n"
+                ),
+            )
+
         return cls(
             action=TagAction(parsed.action),
             in_interactive_mode=parsed.interactive,
             no_action=parsed.no_action,
             tags=tags,
-            tagged_files={TaggedFile(file_path) for file_path in file_paths},
+            file_paths=file_paths,
+            jobs=parsed.jobs,
+            stats_path=stats_path,
+            run_metrics=run_metrics,
+            concurrency=parsed.concurrency,
+            processes=parsed.processes,
+            output_format=parsed.output,
+            quiet=parsed.quiet,
+            expression=expression,
+            where=where,
+            recursive=parsed.recursive,
+            include=parsed.include,
+            exclude=parsed.exclude,
+            max_depth=parsed.max_depth,
+            listing_cache_path=(
+                parsed.cache_file
+                or (DEFAULT_LISTING_CACHE_PATH if parsed.cache else None)
+            )
+            if parsed.recursive
+            else None,
         )
 
 
+def _help_description() -> str:
+    import textwrap
+
+    return "description:{}".format(
+        textwrap.indent("{0}" "\nRequires Python 3.5+".format(__doc__), "    ")
+    )
+
+
+def validate_paths_in_chunks(
+    paths: Iterable[str],
+    run_metrics: Union[metrics.Metrics, metrics.NullMetrics] = metrics.NULL_METRICS,
+) -> Iterator[str]:
+    """
+    Lazily validate `paths` with `util.validate_paths`, CHUNK_SIZE at a time.
+    """
+    paths = iter(paths)
+    while True:
+        chunk = list(itertools.islice(paths, CHUNK_SIZE))
+        if not chunk:
+            return
+        with run_metrics.phase("validate") as phase:
+            chunk = util.validate_paths(chunk)
+            phase.item_count += len(chunk)
+        yield from chunk
+
+
 def run(command_line_args: List) -> None:
-    util.setup_terminal_logging(log)
+    util.setup_terminal_logging(log, background=BACKGROUND_LOG_ARG in command_line_args)
+    run_command(command_line_args)
+
+
+def run_command(command_line_args: List, **command_kwargs) -> None:
+    """
+    Run a tag action or one of the COMMANDS, exiting via `sys.exit` on failure.
+    `command_kwargs` are passed on to the command's `main`.
+    """
+    config = None
     try:
-        main(Config.from_command_line_args(command_line_args))
+        if command_line_args and command_line_args[0] in COMMANDS:
+            command = importlib.import_module(COMMANDS[command_line_args[0]])
+            command.main(
+                command.Config.from_command_line_args(command_line_args[1:]),
+                **command_kwargs,
+            )
+        else:
+            config = Config.from_command_line_args(command_line_args)
+            main(config)
     except KeyboardInterrupt:
         print()
         log.info("Interrupted by the user, exiting ...")
@@ -308,59 +965,164 @@ def run(command_line_args: List) -> None:
     except Exception as err:
         log.critical(util.fmt_err(err), exc_info=True)
         sys.exit(1)
+    finally:
+        if config is not None and config.stats_path:
+            config.metrics.dump(config.stats_path)
 
 
 def main(config: Config) -> None:
+    from file_tags import session
+
     log.info("Tags: {}".format(", ".join(tag.name for tag in config.tags)))
     log.info("Action: {}".format(config.action))
-    log.info("File count: {}".format(len(config.tagged_files)))
+    if config.action.value == "edit":
+        log.info("Expression: {}".format(config.expression))
+    if config.where is not None:
+        log.info("Where: {}".format(config.where))
 
-    for tagged_file in config.tagged_files:
-        for tag in config.tags:
-            if config.action.value == "add":
-                tagged_file.add_tag(tag)
-            elif config.action.value == "remove":
-                tagged_file.remove_tag(tag)
+    run_metrics = config.metrics
+    with session.Session(
+        jobs=config.jobs,
+        concurrency=config.concurrency,
+        processes=config.processes,
+        listing_cache_path=config.listing_cache_path,
+        run_metrics=run_metrics,
+    ) as tag_session:
+        changed_files, file_count = tag_session.collect(
+            config.file_paths,
+            config.expression,
+            config.where,
+            recursive=config.recursive,
+            include=config.include,
+            exclude=config.exclude,
+            max_depth=config.max_depth,
+        )
+        log.info("File count: {}".format(file_count))
+        if tag_session.listing_cache is not None:
+            log.info(
+                "Directories listed: {}, from the cache: {}".format(
+                    tag_session.listing_cache.miss_count,
+                    tag_session.listing_cache.hit_count,
+                )
+            )
 
-    changed_tagged_files = {
-        file for file in config.tagged_files if file.name != file.new_name
-    }
-    if not changed_tagged_files:
-        log.info("Exiting ... (no files to rename)")
-        sys.exit(0)
+        if not changed_files:
+            log.info("Exiting ... (no files to rename)")
+            sys.exit(0)
 
-    list_files(changed_tagged_files)
+        if config.quiet:
+            log.info("Files to change: {}".format(len(changed_files)))
+        elif config.output_format == "text":
+            with run_metrics.phase("list") as phase:
+                list_files(changed_files.planned_renames())
+                phase.item_count += len(changed_files)
 
-    if config.no_action:
-        log.info("Exiting ... (--no-action)")
-        sys.exit(0)
+        try:
+            rename_plan = tag_session.check(changed_files)
+        except exception.Error as err:
+            log.error(util.fmt_err(err))
+            log.error("Exiting ... (conflicting renames, no files were renamed)")
+            sys.exit(1)
 
-    if config.in_interactive_mode:
-        answer = input("Rename the files? [y/N]: ").strip().lower()
-        if answer not in ("y", "yes"):
-            log.info("Exiting ... (answered no)")
-            sys.exit(130)
+        if config.output_format == "jsonl":
+            # Only for plans that passed the check.
+            with run_metrics.phase("list") as phase:
+                write_renames_jsonl(changed_files, sys.stdout)
+                phase.item_count += len(changed_files)
 
-    log.info("Renaming the files ...")
-    try:
-        rename_files(changed_tagged_files)
-    except exception.Error as err:
-        log.error(util.fmt_err(err))
-        log.error("Exiting ... (failed to rename a file, please retry)")
-        sys.exit(1)
-    log.info("Files successfully renamed.")
+        if config.no_action:
+            log.info("Exiting ... (--no-action)")
+            sys.exit(0)
+
+        if config.in_interactive_mode:
+            for handler in log.handlers:
+                handler.flush()
+            answer = input("Rename the files? [y/N]: ").strip().lower()
+            if answer not in ("y", "yes"):
+                log.info("Exiting ... (answered no)")
+                sys.exit(130)
+
+        log.info("Renaming the files ...")
+        try:
+            tag_session.apply(
+                session.SessionPlan(changed_files, file_count, rename_plan)
+            )
+        except exception.Error as err:
+            log.error(util.fmt_err(err))
+            log.error("Exiting ... (failed to rename a file, please retry)")
+            sys.exit(1)
+        log.info("Files successfully renamed.")
+
+
+def collect_changes(
+    file_paths: Iterable[str],
+    update: Callable[[TaggedFile], None],
+    run_metrics: Union[metrics.Metrics, metrics.NullMetrics] = metrics.NULL_METRICS,
+    where: Optional[TagPredicate] = None,
+    parsed: bool = False,
+) -> Tuple[store.FileStore, int]:
+    """
+    Apply `update` to each of the files (matching `where`, if given) and keep
+    the ones whose name changes. When `parsed` is set, `file_paths` are pairs
+    of paths and parsed names, like `listing_cache.walk_paths` yields, and the
+    names aren't parsed again.
+
+    The files are consumed lazily, in chunks, and only the ones that need
+    renaming are kept, in columnar form. Returns them and the number of files.
+    """
+    file_count = 0
+    changed_files = store.FileStore()
+    file_paths = iter(file_paths)
+    while True:
+        with run_metrics.phase("scan") as phase:
+            chunk = list(itertools.islice(file_paths, CHUNK_SIZE))
+            phase.item_count += len(chunk)
+        if not chunk:
+            break
+        file_count += len(chunk)
+        with run_metrics.phase("parse") as phase:
+            if parsed:
+                tagged_files = [
+                    tagged_file
+                    for tagged_file in (
+                        filtered_tagged_file(file_path, where, parsed_name)
+                        for file_path, parsed_name in chunk
+                    )
+                    if tagged_file is not None
+                ]
+            elif where is None:
+                tagged_files = [TaggedFile(file_path) for file_path in chunk]
+            else:
+                tagged_files = [
+                    tagged_file
+                    for tagged_file in (
+                        filtered_tagged_file(file_path, where) for file_path in chunk
+                    )
+                    if tagged_file is not None
+                ]
+            phase.item_count += len(chunk)
+        with run_metrics.phase("plan") as phase:
+            for tagged_file in tagged_files:
+                update(tagged_file)
+                new_name = tagged_file.new_name
+                if tagged_file.name != new_name:
+                    changed_files.add(tagged_file.path, new_name, tagged_file.tags)
+            phase.item_count += len(tagged_files)
+    return changed_files, file_count
 
 
-def list_files(tagged_files: Set[TaggedFile]) -> None:
-    log.info("Files to change [{}]:".format(len(tagged_files)))
+def list_files(renames: Iterable[rename.Rename]) -> None:
+    """
+    Log a random sample of `renames`, consumed in a single pass in constant
+    memory.
+    """
     files_to_show_count = 10
-    tagged_files_to_show = list(tagged_files)
-    random.shuffle(tagged_files_to_show)
-    tagged_files_to_show = tagged_files_to_show[0:files_to_show_count]
-    for tagged_file in sorted(tagged_files_to_show, key=lambda f: f.path):
-        log.info(" - '{}'".format(tagged_file.path))
-        name = tagged_file.name
-        new_name = tagged_file.new_name
+    renames_to_show, rename_count = util.reservoir_sample(renames, files_to_show_count)
+    log.info("Files to change [{}]:".format(rename_count))
+    for planned_rename in sorted(renames_to_show, key=lambda r: r.path):
+        log.info(" - '{}'".format(planned_rename.path))
+        name = planned_rename.name
+        new_name = planned_rename.new_name
         if new_name != name:
             longest_name = new_name
             if len(name) > len(new_name):
@@ -374,24 +1136,58 @@ def list_files(tagged_files: Set[TaggedFile]) -> None:
                     len(new_name), longest_name_char_len, new_name
                 )
             )
-    if len(tagged_files) > len(tagged_files_to_show):
+    if rename_count > len(renames_to_show):
         log.info(" [...]")
 
 
-def rename_files(tagged_files: Set[TaggedFile]) -> None:
-    renamed_files: Set = set()
-    for tagged_file in tagged_files:
-        try:
-            tagged_file.write()
-        except exception.Error as err:
-            raise exception.Error(
-                "While renaming file {}/{}: [1]."
-                "\n [1]: '{}'".format(
-                    len(renamed_files) + 1, len(tagged_files), util.fmt_err(err)
-                )
+def write_renames_jsonl(file_store: store.FileStore, output_file: TextIO) -> None:
+    """
+    Write every rename of `file_store` to `output_file` as a line of JSON with
+    its path, new path and the names of the added and removed tags, one at a
+    time.
+    """
+    import json
+
+    for index in range(len(file_store)):
+        directory = file_store.directory(index)
+        added_tag_names, removed_tag_names = tag_changes(file_store, index)
+        output_file.write(
+            json.dumps(
+                {
+                    "path": os.path.join(directory, file_store.names[index]),
+                    "new_path": os.path.join(directory, file_store.new_names[index]),
+                    "added_tags": added_tag_names,
+                    "removed_tags": removed_tag_names,
+                }
             )
-        else:
-            renamed_files.add(tagged_file)
+            + "\n"
+        )
+    output_file.flush()
+
+
+def tag_changes(file_store: store.FileStore, index: int) -> Tuple[List[str], List[str]]:
+    """
+    The sorted names of the tags added to and removed from the file at `index`
+    of `file_store`.
+    """
+    tag_names = set(parse_file_name(file_store.names[index])[1])
+    new_tag_names = {tag.name for tag in file_store.file_tags(index)}
+    return sorted(new_tag_names - tag_names), sorted(tag_names - new_tag_names)
+
+
+def rename_files(
+    tagged_files: Iterable[TaggedFile], jobs: int = rename.DEFAULT_JOBS
+) -> None:
+    execute_plan(
+        plan.plan_renames(tagged_file.planned_rename() for tagged_file in tagged_files),
+        jobs=jobs,
+    )
+
+
+def execute_plan(rename_plan: plan.RenamePlan, jobs: int = rename.DEFAULT_JOBS) -> None:
+    rename.rename_all(
+        rename_plan.independent, jobs=jobs, sequences=rename_plan.sequences
+    )
 
 
 if __name__ == "__main__":
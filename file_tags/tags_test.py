@@ -1,5 +1,18 @@
+import contextlib
+import io
+import itertools
+import json
+import os
+import pickle
+import random
+import re
+import subprocess
+import sys
+
 import pytest
 
+from file_tags import bench
+from file_tags import store
 from file_tags import tags as tagger
 from file_tags import exception, util
 
@@ -239,3 +252,343 @@ def test_tagged_file_actions():
     tagged_file = tagger.TaggedFile(path_in)
     tagged_file.remove_tag(tagger.Tag("sdfjidjfsdifsidfisjf"))
     assert tagged_file.new_path == util.normalize_path(path_out)
+
+
+def test_tagged_file_new_name_memoization():
+    tagged_file = tagger.TaggedFile("a {}b.jpg".format(tagger.TAG_START_CHAR))
+    new_name = tagged_file.new_name
+    assert tagged_file.new_name is new_name
+
+    # Tag changes make the name stale, no-op changes don't.
+    tagged_file.add_tag(tagger.Tag("b"))
+    assert tagged_file.new_name is new_name
+    tagged_file.add_tag(tagger.Tag("c"))
+    assert tagged_file.new_name == "a #b #c.jpg"
+    tagged_file.remove_tag(tagger.Tag("b"))
+    tagged_file.remove_tag(tagger.Tag("d"))
+    assert tagged_file.new_name == "a #c.jpg"
+    assert tagged_file.new_path == util.normalize_path("a #c.jpg")
+
+
+def test_tag_ordering():
+    tags = [tagger.Tag(name) for name in ("b", "a2", "a", "c")]
+    assert [tag.name for tag in sorted(tags)] == ["a", "a2", "b", "c"]
+    assert tagger.Tag("a") < tagger.Tag("b") <= tagger.Tag("b")
+    assert tagger.Tag("b") > tagger.Tag("a")
+    assert not tagger.Tag("b") > tagger.Tag("b")
+
+
+def test_tag_expression():
+    expression = tagger.TagExpression.compile(" +final, -draft,~Old=new ")
+    assert str(expression) == "+final,-draft,~Old=new"
+    assert expression.tags() == {
+        tagger.Tag(name) for name in ("final", "draft", "Old", "new")
+    }
+
+    tagged_file = tagger.TaggedFile(
+        "a {0}draft {0}Old.jpg".format(tagger.TAG_START_CHAR)
+    )
+    expression.apply(tagged_file)
+    assert tagged_file.new_name == "a #final #new.jpg"
+    # Replacing only applies to files having the tag.
+    tagged_file = tagger.TaggedFile("b.jpg")
+    expression.apply(tagged_file)
+    assert tagged_file.new_name == "b #final.jpg"
+
+    for invalid_expression in ("final", "+", "~old", "+a,,-b", "~old=#"):
+        with pytest.raises(exception.Error):
+            tagger.TagExpression.compile(invalid_expression)
+
+
+def test_tag_expression_command_line(tmp_path):
+    path = tmp_path / "a {0}draft {0}old.jpg".format(tagger.TAG_START_CHAR)
+    path.touch()
+    config = tagger.Config.from_command_line_args(
+        ["edit", "--", "-draft,+final,~old=new", str(path)]
+    )
+    assert str(config.expression) == "-draft,+final,~old=new"
+    tagger.main(config)
+    assert os.listdir(str(tmp_path)) == ["a #final #new.jpg"]
+
+
+def test_command_line_options_between_paths(tmp_path, monkeypatch):
+    paths = [str(tmp_path / name) for name in ("a.jpg", "b.jpg", "c.jpg")]
+    for path in paths:
+        with open(path, "w"):
+            pass
+
+    config = tagger.Config.from_command_line_args(
+        ["add", "y", paths[0], "-n", paths[1], "-j", "2", paths[2]]
+    )
+    assert config.no_action and config.jobs == 2
+    assert list(config.file_paths) == paths
+
+    # Paths given both as arguments and on stdin are handled once.
+    monkeypatch.setattr(
+        sys,
+        "stdin",
+        io.TextIOWrapper(io.BytesIO("\n".join(paths[1:] + [paths[0]]).encode())),
+    )
+    config = tagger.Config.from_command_line_args(
+        ["add", "y", "--from-stdin", paths[0], paths[1]]
+    )
+    tagger.main(config)
+    assert sorted(os.listdir(str(tmp_path))) == ["a #y.jpg", "b #y.jpg", "c #y.jpg"]
+
+
+def test_stats_option_before_paths(tmp_path, capsys, make_tree):
+    paths = make_tree(tmp_path / "tree", ["a.jpg", "b.jpg"])
+    stats_path = str(tmp_path / "stats.json")
+
+    # The paths following --stats are handled, not taken as its file.
+    tagger.run_command(["add", "y", "--stats"] + paths)
+    assert "rename" in json.loads(capsys.readouterr().err)["phases"]
+    paths = [str(tmp_path / "tree" / name) for name in ("a #y.jpg", "b #y.jpg")]
+    tagger.run_command(["add", "z", "--stats-file", stats_path] + paths)
+    with open(stats_path) as stats_file:
+        assert "rename" in json.load(stats_file)["phases"]
+    assert sorted(os.listdir(str(tmp_path / "tree"))) == ["a #y #z.jpg", "b #y #z.jpg"]
+
+
+def test_processes_option_before_paths(tmp_path, make_tree):
+    paths = make_tree(tmp_path, ["a.jpg", "b.jpg"])
+    config = tagger.Config.from_command_line_args(["add", "y", "-P", "0"] + paths)
+    assert config.processes == 0
+    tagger.main(config)
+    assert sorted(os.listdir(str(tmp_path))) == ["a #y.jpg", "b #y.jpg"]
+
+    # N is required, a path isn't taken for it.
+    with pytest.raises(SystemExit):
+        tagger.Config.from_command_line_args(["add", "y", "-P"] + paths)
+
+
+def test_overlapping_recursive_paths(tmp_path, monkeypatch, make_tree):
+    make_tree(tmp_path, ["a.jpg", "sub/b.jpg"])
+    monkeypatch.chdir(str(tmp_path))
+
+    # Each file is renamed once.
+    config = tagger.Config.from_command_line_args(["add", "y", ".", "sub", "-r"])
+    tagger.main(config)
+    assert sorted(os.listdir(".")) == ["a #y.jpg", "sub"]
+    assert os.listdir("sub") == ["b #y.jpg"]
+
+
+def test_tag_predicate():
+    # Each filter with the equivalent Python.
+    cases = {
+        "2019": lambda tags: "2019" in tags,
+        "2019 and not keep": lambda tags: "2019" in tags and "keep" not in tags,
+        "#2019 & !#keep": lambda tags: "2019" in tags and "keep" not in tags,
+        "keep or draft": lambda tags: "keep" in tags or "draft" in tags,
+        "not (keep | draft)": lambda tags: not ("keep" in tags or "draft" in tags),
+        "2019 and (x or not keep)": lambda tags: "2019" in tags
+        and ("x" in tags or "keep" not in tags),
+        "!2019 or keep and draft": lambda tags: "2019" not in tags
+        or ("keep" in tags and "draft" in tags),
+        "not not (x and not (keep or not draft))": lambda tags: "x" in tags
+        and "keep" not in tags
+        and "draft" in tags,
+        # Operators are case insensitive, tags aren't; tags are normalized.
+        "NOT Keep": lambda tags: "Keep" not in tags,
+        "#and or tag_with": lambda tags: "and" in tags or "tag-with" in tags,
+    }
+    tag_sets = [
+        set(names)
+        for size in range(4)
+        for names in itertools.combinations(
+            ["2019", "keep", "Keep", "draft", "x", "and", "tag-with"], size
+        )
+    ]
+    for source, expected in cases.items():
+        predicate = tagger.TagPredicate(source)
+        assert [predicate.matches(tag_set) for tag_set in tag_sets] == [
+            expected(tag_set) for tag_set in tag_sets
+        ], source
+        assert pickle.loads(pickle.dumps(predicate)).matches(["2019"]) == (
+            predicate.matches(["2019"])
+        )
+
+    for invalid_source in ("", "a and", "(a", "a)", "a or or b", "not", "a b", "#"):
+        with pytest.raises(exception.Error, match="While parsing tag filter"):
+            tagger.TagPredicate(invalid_source)
+
+
+def test_tag_predicate_command_line(tmp_path):
+    for name in ("a #2019.jpg", "b #2019 #keep.jpg", "c #2020.jpg", "d.jpg"):
+        (tmp_path / name).touch()
+    paths = sorted(str(path) for path in tmp_path.iterdir())
+    expected = ["a #2019 #archived.jpg", "b #2019 #keep.jpg", "c #2020.jpg", "d.jpg"]
+
+    config = tagger.Config.from_command_line_args(
+        ["--where", "2019 and not keep", "add", "archived"] + paths
+    )
+    changed_files, file_count = tagger.collect_changes(
+        config.file_paths, config.expression.apply, where=config.where
+    )
+    assert file_count == 4
+    assert [
+        planned_rename.new_name for planned_rename in changed_files.planned_renames()
+    ] == ["a #2019 #archived.jpg"]
+    tagger.main(config)
+    assert sorted(os.listdir(str(tmp_path))) == expected
+
+
+def test_parse_file_name():
+    file_names = [
+        "",
+        "justfilename",
+        "justfilename.ext",
+        "random{0}faketag.jpg".format(tagger.TAG_START_CHAR),
+        "{0}tag justfilename {0}tag".format(tagger.TAG_START_CHAR),
+        "text    {0}tag     text".format(tagger.TAG_START_CHAR),
+        "sfd {0}tag1 ran{0}do{0}{0}m {0}Tag2 {0}tag3 {0}{0}d  {0}tag4 .jpg".format(
+            tagger.TAG_START_CHAR
+        ),
+        "a {0}- {0}tag--with---dashes- {0}x.jpg".format(tagger.TAG_START_CHAR),
+    ]
+    for file_name in file_names:
+        tagless_name, tag_names = tagger.parse_file_name(file_name)
+        # Must agree with separately substituting and finding the tags.
+        assert tagless_name == re.sub(tagger.TAG_REGEX, "", file_name).strip()
+        expected_tags = set()
+        for tag_name in re.findall(tagger.TAG_REGEX, file_name):
+            with contextlib.suppress(exception.Error):
+                expected_tags.add(tagger.Tag(tag_name))
+        assert {tagger.Tag(name) for name in tag_names} == expected_tags
+
+    assert tagger.parse_file_name(
+        "Picture {0}b 002 {0}a.jpg".format(tagger.TAG_START_CHAR)
+    ) == ("Picture 002.jpg", ["b", "a"])
+    # Tags that normalize to nothing are dropped.
+    file_name = "a {0}- {0}x".format(tagger.TAG_START_CHAR)
+    assert tagger.parse_file_name(file_name) == ("a", ["x"])
+
+    assert tagger.parse_file_names(file_names) == [
+        tagger.parse_file_name(file_name) for file_name in file_names
+    ]
+    # With more raw tag names than are kept between batches, seen or not.
+    file_names = list(bench.generate_file_names(2_000)) + [
+        "{1} {0}--{1} {0}X_y{1}.jpg".format(tagger.TAG_START_CHAR, i)
+        for i in range(tagger.TAG_INTERN_CACHE_SIZE)
+    ]
+    expected = [tagger.parse_file_name(file_name) for file_name in file_names]
+    for _ in range(2):
+        assert tagger.parse_file_names(file_names) == expected
+
+
+def test_intern_tag():
+    tag = tagger.intern_tag("some_tag")
+    assert tag == tagger.Tag("some_tag")
+    assert tagger.intern_tag("some_tag") is tag
+
+    # Files sharing a tag share the tag object.
+    tagged_file_1 = tagger.TaggedFile("a {0}shared".format(tagger.TAG_START_CHAR))
+    tagged_file_2 = tagger.TaggedFile("b {0}shared".format(tagger.TAG_START_CHAR))
+    assert next(iter(tagged_file_1.tags)) is next(iter(tagged_file_2.tags))
+
+    with pytest.raises(exception.Error):
+        tagger.intern_tag(tagger.TAG_START_CHAR)
+
+    # No per-instance dictionaries.
+    assert not hasattr(tag, "__dict__")
+    assert not hasattr(tagged_file_1, "__dict__")
+
+
+def _reference_normalize_name(name):
+    """
+    `Tag._normalize_name` as it was before switching to translation tables.
+    """
+    normalized_name = name.strip()
+    for common_separator in tagger.COMMON_SEPARATORS:
+        normalized_name = normalized_name.replace(common_separator, tagger.TAG_WORD_SEP)
+    normalized_name = (
+        "".join(
+            char
+            for char in normalized_name
+            if char.isalnum() or char == tagger.TAG_WORD_SEP
+        )
+        .strip(tagger.TAG_WORD_SEP)
+        .strip()
+    )
+    return util.trim_repeating_character(tagger.TAG_WORD_SEP, normalized_name)
+
+
+def test_normalize_tag_names():
+    random_generator = random.Random(0)
+    alphabet = "aZ09_-. \t#+,/\\\0éßΩ٣²½\u200b\u3000"
+    names = [
+        "".join(
+            random_generator.choice(alphabet)
+            for _ in range(random_generator.randrange(12))
+        )
+        for _ in range(20_000)
+    ]
+    expected = [_reference_normalize_name(name) for name in names]
+
+    assert tagger.normalize_tag_names(names) == expected
+    # Without any name containing the batch separator.
+    names_without_nul = [name.replace("\0", "") for name in names]
+    assert tagger.normalize_tag_names(names_without_nul) == [
+        _reference_normalize_name(name) for name in names_without_nul
+    ]
+    for name, expected_name in zip(names, expected):
+        if expected_name:
+            assert tagger.Tag(name).name == expected_name
+        else:
+            with pytest.raises(exception.Error):
+                tagger.Tag(name)
+    assert tagger.normalize_tag_names([]) == []
+
+
+def test_write_renames_jsonl():
+    file_store = store.FileStore()
+    for path, tag_names in (
+        ("a {0}old {0}kept.jpg", ["added", "kept"]),
+        ("b.jpg", ["added"]),
+    ):
+        tagged_file = tagger.TaggedFile(path.format(tagger.TAG_START_CHAR))
+        tagged_file.remove_tag(tagger.Tag("old"))
+        for tag_name in tag_names:
+            tagged_file.add_tag(tagger.Tag(tag_name))
+        file_store.add_tagged_file(tagged_file)
+    output_file = io.StringIO()
+
+    tagger.write_renames_jsonl(file_store, output_file)
+
+    assert [json.loads(line) for line in output_file.getvalue().splitlines()] == [
+        {
+            "path": "a #old #kept.jpg",
+            "new_path": "a #added #kept.jpg",
+            "added_tags": ["added"],
+            "removed_tags": ["old"],
+        },
+        {
+            "path": "b.jpg",
+            "new_path": "b #added.jpg",
+            "added_tags": ["added"],
+            "removed_tags": [],
+        },
+    ]
+
+
+def test_lazy_imports():
+    # Modules only some code paths need mustn't slow down the start-up of others.
+    lazy_modules = [
+        "argparse",
+        "concurrent.futures",
+        "fnmatch",
+        "json",
+        "random",
+        "socket",
+        "sqlite3",
+    ]
+    code = (
+        "import sys; from file_tags import client, tags; "
+        "print(','.join(m for m in {!r} if m in sys.modules))".format(lazy_modules)
+    )
+    output = subprocess.check_output(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(tagger.__file__)),
+        universal_newlines=True,
+    )
+    assert output.strip() == ""
@@ -1,10 +1,12 @@
 # pylint: disable=unused-wildcard-import
 from typing import *
 
-import logging.handlers
+import itertools
+import logging
 import os
+import queue
 import re
-import textwrap
+import threading
 import time
 
 from file_tags import exception
@@ -24,89 +26,297 @@ def validate_paths(paths: List[str]) -> List[str]:
             continue
         out_paths.append(path)
     if err_paths:
-        raise exception.Error(
-            "While validating paths: The following paths don't exist ({}/{}):"
-            "\n{}".format(
-                len(err_paths),
-                len(paths),
-                "\n".join(
-                    " [{}]: '{}'".format(i, path) for i, path in enumerate(err_paths, 1)
-                ),
-            )
-        )
+        raise missing_paths_error(err_paths, len(paths))
     return out_paths
 
 
+def missing_paths_error(missing_paths: List[str], path_count: int) -> exception.Error:
+    return exception.Error(
+        "While validating paths: The following paths don't exist ({}/{}):"
+        "\n{}".format(
+            len(missing_paths),
+            path_count,
+            "\n".join(
+                " [{}]: '{}'".format(i, path) for i, path in enumerate(missing_paths, 1)
+            ),
+        )
+    )
+
+
 def sanitize_file_name(file_name: str) -> str:
     return "".join(char for char in file_name if char.isalnum() or char in "-. ")
 
 
+def read_paths(
+    stream: BinaryIO, separator: bytes = b"\n", block_size: int = 1 << 16
+) -> Iterator[str]:
+    """
+    Lazily yield the `separator` delimited paths read from the binary `stream`,
+    decoded the same way as command line arguments. Empty entries are skipped.
+    """
+    remainder = b""
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        entries = (remainder + block).split(separator)
+        remainder = entries.pop()
+        for entry in entries:
+            if entry:
+                yield os.fsdecode(entry)
+    if remainder:
+        yield os.fsdecode(remainder)
+
+
+def reservoir_sample(items: Iterable, count: int, rng=None) -> Tuple[List, int]:
+    """
+    Pick `count` of `items` uniformly at random in a single pass, holding only
+    the picked ones in memory (Algorithm L). Returns them, in no particular
+    order, and the number of items.
+
+    Random numbers are only drawn for the items that get picked, the runs of
+    skipped ones are consumed and counted without a Python-level loop.
+    """
+    import collections
+    import math
+    import random
+
+    rng = rng or random
+    items = iter(items)
+    sample = list(itertools.islice(items, count))
+    item_count = len(sample)
+    if item_count < count or count == 0:
+        return sample, item_count + sum(1 for _ in items)
+    weight = math.exp(math.log(_random_open(rng)) / count)
+    while True:
+        skip_count = (
+            int(math.log(_random_open(rng)) / math.log1p(-weight))
+            if weight < 1.0
+            else 0
+        )
+        last_skipped = collections.deque(zip(range(skip_count), items), maxlen=1)
+        skipped_count = last_skipped[0][0] + 1 if last_skipped else 0
+        item_count += skipped_count
+        if skipped_count < skip_count:
+            return sample, item_count
+        try:
+            item = next(items)
+        except StopIteration:
+            return sample, item_count
+        item_count += 1
+        sample[rng.randrange(count)] = item
+        weight *= math.exp(math.log(_random_open(rng)) / count)
+
+
+def _random_open(rng) -> float:
+    """
+    Random number in the open interval (0, 1).
+    """
+    while True:
+        number = rng.random()
+        if number:
+            return number
+
+
+# A directory modified this recently can still change within the same mtime
+# tick without its mtime changing, so its mtime only says it's unchanged once
+# it's been still for longer than the coarsest common granularity (2s on FAT).
+MIN_MTIME_AGE_NS = 2_000_000_000
+
+
 def normalize_path(path: str) -> str:
     return os.path.normpath(os.path.abspath(os.path.expanduser(path)))
 
 
-def setup_terminal_logging(logger, level=logging.INFO) -> None:
+def setup_terminal_logging(
+    logger,
+    level=logging.INFO,
+    stream: Optional[TextIO] = None,
+    background: bool = False,
+) -> logging.Handler:
+    """
+    With `background`, the records are formatted and written by a background
+    thread, in batches. Closing the returned handler (done by `logging.shutdown`
+    at exit) writes out the remaining ones.
+    """
     logging.Formatter.converter = time.gmtime
     if os.name == "nt":
-        terminal_handler = AlignedLoggingStreamHandler()
-        terminal_formatter = logging.Formatter(
-            "%(asctime)s %(levelname)s | %(message)s", datefmt="%m-%d %H:%M:%S"
-        )
+        terminal_handler: logging.Handler = AlignedLoggingStreamHandler(stream)
     else:
-        terminal_handler = ColoredLoggingStreamHandler()
-        terminal_formatter = logging.Formatter(
-            "%(asctime)s %(levelname)s %(message)s", datefmt="%m-%d %H:%M:%S"
-        )
-    terminal_handler.setFormatter(terminal_formatter)
+        terminal_handler = ColoredLoggingStreamHandler(stream)
     terminal_handler.setLevel(level)
+    if background:
+        terminal_handler = BackgroundLogHandler(terminal_handler)
     logger.addHandler(terminal_handler)
+    return terminal_handler
+
+
+class PrefixFormatter(logging.Formatter):
+    """
+    Formats records as "<start><time> <level prefix><message>", with the
+    per-level prefixes precomputed and the time formatted once per second.
+    """
+
+    def __init__(
+        self, level_prefixes: Dict[int, str], start: str = "", datefmt: str = ""
+    ) -> None:
+        super().__init__(datefmt=datefmt)
+        self.level_prefixes = level_prefixes
+        self.start = start
+        self._time_second: Optional[int] = None
+        self._time_text = ""
+
+    def format(self, record: logging.LogRecord) -> str:
+        second = int(record.created)
+        if second != self._time_second:
+            self._time_text = self.formatTime(record, self.datefmt)
+            self._time_second = second
+        level_prefix = self.level_prefixes.get(record.levelno)
+        if level_prefix is None:
+            level_prefix = self.level_prefixes[record.levelno] = "{} ".format(
+                record.levelname
+            )
+        text = "{}{} {}{}".format(
+            self.start, self._time_text, level_prefix, record.getMessage()
+        )
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            text = "{}\n{}".format(text, record.exc_text)
+        if record.stack_info:
+            text = "{}\n{}".format(text, self.formatStack(record.stack_info))
+        return text
+
+
+LOG_DATE_FORMAT = "%m-%d %H:%M:%S"
+LEVEL_NAMES = {
+    logging.DEBUG: "DEBUG",
+    logging.INFO: "INFO",
+    logging.WARNING: "WARNING",
+    logging.ERROR: "ERROR",
+    logging.CRITICAL: "CRITICAL",
+}
 
 
 class AlignedLoggingStreamHandler(logging.StreamHandler):
-    def format(self, record):
-        message = logging.StreamHandler.format(self, record)
-        levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-        for level in levels:
-            message = message.replace(level, "{:>8}".format(level), 1)
-        return message
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        super().__init__(stream)
+        self.setFormatter(
+            PrefixFormatter(
+                {
+                    level: "{:>8} | ".format(level_name)
+                    for level, level_name in LEVEL_NAMES.items()
+                },
+                datefmt=LOG_DATE_FORMAT,
+            )
+        )
 
 
 class ColoredLoggingStreamHandler(logging.StreamHandler):
-    def format(self, record):
-        level_colors = [
-            ("DEBUG", 30),
-            ("INFO", 70),
-            ("WARNING", 202),
-            ("ERROR", 196),
-            ("CRITICAL", 198),
-        ]
-        level_shortened = {
-            "DEBUG": "DEB",
-            "INFO": "INFO",
-            "WARNING": "WARN",
-            "ERROR": "ERR",
-            "CRITICAL": "CRIT",
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        super().__init__(stream)
+        level_colors = {
+            logging.DEBUG: ("DEB", 30),
+            logging.INFO: ("INFO", 70),
+            logging.WARNING: ("WARN", 202),
+            logging.ERROR: ("ERR", 196),
+            logging.CRITICAL: ("CRIT", 198),
         }
         clr_template = "\033[38;5;{}m"
-        message = logging.StreamHandler.format(self, record)
-        for level, color in level_colors:
-            message = clr_template.format(247) + message
-            message = message.replace(
-                level,
-                "{clr}{lvl:<4}{after}{reset}".format(
-                    clr=clr_template.format(color),
-                    lvl=level_shortened[level],
-                    after="\033[0m {}|".format(clr_template.format(239)),
-                    reset="\033[0m",
-                ),
-                1,
+        self.setFormatter(
+            PrefixFormatter(
+                {
+                    level: "{clr}{lvl:<4}{after}{reset} ".format(
+                        clr=clr_template.format(color),
+                        lvl=level_shortened,
+                        after="\033[0m {}|".format(clr_template.format(239)),
+                        reset="\033[0m",
+                    )
+                    for level, (level_shortened, color) in level_colors.items()
+                },
+                start=clr_template.format(247),
+                datefmt=LOG_DATE_FORMAT,
             )
-        return message
+        )
+
+
+class BackgroundLogHandler(logging.Handler):
+    """
+    Hands the records over to a background thread through a queue. The thread
+    formats them with `handler` and writes whatever has queued up in one go.
+    """
+
+    # The most records written at a time.
+    BATCH_SIZE = 512
+
+    def __init__(self, handler: logging.StreamHandler) -> None:
+        super().__init__(handler.level)
+        self.handler = handler
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._write_records, name="log-writer", daemon=True
+        )
+        self._thread.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            # The arguments are merged now, they may change after returning.
+            record.msg = record.getMessage()
+            record.args = None
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        self._queue.put(record)
+
+    def flush(self) -> None:
+        """
+        Wait until the records emitted so far are written.
+        """
+        if self._thread.is_alive():
+            written = threading.Event()
+            self._queue.put(written)
+            written.wait()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self.handler.close()
+        super().close()
+
+    def _write_records(self) -> None:
+        stream = self.handler.stream
+        terminator = self.handler.terminator
+        while True:
+            records = [self._queue.get()]
+            while len(records) < self.BATCH_SIZE:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Besides records, the queue holds flush events and None to stop.
+            lines = [
+                self.handler.format(record) + terminator
+                for record in records
+                if isinstance(record, logging.LogRecord)
+            ]
+            try:
+                stream.write("".join(lines))
+                stream.flush()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            for record in records:
+                if isinstance(record, threading.Event):
+                    record.set()
+            if any(record is None for record in records):
+                return
 
 
 def fmt_err(err) -> str:
     basic_fmt = "[{err}] {msg}".format(err=err.__class__.__qualname__, msg=err)
     if isinstance(err, exception.Error):
+        import textwrap
+
         return textwrap.indent(basic_fmt, prefix=" " * 6).strip()
     return basic_fmt
 
@@ -119,6 +329,24 @@ def get_file_name_no_extension(file_path: str) -> str:
     return os.path.basename(os.path.splitext(file_path)[0])
 
 
+def tagged_file_name(tagless_name: str, tag_values: Iterable[str]) -> str:
+    """
+    Put the sorted `tag_values` at the end of `tagless_name`, before the extension.
+
+    Examples:
+        f("Picture 002.jpg", ["#b", "#a"]) -> "Picture 002 #a #b.jpg"
+    """
+    tags = " ".join(sorted(tag_values))
+    name = "{name}{tags}".format(
+        name=get_file_name_no_extension(tagless_name),
+        tags=" {}".format(tags) if tags else "",
+    ).strip()
+    extension = get_file_extension(tagless_name)
+    return "{name}{ext}".format(
+        name=name, ext=".{}".format(extension) if extension else ""
+    ).strip()
+
+
 def trim_repeating_whitespace(text: str) -> str:
     """
     Remove consecutive repeats of whitespace from `text`.
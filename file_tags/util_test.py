@@ -1,3 +1,8 @@
+import collections
+import io
+import logging
+import random
+
 import pytest
 
 from file_tags import util
@@ -38,3 +43,77 @@ def test_trim_repeating_whitespace():
     assert util.trim_repeating_whitespace("\t") == "\t"
     assert util.trim_repeating_whitespace("\t\t") == "\t"
     assert util.trim_repeating_whitespace("\t" * ARBITRARY_LARGE_NUMBER) == "\t"
+
+
+def test_read_paths():
+    def read_paths(data, **kwargs):
+        return list(util.read_paths(io.BytesIO(data), **kwargs))
+
+    assert read_paths(b"") == []
+    assert read_paths(b"a\nb c\n\n/d/e") == ["a", "b c", "/d/e"]
+    assert read_paths(b"a\nb\n", separator=b"\0") == ["a\nb\n"]
+    assert read_paths(b"a\nb\0c\0", separator=b"\0") == ["a\nb", "c"]
+    # Entries spanning read blocks.
+    assert read_paths(b"abc\ndefgh\ni", block_size=2) == ["abc", "defgh", "i"]
+
+
+def test_reservoir_sample():
+    rng = random.Random(0)
+    assert util.reservoir_sample(range(3), 5, rng) == ([0, 1, 2], 3)
+    assert util.reservoir_sample(iter(range(3)), 0, rng) == ([], 3)
+
+    pick_counts = collections.Counter()
+    for _ in range(3000):
+        sample, item_count = util.reservoir_sample(iter(range(20)), 4, rng)
+        assert item_count == 20
+        assert len(set(sample)) == 4
+        pick_counts.update(sample)
+    # Each item is expected to be picked 600 times.
+    assert set(pick_counts) == set(range(20))
+    assert all(500 < pick_count < 700 for pick_count in pick_counts.values())
+
+
+def make_logger(name, stream, **kwargs):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    handler = util.setup_terminal_logging(logger, stream=stream, **kwargs)
+    return logger, handler
+
+
+def test_terminal_logging():
+    stream = io.StringIO()
+    logger, handler = make_logger("test_terminal_logging", stream)
+    logger.info("a %s", "message")
+    logger.warning("mentions ERROR")
+    logger.debug("filtered out")
+    logger.removeHandler(handler)
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 2
+    assert lines[0].endswith("|\033[0m a message")
+    assert "INFO" in lines[0]
+    # Only the level prefix is colored, not level names in the message.
+    assert lines[1].count("\033[") == 5
+    assert lines[1].endswith(" mentions ERROR")
+
+
+def test_background_logging():
+    stream = io.StringIO()
+    logger, handler = make_logger("test_background_logging", stream, background=True)
+    values = []
+    for i in range(1000):
+        values.append(i)
+        # Arguments are merged when logging, not when writing.
+        logger.info("%s", values)
+        values = [i]
+    handler.flush()
+    assert len(stream.getvalue().splitlines()) == 1000
+    logger.error("last")
+    logger.removeHandler(handler)
+    handler.close()
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1001
+    assert lines[1].endswith(" [0, 1]")
+    assert lines[-1].endswith(" last")
@@ -0,0 +1,114 @@
+# pylint: disable=unused-wildcard-import
+from typing import *
+
+import os
+import re
+
+from file_tags import util
+
+
+def walk_paths(
+    paths: Iterable[str],
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    max_depth: Optional[int] = None,
+) -> Iterator[str]:
+    """
+    Lazily yield the files found under each of `paths`.
+
+    Paths that are files are yielded as they are, directories are walked
+    recursively via `os.scandir`. Only the currently open directory iterators are
+    held in memory, so memory use is bound by the tree depth, not its size.
+
+    `include` and `exclude` are glob patterns matched against entry names. A file
+    is yielded when it matches any of `include` (or `include` is empty) and none
+    of `exclude`. Excluded directories are not descended into. A `max_depth` of 0
+    only yields the files directly inside each directory in `paths`.
+
+    Each file is yielded once, also when `paths` overlap: see `split_roots`.
+    """
+    include_match = compile_globs(include)
+    exclude_match = compile_globs(exclude)
+    roots, nested_roots = split_roots(paths)
+    for path in roots:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        yield from _walk_directory(
+            path, include_match, exclude_match, max_depth, nested_roots
+        )
+
+
+def split_roots(paths: Iterable[str]) -> Tuple[List[str], Set[str]]:
+    """
+    The normalized `paths` without the repeated ones, and the ones among them
+    that are inside another directory of `paths`.
+
+    The nested roots are walked on their own, with their own depth limit, so
+    they're skipped when walking the directories they're in.
+    """
+    roots = list(dict.fromkeys(map(util.normalize_path, paths)))
+    directories = {path for path in roots if os.path.isdir(path)}
+    nested_roots = set()
+    if directories and len(roots) > 1:
+        for path in roots:
+            child, parent = path, os.path.dirname(path)
+            while parent != child:
+                if parent in directories:
+                    nested_roots.add(path)
+                    break
+                child, parent = parent, os.path.dirname(parent)
+    return roots, nested_roots
+
+
+def _walk_directory(
+    root: str,
+    include_match: Optional[Callable],
+    exclude_match: Optional[Callable],
+    max_depth: Optional[int],
+    nested_roots: Set[str],
+) -> Iterator[str]:
+    stack = [(os.scandir(root), 0)]
+    try:
+        while stack:
+            entries, depth = stack[-1]
+            for entry in entries:
+                name = entry.name
+                if exclude_match and exclude_match(name):
+                    continue
+                if nested_roots and entry.path in nested_roots:
+                    continue
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if max_depth is not None and depth >= max_depth:
+                        continue
+                    try:
+                        stack.append((os.scandir(entry.path), depth + 1))
+                    except OSError:
+                        continue
+                    break
+                if include_match and not include_match(name):
+                    continue
+                yield entry.path
+            else:
+                stack.pop()[0].close()
+    finally:
+        for entries, _ in stack:
+            entries.close()
+
+
+def compile_globs(patterns: Sequence[str]) -> Optional[Callable]:
+    """
+    A function matching names against any of the glob `patterns`, or None when
+    there are no patterns.
+    """
+    if not patterns:
+        return None
+    import fnmatch
+
+    return re.compile(
+        "|".join("(?:{})".format(fnmatch.translate(pattern)) for pattern in patterns)
+    ).match
@@ -0,0 +1,91 @@
+import os
+
+from file_tags import walk
+
+
+def relative_walk(root, **kwargs):
+    return sorted(
+        os.path.relpath(path, str(root))
+        for path in walk.walk_paths([str(root)], **kwargs)
+    )
+
+
+def test_walk_paths(tmp_path, make_tree):
+    make_tree(tmp_path, ["a.jpg", "b.txt", "x/c.jpg", "x/y/d.jpg", "z/e.txt"])
+
+    assert relative_walk(tmp_path) == [
+        "a.jpg",
+        "b.txt",
+        os.path.join("x", "c.jpg"),
+        os.path.join("x", "y", "d.jpg"),
+        os.path.join("z", "e.txt"),
+    ]
+
+    # Files passed in directly are yielded as they are.
+    file_path = str(tmp_path / "a.jpg")
+    assert list(walk.walk_paths([file_path])) == [file_path]
+
+    # Depth limits.
+    assert relative_walk(tmp_path, max_depth=0) == ["a.jpg", "b.txt"]
+    assert relative_walk(tmp_path, max_depth=1) == [
+        "a.jpg",
+        "b.txt",
+        os.path.join("x", "c.jpg"),
+        os.path.join("z", "e.txt"),
+    ]
+
+    # Globs.
+    assert relative_walk(tmp_path, include=["*.txt"]) == [
+        "b.txt",
+        os.path.join("z", "e.txt"),
+    ]
+    assert relative_walk(tmp_path, include=["*.txt", "a*"]) == [
+        "a.jpg",
+        "b.txt",
+        os.path.join("z", "e.txt"),
+    ]
+    assert relative_walk(tmp_path, exclude=["x"]) == [
+        "a.jpg",
+        "b.txt",
+        os.path.join("z", "e.txt"),
+    ]
+    assert relative_walk(tmp_path, include=["*.jpg"], exclude=["y"]) == [
+        "a.jpg",
+        os.path.join("x", "c.jpg"),
+    ]
+
+
+def test_walk_overlapping_paths(tmp_path, monkeypatch, make_tree):
+    make_tree(tmp_path, ["a.jpg", "x/c.jpg", "x/y/d.jpg", "z/e.txt"])
+    monkeypatch.chdir(str(tmp_path))
+
+    # Each file once, whatever the order and the spelling of the paths.
+    for paths in (
+        [".", "x", "x/y/d.jpg"],
+        ["x/y/", "x/../x", str(tmp_path), "a.jpg"],
+    ):
+        assert sorted(walk.walk_paths(paths)) == sorted(
+            walk.walk_paths([str(tmp_path)])
+        )
+
+    # The nested paths get their own depth limit.
+    assert sorted(
+        os.path.relpath(path) for path in walk.walk_paths([".", "x"], max_depth=0)
+    ) == ["a.jpg", os.path.join("x", "c.jpg")]
+    # Excluded directories are still walked when passed in directly.
+    assert sorted(
+        os.path.relpath(path) for path in walk.walk_paths([".", "x"], exclude=["x"])
+    ) == [
+        "a.jpg",
+        os.path.join("x", "c.jpg"),
+        os.path.join("x", "y", "d.jpg"),
+        os.path.join("z", "e.txt"),
+    ]
+
+
+def test_walk_paths_is_lazy(tmp_path, make_tree):
+    make_tree(tmp_path, ["a", "b", "c"])
+    paths = walk.walk_paths([str(tmp_path)])
+    assert next(paths)
+    # Closing the generator early must release the open directory iterators.
+    paths.close()
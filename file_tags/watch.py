@@ -0,0 +1,289 @@
+"""
+Keep the tag index up to date while files get renamed, created and deleted.
+
+Uses inotify where available, applying each change to the index as it happens.
+Elsewhere, or when the inotify watch limit is reached, falls back to polling:
+refreshing the index periodically, which only rescans directories whose mtime
+changed.
+"""
+
+# pylint: disable=unused-wildcard-import
+from typing import *
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+from file_tags import exception
+from file_tags import index
+from file_tags import util
+
+
+log = logging.getLogger()
+
+DEFAULT_POLL_INTERVAL = 30.0
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Config:
+    def __init__(
+        self, index_path: str, roots: List[str], poll_interval: float, poll: bool
+    ) -> None:
+        self.index_path = index_path
+        self.roots = roots
+        self.poll_interval = poll_interval
+        self.poll = poll
+
+    @classmethod
+    def from_command_line_args(cls, command_line_args: List):
+        parser = argparse.ArgumentParser(
+            prog="watch",
+            formatter_class=argparse.RawTextHelpFormatter,
+            description=__doc__,
+        )
+        parser.add_argument("paths", nargs="+", help="directories to watch")
+        parser.add_argument(
+            "--index",
+            default=index.DEFAULT_INDEX_PATH,
+            help="tag index location (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--poll",
+            action="store_true",
+            help="poll for changes even where inotify is available",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            metavar="SECONDS",
+            type=float,
+            default=DEFAULT_POLL_INTERVAL,
+            help="how often to poll for changes (default: %(default)s)",
+        )
+        parsed = parser.parse_args(command_line_args)
+
+        try:
+            roots = util.validate_paths(parsed.paths)
+        except exception.Error as err:
+            log.error(util.fmt_err(err))
+            sys.exit(1)
+
+        return cls(
+            index_path=parsed.index,
+            roots=roots,
+            poll_interval=parsed.poll_interval,
+            poll=parsed.poll,
+        )
+
+
+class PollingWatcher:
+    def __init__(
+        self,
+        tag_index: index.TagIndex,
+        roots: List[str],
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        self.tag_index = tag_index
+        self.roots = roots
+        self.poll_interval = poll_interval
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        pass
+
+    def poll_once(self, timeout: Optional[float] = None) -> int:
+        """
+        Wait up to `timeout` seconds (the poll interval by default), then bring
+        the index up to date. Returns the number of rescanned directories.
+        """
+        time.sleep(self.poll_interval if timeout is None else timeout)
+        return self.tag_index.refresh(self.roots).scanned_directory_count
+
+    def run(self) -> None:
+        while True:
+            self.poll_once()
+
+
+class InotifyWatcher:
+    """
+    Watches every directory under `roots` and applies each create, delete and
+    rename event directly to the index, re-parsing only the affected names.
+
+    Raises `exception.Error` when inotify is unavailable or the watch limit is
+    reached.
+    """
+
+    def __init__(self, tag_index: index.TagIndex, roots: List[str]) -> None:
+        self.tag_index = tag_index
+        self.roots = roots
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise _inotify_error("initializing inotify")
+        self._paths_by_watch: Dict[int, str] = {}
+        try:
+            for root in roots:
+                self._watch_tree(root)
+        except exception.Error:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def poll_once(self, timeout: Optional[float] = None) -> int:
+        """
+        Wait up to `timeout` seconds (forever by default) for changes and apply
+        them to the index. Returns the number of applied events.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return 0
+        data = os.read(self._fd, 1 << 16)
+        changed_directories = set()
+        event_count = 0
+        offset = 0
+        while offset < len(data):
+            watch, mask, _, name_length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + name_length].rstrip(b"\0"))
+            offset += name_length
+            if mask & IN_Q_OVERFLOW:
+                log.warning("Missed some changes, refreshing the whole index ...")
+                self.tag_index.refresh(self.roots)
+                continue
+            if mask & IN_IGNORED:
+                self._paths_by_watch.pop(watch, None)
+                continue
+            directory = self._paths_by_watch.get(watch)
+            if directory is None or not name:
+                continue
+            event_count += 1
+            self._apply(os.path.join(directory, name), mask)
+            changed_directories.add(directory)
+        for directory in changed_directories:
+            self.tag_index.touch_directory(directory)
+        return event_count
+
+    def run(self) -> None:
+        while True:
+            self.poll_once()
+
+    def _apply(self, path: str, mask: int) -> None:
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            self.tag_index.remove_path(path)
+        elif mask & (IN_CREATE | IN_MOVED_TO):
+            if mask & IN_ISDIR:
+                self._watch_tree(path)
+                self.tag_index.update_directory(path)
+            else:
+                self.tag_index.update_file(path)
+
+    def _watch_tree(self, root: str) -> None:
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            watch = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(path), WATCH_MASK
+            )
+            if watch < 0:
+                if ctypes.get_errno() in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    continue
+                raise _inotify_error("watching '{}'".format(path))
+            self._paths_by_watch[watch] = path
+            try:
+                with os.scandir(path) as entries:
+                    stack.extend(
+                        entry.path
+                        for entry in entries
+                        if entry.is_dir(follow_symlinks=False)
+                    )
+            except OSError:
+                continue
+
+
+def _load_libc():
+    library_name = ctypes.util.find_library("c")
+    try:
+        libc = ctypes.CDLL(library_name, use_errno=True)
+        # Looking the functions up fails where they don't exist.
+        libc.inotify_init1  # pylint: disable=pointless-statement
+        libc.inotify_add_watch  # pylint: disable=pointless-statement
+    except (OSError, AttributeError) as err:
+        raise exception.Error(
+            "While loading inotify: [1]." "\n [1]: '{}'".format(util.fmt_err(err))
+        )
+    return libc
+
+
+def _inotify_error(doing: str) -> exception.Error:
+    errno_value = ctypes.get_errno()
+    return exception.Error(
+        "While {}: [1]." "\n [1]: '{}'".format(doing, os.strerror(errno_value))
+    )
+
+
+def create_watcher(
+    tag_index: index.TagIndex,
+    roots: List[str],
+    poll: bool = False,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+) -> Union[InotifyWatcher, PollingWatcher]:
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(tag_index, roots)
+        except exception.Error as err:
+            log.warning(util.fmt_err(err))
+            log.warning("Falling back to polling for changes ...")
+    return PollingWatcher(tag_index, roots, poll_interval)
+
+
+def main(config: Config) -> None:
+    with index.TagIndex(config.index_path) as tag_index:
+        # Watching first, so that the changes made while refreshing are picked
+        # up afterwards, like for new directories in `InotifyWatcher._apply`.
+        with create_watcher(
+            tag_index, config.roots, config.poll, config.poll_interval
+        ) as watcher:
+            result = tag_index.refresh(config.roots)
+            log.info(
+                "Index refreshed: {} directories scanned, {} unchanged".format(
+                    result.scanned_directory_count, result.skipped_directory_count
+                )
+            )
+            log.info(
+                "Watching {} for changes ({}) ...".format(
+                    ", ".join("'{}'".format(root) for root in config.roots),
+                    "inotify" if isinstance(watcher, InotifyWatcher) else "polling",
+                )
+            )
+            watcher.run()
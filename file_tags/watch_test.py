@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pytest
+
+from file_tags import index
+from file_tags import tags as tagger
+from file_tags import watch
+
+
+def query(tag_index, tag_name):
+    return sorted(os.path.basename(path) for path in tag_index.query([tag_name]))
+
+
+def tagged(name, tag_name):
+    return "{} {}{}".format(name, tagger.TAG_START_CHAR, tag_name)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="needs inotify")
+def test_inotify_watcher(tmp_path):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    (tree / "a").touch()
+    with index.TagIndex(str(tmp_path / "index.sqlite3")) as tag_index:
+        tag_index.refresh([str(tree)])
+        with watch.InotifyWatcher(tag_index, [str(tree)]) as watcher:
+            os.rename(str(tree / "a"), str(tree / tagged("a", "x")))
+            while watcher.poll_once(timeout=0.2):
+                pass
+            assert query(tag_index, "x") == [tagged("a", "x")]
+
+            (tree / "sub").mkdir()
+            (tree / "sub" / tagged("b", "x")).touch()
+            while watcher.poll_once(timeout=0.2):
+                pass
+            assert query(tag_index, "x") == [tagged("a", "x"), tagged("b", "x")]
+
+            # Files in the new directory are watched too.
+            (tree / "sub" / tagged("c", "x")).touch()
+            os.remove(str(tree / tagged("a", "x")))
+            while watcher.poll_once(timeout=0.2):
+                pass
+            assert query(tag_index, "x") == [tagged("b", "x"), tagged("c", "x")]
+
+        # The applied changes are recorded, nothing is left to rescan.
+        assert tag_index.refresh([str(tree)]).scanned_directory_count == 0
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="needs inotify")
+def test_main_changes_during_initial_refresh(tmp_path, monkeypatch):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    refresh = index.TagIndex.refresh
+
+    def refresh_then_change(tag_index, roots):
+        result = refresh(tag_index, roots)
+        (tree / tagged("a", "x")).touch()
+        return result
+
+    def run_once(watcher):
+        while watcher.poll_once(timeout=0.2):
+            pass
+
+    monkeypatch.setattr(index.TagIndex, "refresh", refresh_then_change)
+    monkeypatch.setattr(watch.InotifyWatcher, "run", run_once)
+    index_path = str(tmp_path / "index.sqlite3")
+    watch.main(watch.Config(index_path, [str(tree)], poll_interval=1, poll=False))
+
+    with index.TagIndex(index_path) as tag_index:
+        assert query(tag_index, "x") == [tagged("a", "x")]
+
+
+def test_polling_watcher(tmp_path):
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    with index.TagIndex(str(tmp_path / "index.sqlite3")) as tag_index:
+        tag_index.refresh([str(tree)])
+        with watch.PollingWatcher(tag_index, [str(tree)]) as watcher:
+            (tree / tagged("a", "x")).touch()
+            os.utime(str(tree), ns=(1, 1))
+            assert watcher.poll_once(timeout=0) == 1
+            assert query(tag_index, "x") == [tagged("a", "x")]